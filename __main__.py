@@ -1,111 +1,135 @@
-from lib.experiment_with_shuffling import experiment_with_shuffling
-from lib.factor_returns import FactorReturns
-from lib.investment_returns import InvestmentReturns
-from lib.investments import Investments
-# Pandas to read csv file and other things
-import pandas as pd
-# To prepare design matrices using R-like formulas
-from patsy import dmatrices
-# Statsmodels to run our multiple regression model
-import statsmodels.api as sm
-
-FIVE_FACTOR_FORMULA = """
-port_excess ~ market_minus_risk_free + small_minus_big + high_minus_low + robust_minus_weak + conservative_minus_aggressive
-"""
-
-if __name__ == '__main__':
-    # market_type = 'US'
-    # market_type = 'Developed ex US'
-    market_type = 'Emerging'
-
-    # Get the French-Fama Data
-    ff_data = FactorReturns.fetch(market_type)
-    ff_starts_at = ff_data.occurred_at.min()
-    ff_ends_at = ff_data.occurred_at.max()
-
-    # Get the investments to study
-    # Investments().backfill_facts(market_type)
-    print(f'Looking for investment returns through {ff_ends_at}')
-    investments = Investments().query.for_analysis(market_type, ff_ends_at)
-    print(f'Found {len(list(investments))} investments of market type {market_type}')
-    # for investment in investments:
-    #     try:
-    #         InvestmentReturns.backfill_returns(investment.ticker_symbol, ff_starts_at, ff_ends_at)
-    #     except KeyError as e:
-    #         print(f'Skipping {investment.ticker_symbol} due to lack of Yahoo API response')
-
-    results = {}
-    for investment in investments:
-        ticker_symbol = investment.ticker_symbol
-        # print(f'Analyzing {ticker_symbol}')
-        # Get the returns of the investment
-        ticker_data = InvestmentReturns.fetch(ticker_symbol, ff_starts_at, ff_ends_at)
-        if len(ticker_data) < 12:
-            print(f'Less than 12 months of data, skipping {ticker_symbol}!')
-            continue
-
-        # Join the FF and investment returns data
-        all_data = pd.merge(ticker_data, ff_data, on='occurred_at')
-        all_data['port_excess'] = all_data.percentage_change - all_data.risk_free
-
-        # Run OLS regression
-        endogenous, exogenous = dmatrices(FIVE_FACTOR_FORMULA, data=all_data, return_type='dataframe')
-        results[ticker_symbol] = sm.OLS(endogenous, exogenous).fit()
-
-    dfs = []
-    for ticker, result in results.items():
-        df = pd.DataFrame({ 'coef': result.params, 'tvalue': result.tvalues, 'pvalue': result.pvalues })
-        df['factor'] = df.index
-        df['ticker'] = ticker
-        df.set_index(['ticker'])
-        dfs.append(df)
-
-    df = pd.concat(dfs)
-    # df = pd.merge(df, investments.to_data_frame(), on='ticker')
-
-    # Remove inverse funds
-    inversed = df[(df.coef <= 0) & (df.factor == 'market_minus_risk_free')]
-    df = df[~df.ticker.isin(inversed.ticker)]
-    # Remove leveraged funds
-    leveraged = df[(df.coef >= 2) & (df.factor == 'market_minus_risk_free')]
-    df = df[~df.ticker.isin(leveraged.ticker)]
-    # Exclude 'Intercept' because it almost always very close to zero
-    df = df[~df.factor.isin(['Intercept'])]
-    # Exclude 'market_minus_risk_free' because it usually close to one
-    # df = df[~df.factor.isin(['market_minus_risk_free'])]
-
-    # Exclude statistically insignificant results
-    df = df[df.pvalue <= 0.05]
-
-    renamed = {
-        'market_minus_risk_free': 'mmrf',
-        'small_minus_big': 'smb',
-        'high_minus_low': 'hml',
-        'robust_minus_weak': 'rmw',
-        'conservative_minus_aggressive': 'cma'}
-    df = df[['ticker', 'factor', 'coef']].\
-        pivot(index='ticker', columns='factor', values='coef').\
-        rename(columns=renamed)
-    df = df.reset_index() # Make index integers rather than ticker
-
-    investments_df = investments.to_data_frame()[['ticker', 'expense_ratio', 'dividend_yield']]
-    investments_df = investments_df.fillna(0)
-    # Throw out funds missing their expense ratio
-    investments_df = investments_df[investments_df.expense_ratio > 0]
-
-    df = df.merge(investments_df, on='ticker')
-
-    # Replacing all NaNs with zero. This isn't perfect because:
-    # * Factors with just barely insignificant p-values will be zero, when in
-    #   fact they might be negative.
-    # * Dividend yield that are missing in the API will appear as zero.
-    df = df.fillna(0)
-
-    # Reorder columns
-    df = df.filter(['ticker', 'mmrf', 'smb', 'hml', 'rmw', 'cma', 'expense_ratio', 'dividend_yield'])
-
+import argparse
+from lib.market_types import MARKET_TYPES
+from os import environ
+
+# Each command imports just what it needs, when it runs, so that e.g.
+# `python . refresh` doesn't wait for the solver, plotting and Yahoo libraries
+
+def analyze(args):
+    from lib import pipeline
+    funds_df, results_df = pipeline.analyze_all(
+        args.market_types or MARKET_TYPES,
+        iterations=args.iterations,
+        workers=args.workers,
+        seed=args.seed,
+        refresh=args.refresh,
+        cache=args.cache,
+        batched=not args.per_sample,
+        bootstrap=args.bootstrap,
+        trace_memory=bool(environ.get('TRACE_MEMORY'))
+    )
     # print('Consider catching a debugger here to play with the data frames')
     # print('Write "import pdb; pdb.set_trace()" and run "python ."')
-    # print(df.head())
+    # print(funds_df.head())
+    if args.output:
+        results_df.to_csv(args.output, index=False)
+        print(f'Wrote the results of {results_df.market_type.nunique()} market types to {args.output}')
+
+def models(args):
+    from lib import pipeline
+    df = pipeline.compare_models(args.market_types or MARKET_TYPES)
+    if args.output:
+        df.to_csv(args.output, index=False)
+        print(f'Wrote the models of {df.market_type.nunique()} market types side by side to {args.output}')
+
+def rolling(args):
+    from lib import pipeline
+    df = pipeline.fit_rolling_loadings(
+        args.market_types or MARKET_TYPES,
+        window=args.window,
+        step=args.step,
+        min_observations=args.min_observations
+    )
+    if args.output:
+        df.to_csv(args.output, index=False)
+        print(f'Wrote the rolling loadings of {df.market_type.nunique()} market types to {args.output}')
+
+def frontier(args):
+    from lib import pipeline
+    df = pipeline.trace_frontiers(args.market_types or MARKET_TYPES, points=args.points, cache=args.cache, bootstrap=args.bootstrap)
+    if args.output:
+        df.to_csv(args.output, index=False)
+        print(f'Wrote the efficient frontiers of {df.market_type.nunique()} market types to {args.output}')
+
+def refresh(args):
+    from lib.factor_returns import FactorReturns
+    for market_type_name, count in FactorReturns.refresh(changed_only=not args.all).items():
+        print(f'Wrote {count} months of {market_type_name} factor returns')
+
+def backfill(args):
+    from lib.factor_returns import FactorReturns
+    from lib.investments import Investments
+    from lib.returns_backfiller import ReturnsBackfiller
+    for market_type_name in args.market_types or MARKET_TYPES:
+        factor_data = FactorReturns.fetch_snapshot(market_type_name)
+        Investments().backfill_facts(market_type_name)
+        investments_df = Investments().query.for_analysis(market_type_name, factor_data.index.max()).to_data_frame()
+        ReturnsBackfiller().run(investments_df.ticker, factor_data.index.min(), factor_data.index.max())
+
+# The subcommands of `python .`, by name
+COMMANDS = {
+    'analyze': analyze,
+    'models': models,
+    'rolling': rolling,
+    'frontier': frontier,
+    'refresh': refresh,
+    'backfill': backfill
+}
 
-    experiment_with_shuffling(df, market_type)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python .', description='Finds the funds with the best exposure to the Fama French factors')
+    subparsers = parser.add_subparsers(dest='command')
+
+    analyze_parser = subparsers.add_parser('analyze', help='Run the pipeline of each market type, in parallel (the default)')
+    analyze_parser.add_argument('market_types', nargs='*', metavar='market_type', help=f'Any of {", ".join(MARKET_TYPES)}, defaulting to all of them')
+    analyze_parser.add_argument('--iterations', type=int, default=100, help='The count of samples for experiment_with_shuffling')
+    analyze_parser.add_argument('--workers', type=int, default=None, help='The count of processes to use, defaulting to the CPU count')
+    analyze_parser.add_argument('--seed', type=int, default=0)
+    analyze_parser.add_argument('--refresh', action='store_true', help='Re-download the factor returns that have changed first')
+    analyze_parser.add_argument('--cache', action='store_true', help='Reuse the cached regressions of the funds whose data hasn\'t changed, rather than refit every fund')
+    analyze_parser.add_argument('--per-sample', action='store_true', help='Solve each sample with its own solver call, spread across the workers, rather than all of them at once')
+    analyze_parser.add_argument('--bootstrap', type=int, default=0, metavar='REPLICATES', help='Screen the loadings by the 95%% confidence intervals of this many block bootstrap replicates, e.g. 1000, rather than by their p-values')
+    analyze_parser.add_argument('--output', help='Where to write the results of all the market types as CSV')
+
+    models_parser = subparsers.add_parser('models', help='Compare the three-factor, five-factor and momentum models of each market type\'s funds')
+    models_parser.add_argument('market_types', nargs='*', metavar='market_type', help='Defaulting to all of them')
+    models_parser.add_argument('--output', help='Where to write every fund\'s coefficients, t-values and adjusted R² under each model as CSV')
+
+    rolling_parser = subparsers.add_parser('rolling', help='Fit each market type\'s funds\' loadings over rolling windows of months')
+    rolling_parser.add_argument('market_types', nargs='*', metavar='market_type', help='Defaulting to all of them')
+    rolling_parser.add_argument('--window', type=int, default=36, help='The count of months in each window')
+    rolling_parser.add_argument('--step', type=int, default=1, help='The count of months between the ends of consecutive windows')
+    rolling_parser.add_argument('--min-observations', type=int, default=24, help='Skip the windows where a fund has fewer months of returns than this')
+    rolling_parser.add_argument('--output', help='Where to write every fund\'s loadings in each window as CSV')
+
+    frontier_parser = subparsers.add_parser('frontier', help='Trace the efficient frontier of each market type\'s funds, from the best mean to the least variance')
+    frontier_parser.add_argument('market_types', nargs='*', metavar='market_type', help='Defaulting to all of them')
+    frontier_parser.add_argument('--points', type=int, default=200, help='The count of risk aversions to solve at')
+    frontier_parser.add_argument('--cache', action='store_true', help='Reuse the cached regressions, rather than refit every fund')
+    frontier_parser.add_argument('--bootstrap', type=int, default=0, metavar='REPLICATES', help='Screen the loadings by the 95%% confidence intervals of this many block bootstrap replicates, e.g. 1000, rather than by their p-values')
+    frontier_parser.add_argument('--output', help='Where to write every point\'s mean, stdev, expense ratio and allocations as CSV')
+
+    refresh_parser = subparsers.add_parser('refresh', help='Re-download the factor returns that have changed')
+    refresh_parser.add_argument('--all', action='store_true', help='Sync every market type, not just the ones whose files changed')
+
+    backfill_parser = subparsers.add_parser('backfill', help='Backfill the investments\' facts and returns')
+    backfill_parser.add_argument('market_types', nargs='*', metavar='market_type', help='Defaulting to all of them')
+
+    args = parser.parse_args()
+    if args.command is None:
+        # `python .` alone analyzes every market type
+        args = parser.parse_args(['analyze'])
+
+    from db.db import engine
+    from lib.instrumentation import Instrumentation
+    # Measure where the run's time, DB round trips and memory go. Set PROFILER
+    # to cprofile or pyinstrument to profile it too, and TRACE_MEMORY to find
+    # each stage's peak memory.
+    instrumentation = Instrumentation().start(
+        engine(),
+        profiler=environ.get('PROFILER'),
+        trace_memory=bool(environ.get('TRACE_MEMORY'))
+    )
+    COMMANDS[args.command](args)
+    instrumentation.stop()
+    print(f'Made {instrumentation.report()["sql_queries"]} DB round trips, wrote the run report to {instrumentation.write_report()}')
@@ -0,0 +1,151 @@
+import argparse
+import datetime
+import json
+import numpy as np
+import os
+import pandas as pd
+import platform
+import scipy
+import sqlalchemy
+import subprocess
+import sys
+import tempfile
+
+# The universe sizes to sweep through by default
+TICKERS = [100, 1000, 10000, 50000]
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    """
+    Runs the sweep in a temporary directory, so that the synthetic zip files,
+    plots and snapshot invalidations never touch the real ones.
+    @return [dict] The results, with enough about the environment to compare them across commits
+    """
+    revision = commit()
+    # Before anything creates the engine from it
+    os.environ['DATABASE_URL'] = args.database_url
+    from benchmarks.universe_benchmark import UniverseBenchmark
+
+    results = []
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        os.chdir(temporary_directory)
+        os.makedirs('downloads')
+        os.makedirs('plots')
+        try:
+            for tickers in args.tickers:
+                print(f'Benchmarking {tickers} tickers over {args.months} months', file=sys.stderr)
+                benchmark = UniverseBenchmark(tickers, args.months, iterations=args.iterations, seed=args.seed)
+                for result in benchmark.run(stages=args.stages or UniverseBenchmark.STAGES, repeats=args.repeats):
+                    print(f"  {result['stage']:<28}{result['best']:>10.4f}s", file=sys.stderr)
+                    results.append(result)
+        finally:
+            os.chdir(working_directory)
+
+    return {
+        'commit': revision,
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'packages': {
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'scipy': scipy.__version__,
+            'sqlalchemy': sqlalchemy.__version__
+        },
+        'parameters': {
+            'database_url': args.database_url,
+            'months': args.months,
+            'repeats': args.repeats,
+            'iterations': args.iterations,
+            'seed': args.seed
+        },
+        'results': results
+    }
+
+def imports(args):
+    """
+    Times the cold start of each command of `python .`, mostly the time it
+    takes to import what it needs.
+    @return [dict] The results, with the commit they ran on
+    """
+    from benchmarks.import_time import COMMANDS, measure
+
+    results = []
+    print(f"{'command':<12}{'seconds':>10}{'imports':>10}{'modules':>9}  heavy modules", file=sys.stderr)
+    for command in args.commands or COMMANDS:
+        result = measure(command, database_url=args.database_url, repeats=args.repeats)
+        print(
+            f"{command:<12}{result['seconds']:>9.3f}s{result['import_seconds']:>9.3f}s{result['modules']:>9}  {', '.join(result['heavy_modules'])}",
+            file=sys.stderr
+        )
+        results.append(result)
+    return {
+        'commit': commit(),
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'parameters': {
+            'database_url': args.database_url,
+            'repeats': args.repeats
+        },
+        'results': results
+    }
+
+def compare(args):
+    """
+    Prints the best time of each stage and size in both files, and how many
+    times faster the second one is.
+    """
+    def best_times(filename):
+        with open(filename) as results_file:
+            return {
+                (result['stage'], result['tickers'], result['months']): result['best']
+                for result in json.load(results_file)['results']
+            }
+    before = best_times(args.before)
+    after = best_times(args.after)
+    print(f"{'stage':<28}{'tickers':>8}{'months':>8}{'before':>11}{'after':>11}{'speedup':>9}")
+    for key in [key for key in before if key in after]:
+        stage, tickers, months = key
+        print(f'{stage:<28}{tickers:>8}{months:>8}{before[key]:>10.4f}s{after[key]:>10.4f}s{before[key] / after[key]:>8.2f}x')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Times each stage of the pipeline on synthetic data')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run a sweep of universe sizes')
+    run_parser.add_argument('--tickers', type=int, nargs='+', default=TICKERS, help='The universe sizes to sweep through')
+    run_parser.add_argument('--months', type=int, default=240, help='The count of months of returns')
+    run_parser.add_argument('--repeats', type=int, default=3, help='How many times to time each stage, keeping the best')
+    run_parser.add_argument('--iterations', type=int, default=20, help='The count of samples for experiment_with_shuffling')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--database-url', default='sqlite://', help='An embedded DB to run against, e.g. sqlite:// or duckdb:///:memory:')
+    run_parser.add_argument('--stages', nargs='+', default=None, help='Only time these stages')
+    run_parser.add_argument('--output', help='Where to write the JSON results, defaulting to stdout')
+
+    imports_parser = subparsers.add_parser('imports', help='Time the cold start of each command of `python .`')
+    imports_parser.add_argument('--commands', nargs='+', default=None, help='Only time these commands, e.g. --help analyze')
+    imports_parser.add_argument('--repeats', type=int, default=5, help='How many times to time each command, keeping the best')
+    imports_parser.add_argument('--database-url', default='sqlite://', help='For a DB engine that gets created on import')
+    imports_parser.add_argument('--output', help='Where to write the JSON results, defaulting to stdout')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare the results of two runs')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        compare(args)
+    else:
+        report = run(args) if args.command == 'run' else imports(args)
+        if args.output:
+            with open(args.output, 'w') as output_file:
+                json.dump(report, output_file, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
@@ -0,0 +1,103 @@
+import ast
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def command_imports():
+    """
+    Reads the imports of each command of `python .` off __main__.py: the
+    ones its main block makes before running any command, and the ones in
+    the command's function, so that every command in its COMMANDS gets timed.
+    `--help` is just what __main__.py imports itself.
+    @return [dict] For each command, the key is its name, and the value is its import statements [list]
+    """
+    with open(os.path.join(ROOT, '__main__.py')) as main_file:
+        module = ast.parse(main_file.read())
+
+    def imports(node):
+        return [ast.unparse(child) for child in ast.walk(node) if isinstance(child, (ast.Import, ast.ImportFrom))]
+
+    functions = {node.name: node for node in module.body if isinstance(node, ast.FunctionDef)}
+    main_block = next(node for node in module.body if isinstance(node, ast.If))
+    commands = next(
+        node.value for node in module.body
+        if isinstance(node, ast.Assign) and [target.id for target in node.targets] == ['COMMANDS']
+    )
+    result = {'--help': []}
+    for name, function in zip(commands.keys, commands.values):
+        result[name.value] = imports(main_block) + imports(functions[function.id])
+    return result
+
+COMMANDS = command_imports()
+
+# The slow imports to keep out of the commands that don't need them
+HEAVY_MODULES = [
+    'statsmodels',
+    'patsy',
+    'matplotlib',
+    'scipy.stats',
+    'scipy.optimize',
+    'yfinance',
+    'pandas_datareader',
+    'sqlalchemy'
+]
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)$')
+
+def measure(command, database_url='sqlite://', repeats=5):
+    """
+    Times a cold start of the command in a fresh interpreter, with
+    `python -X importtime`, and keeps the best of the repeats.
+    @param [string] command One of COMMANDS
+    @param [string] database_url For a DB engine that gets created on import
+    @param [int] repeats
+    @return [dict] The command, its wall and import seconds, the count of
+        modules it imported, and which of HEAVY_MODULES they included
+    """
+    # Run __main__.py without running its main block, then import what the command would
+    code = '; '.join(
+        ['import runpy', f'runpy.run_path({ROOT!r}, run_name="import_time")'] +
+        COMMANDS[command]
+    )
+    environment = {**os.environ, 'DATABASE_URL': database_url}
+    best = None
+    for _ in range(repeats):
+        started_at = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=ROOT,
+            env=environment,
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        seconds = time.perf_counter() - started_at
+
+        import_microseconds = 0
+        modules = set()
+        for line in completed.stderr.splitlines():
+            match = IMPORT_TIME_LINE.match(line)
+            if match is None:
+                continue
+            cumulative, indent, module = match.groups()
+            modules.add(module)
+            # The top level imports' cumulative times add up to the whole
+            if not indent:
+                import_microseconds += int(cumulative)
+
+        if best is None or seconds < best['seconds']:
+            best = {
+                'command': command,
+                'seconds': seconds,
+                'import_seconds': import_microseconds / 10**6,
+                'modules': len(modules),
+                'heavy_modules': [
+                    heavy_module for heavy_module in HEAVY_MODULES
+                    if any(module == heavy_module or module.startswith(f'{heavy_module}.') for module in modules)
+                ]
+            }
+    return best
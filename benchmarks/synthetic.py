@@ -0,0 +1,132 @@
+from lib.factor_regression import FIVE_FACTORS
+import numpy as np
+import pandas as pd
+import zipfile
+
+# Roughly the monthly means and standard deviations of the five factors and
+# the risk free rate in the Ken French data library, in decimals
+FACTOR_MEANS = [0.006, 0.002, 0.003, 0.003, 0.003]
+FACTOR_STDEVS = [0.045, 0.03, 0.03, 0.02, 0.02]
+FACTOR_CORRELATIONS = [
+    [1.0, 0.25, -0.2, -0.25, -0.35],
+    [0.25, 1.0, 0.0, -0.3, 0.0],
+    [-0.2, 0.0, 1.0, 0.1, 0.65],
+    [-0.25, -0.3, 0.1, 1.0, 0.0],
+    [-0.35, 0.0, 0.65, 0.0, 1.0]
+]
+RISK_FREE_MEAN = 0.003
+
+def factor_returns(months, seed=0, ends_at='2021-12-31'):
+    """
+    @param [int] months The count of months, ending with ends_at
+    @param [int] seed
+    @param [string] ends_at The last month
+    @return [pandas.core.frame.DataFrame] Like `BaseDataSource.parse` returns,
+        with an occurred_at column and a column per factor, plus risk_free
+    """
+    random = np.random.default_rng(seed)
+    occurred_ats = pd.date_range(end=ends_at, periods=months, freq='M')
+    covariance = np.outer(FACTOR_STDEVS, FACTOR_STDEVS) * np.asarray(FACTOR_CORRELATIONS)
+    # Rounded to the hundredths of a percent that Ken French publishes
+    values = random.multivariate_normal(FACTOR_MEANS, covariance, size=months).round(4)
+    risk_free = np.abs(random.normal(RISK_FREE_MEAN, 0.001, size=months)).round(4)
+
+    data_frame = pd.DataFrame(values, columns=FIVE_FACTORS)
+    data_frame['risk_free'] = risk_free
+    data_frame.insert(0, 'occurred_at', occurred_ats.date)
+    return data_frame
+
+def ken_french_csv(data_frame):
+    """
+    @param [pandas.core.frame.DataFrame] data_frame See `factor_returns`
+    @return [string] The factor returns laid out like a Ken French CSV file,
+        monthly table first, then the annual one
+    """
+    lines = [
+        'This file was created using the synthetic benchmark universe.',
+        'The 1-month TBill return is from Ibbotson Associates.',
+        '',
+        ',Mkt-RF,SMB,HML,RMW,CMA,RF'
+    ]
+    columns = FIVE_FACTORS + ['risk_free']
+    for occurred_at, values in zip(data_frame.occurred_at, data_frame[columns].to_numpy() * 100):
+        lines.append(f'{occurred_at:%Y%m},' + ','.join(f'{value:8.2f}' for value in values))
+
+    lines += ['', ' Annual Factors: January-December ', ',Mkt-RF,SMB,HML,RMW,CMA,RF']
+    years = pd.to_datetime(data_frame.occurred_at).dt.year
+    for year, values in (data_frame[columns] * 100).groupby(years.values).sum().iterrows():
+        lines.append(f'{year},' + ','.join(f'{value:8.2f}' for value in values))
+    lines.append('')
+    return '\r\n'.join(lines)
+
+def write_ken_french_zip(filename, data_frame):
+    """
+    @param [string] filename Where to write the zip file, e.g. `BaseDataSource.zip_filename()`
+    @param [pandas.core.frame.DataFrame] data_frame See `factor_returns`
+    """
+    with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr('Synthetic_5_Factors.csv', ken_french_csv(data_frame))
+
+def investments(tickers, seed=0):
+    """
+    @param [int] tickers The count of investments
+    @param [int] seed
+    @return [pandas.core.frame.DataFrame] Like `InvestmentQuery.to_data_frame`
+        returns, with ticker, dividend_yield, expense_ratio and inception_date
+        columns, and a few expense ratios missing
+    """
+    random = np.random.default_rng(seed)
+    expense_ratios = random.uniform(0.0005, 0.0095, size=tickers).round(4)
+    expense_ratios[random.random(tickers) < 0.02] = np.nan
+    return pd.DataFrame({
+        'ticker': [f'T{i:05d}' for i in range(tickers)],
+        'dividend_yield': random.uniform(0, 0.05, size=tickers).round(4),
+        'expense_ratio': expense_ratios,
+        'inception_date': None
+    })
+
+def returns_panel(factor_returns, ticker_symbols, seed=0):
+    """
+    Makes up each fund's monthly returns from the factor returns, with loadings
+    scattered around what real funds have: a market beta near one, smaller
+    loadings on the other factors, a handful of inverse and leveraged funds,
+    some noise, and inception dates spread across the months.
+    @param [pandas.core.frame.DataFrame] factor_returns See `factor_returns`
+    @param [list] ticker_symbols
+    @param [int] seed
+    @return [pandas.core.frame.DataFrame] Months (rows) by tickers (columns), NaN before each fund's inception
+    """
+    random = np.random.default_rng(seed)
+    months, tickers = len(factor_returns), len(ticker_symbols)
+
+    loadings = random.normal(0, 0.3, size=(tickers, len(FIVE_FACTORS)))
+    loadings[:, 0] = random.normal(1, 0.15, size=tickers)
+    kinds = random.random(tickers)
+    loadings[kinds < 0.01, 0] *= -1 # Inverse
+    loadings[(kinds >= 0.01) & (kinds < 0.03), 0] *= 2.5 # Leveraged
+
+    factors = factor_returns[FIVE_FACTORS].to_numpy()
+    noise = random.normal(0, 0.02, size=(months, tickers))
+    values = factor_returns.risk_free.to_numpy()[:, np.newaxis] + factors @ loadings.T + noise
+
+    # Most funds span the whole period, the rest start somewhere in it, and a
+    # few have too little history to regress on
+    inceptions = np.where(random.random(tickers) < 0.5, 0, random.integers(0, months, size=tickers))
+    values[np.arange(months)[:, np.newaxis] < inceptions] = np.nan
+
+    return pd.DataFrame(
+        values.round(6),
+        index=pd.Index(factor_returns.occurred_at, name='occurred_at'),
+        columns=pd.Index(ticker_symbols, name='ticker_symbol')
+    )
+
+def long_returns(panel):
+    """
+    @param [pandas.core.frame.DataFrame] panel See `returns_panel`
+    @return [pandas.core.frame.DataFrame] Like `InvestmentReturns.get_percentage_change_data`
+        returns, with ticker_symbol, occurred_at and percentage_change columns
+    """
+    return panel.\
+        stack().\
+        rename('percentage_change').\
+        reset_index()[['ticker_symbol', 'occurred_at', 'percentage_change']]
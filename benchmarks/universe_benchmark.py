@@ -0,0 +1,132 @@
+from benchmarks import synthetic
+import contextlib
+from db.db import Session
+from db.factor_return import FactorReturn
+from db.investment_return import InvestmentReturn
+import io
+from lib import factor_regression, fund_screener
+from lib.experiment_with_shuffling import experiment_with_shuffling
+from lib.factor_returns import FactorReturns
+from lib.factor_returns_downloader import FactorReturnsDownloader
+from lib.investment_returns import InvestmentReturns
+from lib.sharpe_ratio_solver import choose_best
+import time
+
+class UniverseBenchmark:
+    """
+    Times each stage of the pipeline in `__main__.py` on its own, against a
+    synthetic universe of the given size. Each stage feeds the next, like in
+    the real pipeline, so they run in order.
+    NB: The DB stages write to whatever DATABASE_URL points at, which had
+    better be an embedded DB, and the working directory needs downloads and
+    plots directories.
+    ```py
+    results = UniverseBenchmark(tickers=1000, months=240).run(repeats=3)
+    ```
+    """
+    MARKET_TYPE = 'Emerging'
+
+    STAGES = [
+        'parse_factor_csv',
+        'write_factor_returns',
+        'write_investment_returns',
+        'fetch_panel',
+        'regressions',
+        'screen',
+        'choose_best',
+        'experiment_with_shuffling'
+    ]
+
+    def __init__(self, tickers, months, iterations=20, seed=0):
+        """
+        @param [int] tickers The count of funds in the universe
+        @param [int] months The count of months of factor returns
+        @param [int] iterations The count of samples for `experiment_with_shuffling`
+        @param [int] seed
+        """
+        self.tickers = tickers
+        self.months = months
+        self.iterations = iterations
+        self.seed = seed
+
+        self.data_source = next(
+            data_source
+            for data_source in FactorReturnsDownloader.DATA_SOURCES
+            if data_source.market_type() == self.MARKET_TYPE
+        )
+        self.factor_returns = synthetic.factor_returns(months, seed)
+        self.investments_df = synthetic.investments(tickers, seed)
+        self.returns = synthetic.long_returns(
+            synthetic.returns_panel(self.factor_returns, self.investments_df.ticker, seed)
+        )
+
+    def run(self, stages=STAGES, repeats=3):
+        """
+        @param [list] stages The names of the stages to time, the rest still run but aren't timed
+        @param [int] repeats How many times to time each stage
+        @return [list] A [dict] per timed stage
+        """
+        synthetic.write_ken_french_zip(self.data_source.zip_filename(), self.factor_returns)
+        results = []
+        for stage in self.STAGES:
+            setup = getattr(self, f'before_{stage}', None)
+            timings = []
+            for _ in range(repeats if stage in stages else 1):
+                if setup:
+                    setup()
+                # The stages print progress meant for people, not benchmarks
+                with contextlib.redirect_stdout(io.StringIO()):
+                    started_at = time.perf_counter()
+                    getattr(self, stage)()
+                    timings.append(time.perf_counter() - started_at)
+            if stage in stages:
+                results.append({
+                    'stage': stage,
+                    'tickers': self.tickers,
+                    'months': self.months,
+                    'seconds': timings,
+                    'best': min(timings)
+                })
+        return results
+
+    def parse_factor_csv(self):
+        self.parsed = FactorReturnsDownloader(self.data_source).from_csv()
+
+    def before_write_factor_returns(self):
+        self.delete_all(FactorReturn)
+
+    def write_factor_returns(self):
+        FactorReturns.sync(self.MARKET_TYPE, self.parsed)
+
+    def before_write_investment_returns(self):
+        self.delete_all(InvestmentReturn)
+
+    def write_investment_returns(self):
+        InvestmentReturns.write(self.returns)
+
+    def before_fetch_panel(self):
+        # Like `FactorReturns.fetch_snapshot` returns
+        self.factor_data = self.parsed.set_index('occurred_at').astype('float64')
+
+    def fetch_panel(self):
+        self.panel = InvestmentReturns.fetch_panel(self.investments_df.ticker, self.factor_data.index)
+
+    def regressions(self):
+        returns = self.panel.drop(columns=self.panel.columns[self.panel.count() < 12])
+        excess_returns = factor_regression.excess_returns(returns, self.factor_data)
+        self.regression_df = factor_regression.fit(excess_returns, self.factor_data).to_data_frame()
+
+    def screen(self):
+        self.df = fund_screener.screen(self.regression_df, self.investments_df)
+
+    def choose_best(self):
+        choose_best(self.df.copy())
+
+    def experiment_with_shuffling(self):
+        experiment_with_shuffling(self.df, self.MARKET_TYPE, iterations=self.iterations, workers=1, seed=self.seed)
+
+    @staticmethod
+    def delete_all(model):
+        session = Session()
+        session.query(model).delete()
+        session.commit()
@@ -0,0 +1,3 @@
+-- Momentum, from Ken French's momentum files, for the DBs created before
+-- 00_structure.sql had it. A new DB already has it, so this does nothing.
+alter table factor_returns add column if not exists winners_minus_losers numeric;
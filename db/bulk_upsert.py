@@ -0,0 +1,107 @@
+import io
+import pandas as pd
+from sqlalchemy import or_
+from sqlalchemy.dialects import postgresql, sqlite
+
+def bulk_upsert(connection, table, data_frame, index_elements, batch_size=10000):
+    """
+    Writes every row of the data frame into the table in bulk. Rows that
+    collide with the unique index on `index_elements` are updated in place,
+    so writing the same data twice is harmless.
+    On Postgres, the data frame is streamed with COPY into a temporary table
+    and merged from there with a single INSERT ... ON CONFLICT. DuckDB merges
+    straight from the data frame, which it reads in place. SQLite gets
+    batched executemany INSERT ... ON CONFLICT statements instead.
+    NB: This doesn't commit, so that the caller controls the transaction.
+    @param [sqlalchemy.engine.Connection] connection E.g. `Session().connection()`
+    @param [sqlalchemy.Table] table E.g. `FactorReturn.__table__`
+    @param [pandas.core.frame.DataFrame] data_frame Columns named after the table's columns
+    @param [list] index_elements The columns of the table's unique index
+    @param [int] batch_size The most rows per executemany, if not on Postgres
+    @return [int] The count of rows inserted or updated
+    """
+    if data_frame.empty:
+        return 0
+    if connection.dialect.name == 'postgresql':
+        return copy_upsert(connection, table, data_frame, index_elements)
+    if connection.dialect.name == 'duckdb':
+        return register_upsert(connection, table, data_frame, index_elements)
+    return executemany_upsert(connection, table, data_frame, index_elements, batch_size)
+
+def copy_upsert(connection, table, data_frame, index_elements):
+    columns = list(data_frame.columns)
+    updated_columns = [column for column in columns if column not in index_elements]
+    column_list = ', '.join(columns)
+    staging_table = f'{table.name}_staging'
+
+    csv_buffer = io.StringIO()
+    data_frame.to_csv(csv_buffer, index=False, header=False, na_rep='')
+    csv_buffer.seek(0)
+
+    # The raw DBAPI connection shares the caller's transaction
+    with connection.connection.cursor() as cursor:
+        cursor.execute(f'drop table if exists {staging_table}')
+        cursor.execute(f"""
+            create temporary table {staging_table} on commit drop as
+            select {column_list} from {table.name} with no data
+        """)
+        cursor.copy_expert(f'copy {staging_table} ({column_list}) from stdin with (format csv)', csv_buffer)
+        cursor.execute(f"""
+            insert into {table.name} ({column_list})
+            select {column_list} from {staging_table}
+            {on_conflict(table, index_elements, updated_columns)}
+        """)
+        return cursor.rowcount
+
+def register_upsert(connection, table, data_frame, index_elements):
+    columns = list(data_frame.columns)
+    updated_columns = [column for column in columns if column not in index_elements]
+    column_list = ', '.join(columns)
+    staging_table = f'{table.name}_staging'
+
+    # The raw DBAPI connection shares the caller's transaction
+    dbapi_connection = connection.connection
+    dbapi_connection.register(staging_table, data_frame)
+    try:
+        count, = dbapi_connection.execute(f"""
+            insert into {table.name} ({column_list})
+            select {column_list} from {staging_table}
+            {on_conflict(table, index_elements, updated_columns)}
+        """).fetchone()
+    finally:
+        dbapi_connection.unregister(staging_table)
+    return count
+
+def on_conflict(table, index_elements, updated_columns):
+    if not updated_columns:
+        return f"on conflict ({', '.join(index_elements)}) do nothing"
+    # Skip rewriting rows whose values haven't changed, so that re-running
+    # a backfill doesn't leave dead tuples behind
+    return f"""
+        on conflict ({', '.join(index_elements)})
+        do update set {', '.join(f'{column} = excluded.{column}' for column in updated_columns)}
+        where ({', '.join(f'{table.name}.{column}' for column in updated_columns)})
+        is distinct from ({', '.join(f'excluded.{column}' for column in updated_columns)})
+    """
+
+def executemany_upsert(connection, table, data_frame, index_elements, batch_size):
+    insert = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}[connection.dialect.name]
+    statement = insert(table)
+    updated_columns = [column for column in data_frame.columns if column not in index_elements]
+    if updated_columns:
+        # Skip rewriting rows whose values haven't changed, like `on_conflict`,
+        # so that they don't count as written either
+        statement = statement.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: statement.excluded[column] for column in updated_columns},
+            where=or_(*[table.c[column].is_distinct_from(statement.excluded[column]) for column in updated_columns])
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=index_elements)
+
+    # Plain Python values, with None rather than NaN for NULL
+    rows = data_frame.astype(object).where(pd.notna(data_frame), None).to_dict('records')
+    count = 0
+    for i in range(0, len(rows), batch_size):
+        count += connection.execute(statement, rows[i:i + batch_size]).rowcount
+    return count
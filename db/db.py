@@ -1,7 +1,45 @@
 # To talk to the DB
+from db import embedded, migrations
+import functools
+from os import environ
 import sqlalchemy as db
+from sqlalchemy import event
 from sqlalchemy.orm import sessionmaker, scoped_session
 
+# The docker-compose Postgres container by default, or e.g. sqlite:///ff.db or
+# duckdb:///ff.duckdb to run without it, see `embedded.create_engine`
+DATABASE_URL = environ.get('DATABASE_URL', 'postgresql://postgres:example@db/postgres')
 
-Engine = db.create_engine('postgresql://postgres:example@db/postgres')
-Session = scoped_session(sessionmaker(bind=Engine))
+@functools.lru_cache(maxsize=None)
+def engine():
+    """
+    Creates the engine the first time it's needed, rather than on import, so
+    that importing the models neither loads the DB driver nor, for an
+    embedded DB, opens the DB and applies its schema.
+    @return [sqlalchemy.engine.Engine]
+    """
+    if db.engine.make_url(DATABASE_URL).get_backend_name() in embedded.EMBEDDED_BACKENDS:
+        created_engine = embedded.create_engine(DATABASE_URL)
+    else:
+        created_engine = db.create_engine(DATABASE_URL)
+
+    if created_engine.dialect.driver == 'psycopg2':
+        import psycopg2.extensions
+        # Parse numeric columns straight into floats, rather than into Decimals
+        # that then get converted to floats, see the Numeric(asdecimal=False) columns
+        numeric_as_float = psycopg2.extensions.new_type(
+            psycopg2.extensions.DECIMAL.values,
+            'NUMERIC_AS_FLOAT',
+            lambda value, cursor: float(value) if value is not None else None
+        )
+
+        @event.listens_for(created_engine, 'connect')
+        def register_numeric_as_float(dbapi_connection, _):
+            psycopg2.extensions.register_type(numeric_as_float, dbapi_connection)
+
+    # Add the columns of the schema that a DB created before them is missing
+    migrations.migrate(created_engine)
+    return created_engine
+
+# Binds each thread's session to the engine once it's first used
+Session = scoped_session(lambda: sessionmaker(bind=engine())())
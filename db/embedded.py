@@ -0,0 +1,93 @@
+from os import path
+import re
+import sqlalchemy as db
+from sqlalchemy.pool import StaticPool
+
+# The DBs that run inside this process, rather than in the docker-compose
+# Postgres container. DuckDB is columnar, which suits the big scans over
+# investment_returns, and needs the duckdb-engine package.
+EMBEDDED_BACKENDS = ['sqlite', 'duckdb']
+
+SQL_FILENAMES = [
+    path.join(path.dirname(path.abspath(__file__)), '00_structure.sql'),
+    path.join(path.dirname(path.abspath(__file__)), '01_seeds.sql')
+]
+
+def create_engine(url):
+    """
+    Creates an engine for an embedded DB, e.g. `sqlite:///ff.db`, `sqlite://`
+    (in memory) or `duckdb:///ff.duckdb`, and, if the DB is new, applies the
+    same schema and seeds that Postgres gets from docker-entrypoint-initdb.d.
+    @param [string] url
+    @raise [ValueError] If the URL isn't for one of EMBEDDED_BACKENDS
+    @raise [ImportError] If the URL is for DuckDB, and it isn't installed
+    @return [sqlalchemy.engine.Engine]
+    """
+    url = db.engine.make_url(url)
+    backend = url.get_backend_name()
+    if backend not in EMBEDDED_BACKENDS:
+        raise ValueError(f'Database URL ({url}) is not for one of {", ".join(EMBEDDED_BACKENDS)}')
+
+    in_memory = url.database in (None, '', ':memory:')
+    if backend == 'sqlite':
+        # The returns backfills use the engine from many threads
+        engine = db.create_engine(url, connect_args={'check_same_thread': False}, **(
+            # Share the one connection, or every connection would get its own empty DB
+            {'poolclass': StaticPool} if in_memory else {}
+        ))
+    else:
+        try:
+            engine = db.create_engine(url, **({'poolclass': StaticPool} if in_memory else {}))
+        except db.exc.NoSuchModuleError as e:
+            raise ImportError('Running on DuckDB needs it installed, e.g. `pip install duckdb-engine`') from e
+
+    if not db.inspect(engine).has_table('market_types'):
+        apply_sql_files(engine)
+    return engine
+
+def apply_sql_files(engine, filenames=SQL_FILENAMES):
+    """
+    @param [sqlalchemy.engine.Engine] engine
+    @param [list] filenames Postgres SQL files, translated to the engine's dialect
+    """
+    with engine.begin() as connection:
+        for filename in filenames:
+            with open(filename) as sql_file:
+                sql = translate(sql_file.read(), engine.dialect.name)
+            for statement in sql.split(';'):
+                if statement.strip():
+                    connection.exec_driver_sql(statement)
+
+def translate(sql, dialect_name):
+    """
+    Translates the bits of `db/00_structure.sql` and `db/01_seeds.sql` that
+    are Postgres only.
+    @param [string] sql
+    @param [string] dialect_name sqlite or duckdb
+    @return [string]
+    """
+    # Neither can add a constraint to an existing table
+    sql = re.sub(r'alter table[^;]*add constraint[^;]*;', '', sql)
+    if dialect_name == 'sqlite':
+        sql = sql.replace('serial primary key', 'integer primary key')
+        # SQLite can't skip adding a column that exists, but `migrations.migrate`
+        # only adds the ones that don't
+        sql = sql.replace('add column if not exists', 'add column')
+        # SQLite can't name the columns of a values list, which it calls column1, etc.
+        sql = re.sub(
+            r'join \(\s*values(.*?)\) as (\w+)\((\w+)\)',
+            r'join (select column1 as \3 from (values\1)) as \2',
+            sql,
+            flags=re.S
+        )
+    elif dialect_name == 'duckdb':
+        # DuckDB has no serial type, but has sequences
+        sql = re.sub(
+            r'create table (\w+)\n\( id serial primary key',
+            r"create sequence \1_id_seq;\ncreate table \1\n( id integer primary key default nextval('\1_id_seq')",
+            sql
+        )
+        sql = re.sub(r'drop table if exists (\w+);', r'drop table if exists \1;\ndrop sequence if exists \1_id_seq;', sql)
+        # DuckDB's numeric defaults to 3 decimal places, too few for returns
+        sql = re.sub(r'\bnumeric\b', 'double', sql)
+    return sql
@@ -1,6 +1,6 @@
 from db.db import Session
 from db.market_type import MarketType
-from sqlalchemy import Column, Date, ForeignKey, Integer, Numeric, select, delete
+from sqlalchemy import Column, Date, ForeignKey, Integer, Numeric
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy_repr import RepresentableBase
@@ -12,12 +12,14 @@ class FactorReturn(Base):
     id = Column(Integer, primary_key=True)
     market_type_id = Column(Integer, ForeignKey(MarketType.id), nullable=False)
     occurred_at = Column(Date, nullable=False)
-    risk_free = Column(Numeric, nullable=False)
-    market_minus_risk_free = Column(Numeric, nullable=False)
-    small_minus_big = Column(Numeric, nullable=False)
-    high_minus_low = Column(Numeric, nullable=False)
-    robust_minus_weak = Column(Numeric)
-    conservative_minus_aggressive = Column(Numeric)
+    risk_free = Column(Numeric(asdecimal=False), nullable=False)
+    market_minus_risk_free = Column(Numeric(asdecimal=False), nullable=False)
+    small_minus_big = Column(Numeric(asdecimal=False), nullable=False)
+    high_minus_low = Column(Numeric(asdecimal=False), nullable=False)
+    robust_minus_weak = Column(Numeric(asdecimal=False))
+    conservative_minus_aggressive = Column(Numeric(asdecimal=False))
+    # From a separate file, which starts later than the five factors' in some market types
+    winners_minus_losers = Column(Numeric(asdecimal=False))
 
     market_type = relationship(MarketType, foreign_keys=[market_type_id])
 
@@ -29,16 +31,11 @@ class FactorReturn(Base):
             .filter(MarketType.name == market_type_name)
 
     @staticmethod
-    def delete_by_market_type_name(market_type_name):
+    def value_columns():
         """
-        @return [True]
+        @return [list] The factor returns' columns, e.g. risk_free [sqlalchemy.Column]
         """
-        market_type_query = select(MarketType) \
-            .where(MarketType.name == market_type_name)
-        market_type = Session() \
-            .scalars(market_type_query) \
-            .first()
-        delete_command = delete(FactorReturn) \
-            .where(FactorReturn.market_type_id == market_type.id)
-        Session().execute(delete_command)
-        return True
+        return [
+            column for column in FactorReturn.__table__.columns
+            if column.name not in ('id', 'market_type_id', 'occurred_at')
+        ]
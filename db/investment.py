@@ -11,8 +11,8 @@ class Investment(Base):
     id = Column(Integer, primary_key=True)
     market_type_id = Column(Integer, ForeignKey(MarketType.id), nullable=False)
     ticker_symbol = Column(String, nullable=False)
-    expense_ratio = Column(Numeric)
-    dividend_yield = Column(Numeric)
+    expense_ratio = Column(Numeric(asdecimal=False))
+    dividend_yield = Column(Numeric(asdecimal=False))
     inception_date = Column(Date)
 
     market_type = relationship(MarketType, foreign_keys=[market_type_id])
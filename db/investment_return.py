@@ -9,4 +9,4 @@ class InvestmentReturn(Base):
     id = Column(Integer, primary_key=True)
     ticker_symbol = Column(String, nullable=False)
     occurred_at = Column(Date, nullable=False)
-    percentage_change = Column(Numeric, nullable=False)
+    percentage_change = Column(Numeric(asdecimal=False), nullable=False)
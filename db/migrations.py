@@ -0,0 +1,28 @@
+from db import embedded
+from os import path
+import sqlalchemy as db
+
+# The columns added to the schema since a DB could have been created without
+# them, and the SQL file that adds each one. Postgres runs the files on a
+# new DB too, from docker-entrypoint-initdb.d, after 00_structure.sql
+# already has them.
+MIGRATIONS = [
+    ('factor_returns', 'winners_minus_losers', path.join(path.dirname(path.abspath(__file__)), '02_add_winners_minus_losers.sql'))
+]
+
+def migrate(engine, migrations=MIGRATIONS):
+    """
+    Applies the migrations whose column the DB is missing, so that a DB
+    created before them doesn't fail every query of their tables.
+    @param [sqlalchemy.engine.Engine] engine
+    @param [list] migrations A table, column and SQL file [tuple] per migration
+    @return [list] The SQL files applied
+    """
+    inspector = db.inspect(engine)
+    applied = []
+    for table, column, filename in migrations:
+        if column not in [existing['name'] for existing in inspector.get_columns(table)]:
+            print(f'Adding {table}.{column}, see {path.basename(filename)}')
+            embedded.apply_sql_files(engine, [filename])
+            applied.append(filename)
+    return applied
@@ -2,8 +2,8 @@ import datetime
 from dateutil.relativedelta import relativedelta
 from db.investment import Investment
 from db.market_type import MarketType
-import pandas as pd
-from sqlalchemy import or_
+from db.read_frame import read_frame
+from sqlalchemy import or_, update
 from sqlalchemy.orm import Query
 from sqlalchemy.sql.expression import bindparam
 
@@ -41,24 +41,73 @@ class InvestmentQuery(Query):
                 (Investment.inception_date == None)
             )
 
-    def update_by_ticker_symbol(self, ticker_symbol, values):
+    def bulk_updater(self, batch_size=50):
         """
-        NB: This forces a commit, because I want to avoid having to requery
-        Yahoo because I crashed before I committed.
-        @param [string] ticker_symbol
-        @param [dict] values
-        @returns [int] the count of rows updated
+        @param [int] batch_size How many tickers' updates to collect before
+            flushing them
+        @returns [InvestmentFactsUpdater]
         """
-        count = self.\
-            filter(Investment.ticker_symbol == ticker_symbol).\
-            update(values, synchronize_session=False)
-        self.session.commit()
-        return count
+        return InvestmentFactsUpdater(self.session, batch_size)
 
     def to_data_frame(self):
-        df = pd.read_sql(
+        df = read_frame(
             self.statement,
             self.session.bind
         )[['ticker_symbol', 'dividend_yield', 'expense_ratio', 'inception_date']]
         df = df.rename(columns={ 'ticker_symbol': 'ticker' })
         return df
+
+class InvestmentFactsUpdater:
+    """
+    Collects the facts to update by ticker symbol, and flushes them in
+    batches, each with a single executemany UPDATE and a single commit.
+    Flushing regularly, and on the way out even if something raised, means
+    I don't have to requery Yahoo because I crashed before I committed.
+    ```py
+    with Investments().query.bulk_updater() as updater:
+        updater.add('VWO', {'expense_ratio': 0.0008})
+    ```
+    """
+    def __init__(self, session, batch_size):
+        self.session = session
+        self.batch_size = batch_size
+        self.pending = {}
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.flush()
+
+    def add(self, ticker_symbol, values):
+        """
+        @param [string] ticker_symbol
+        @param [dict] values
+        """
+        self.pending.setdefault(ticker_symbol, {}).update(values)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        @returns [int] the count of rows updated
+        """
+        if not self.pending:
+            return 0
+        # One executemany per set of columns being updated
+        by_columns = {}
+        for ticker_symbol, values in self.pending.items():
+            by_columns.setdefault(tuple(sorted(values)), []).append(
+                {'b_ticker_symbol': ticker_symbol, **{f'b_{column}': value for column, value in values.items()}}
+            )
+        count = 0
+        for columns, parameters in by_columns.items():
+            statement = update(Investment).\
+                where(Investment.ticker_symbol == bindparam('b_ticker_symbol')).\
+                values({column: bindparam(f'b_{column}') for column in columns})
+            count += self.session.execute(statement, parameters).rowcount
+        self.session.commit()
+        self.pending = {}
+        self.count += count
+        return count
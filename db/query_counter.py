@@ -0,0 +1,39 @@
+from sqlalchemy import event
+
+class QueryCounter:
+    """
+    Counts the statements an engine sends to the DB, i.e. its round trips, and
+    the rows they touched.
+    ```py
+    with QueryCounter(engine()) as query_counter:
+        ...
+    print(query_counter.count, query_counter.rows)
+    ```
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        # As the DBAPI cursor reports them: psycopg2 gives the rows a SELECT
+        # returned or a write touched, SQLite only the latter
+        self.rows = 0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def start(self):
+        event.listen(self.engine, 'before_cursor_execute', self.increment)
+        event.listen(self.engine, 'after_cursor_execute', self.add_rows)
+        return self
+
+    def stop(self):
+        event.remove(self.engine, 'before_cursor_execute', self.increment)
+        event.remove(self.engine, 'after_cursor_execute', self.add_rows)
+
+    def increment(self, *_):
+        self.count += 1
+
+    def add_rows(self, connection, cursor, *_):
+        self.rows += max(cursor.rowcount, 0)
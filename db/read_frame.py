@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+
+def read_frame(statement, bind, dtype='float64'):
+    """
+    Like `pd.read_sql`, but every Numeric column comes back as a contiguous
+    float column of the given dtype, rather than an object column of
+    `Decimal`s for pandas to convert. The rows come straight from the DBAPI
+    cursor, without a SQLAlchemy row object each, and the floats straight
+    from the driver (see `db.db`), which get packed into each column's array
+    in one go. DuckDB hands over the whole result column by column instead.
+    @param [sqlalchemy.sql.Select] statement
+    @param [sqlalchemy.engine.Engine] bind
+    @param [string] dtype float64, or float32 to halve the memory
+    @return [pandas.core.frame.DataFrame]
+    """
+    # Spell out the values of IN lists, whose count is only known now
+    compiled = statement.compile(dialect=bind.dialect, compile_kwargs={'render_postcompile': True})
+    if bind.dialect.positional:
+        parameters = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        parameters = compiled.params
+
+    columns = list(statement.selected_columns)
+    with bind.connect() as connection:
+        if bind.dialect.name == 'duckdb':
+            data_frame = connection.connection.execute(compiled.string, list(parameters)).df()
+            # Back to datetime.date objects, like pd.read_sql returns for Date columns
+            for column in columns:
+                if isinstance(column.type, db.Date) and column.name in data_frame:
+                    data_frame[column.name] = data_frame[column.name].dt.date
+        else:
+            result = connection.exec_driver_sql(compiled.string, parameters)
+            names = list(result.keys())
+            rows = result.cursor.fetchall()
+            result.close()
+            values = list(zip(*rows)) if rows else [()] * len(names)
+            data_frame = pd.DataFrame({
+                name: to_array(column, column_values, bind.dialect, dtype)
+                for name, column, column_values in zip(names, columns, values)
+            }, columns=names)
+
+    for column in columns:
+        if isinstance(column.type, db.Numeric) and column.name in data_frame:
+            data_frame[column.name] = data_frame[column.name].astype(dtype, copy=False)
+    return data_frame
+
+def to_array(column, values, dialect, dtype):
+    if isinstance(column.type, db.Numeric):
+        # None becomes NaN
+        return np.array(values, dtype=dtype)
+    # E.g. SQLite's dates come back as strings
+    processor = column.type.dialect_impl(dialect).result_processor(dialect, None)
+    return list(map(processor, values)) if processor else list(values)
@@ -0,0 +1,136 @@
+from lib.factor_regression import FIVE_FACTORS, INTERCEPT, month_outer_products, regression_inputs, zero_filled
+from lib.instrumentation import timed
+import numpy as np
+import pandas as pd
+import warnings
+
+# The most elements of every ticker's X'X and X'y to hold at once, over a chunk of replicates
+CHUNK_ELEMENTS = 10**7
+
+class BootstrapResults:
+    def __init__(self, lower, upper, replicates, block_length):
+        """
+        @param [pandas.core.frame.DataFrame] lower Tickers (rows) by terms (columns), the lower bounds of the confidence intervals
+        @param [pandas.core.frame.DataFrame] upper Tickers (rows) by terms (columns), the upper bounds of the confidence intervals
+        @param [int] replicates The count of bootstrap replicates
+        @param [int] block_length The count of consecutive months in each block
+        """
+        self.lower = lower
+        self.upper = upper
+        self.replicates = replicates
+        self.block_length = block_length
+
+    def to_data_frame(self):
+        """
+        Long format, one row per ticker and term, to merge into
+        `FactorRegressionResults.to_data_frame`'s rows.
+        @return [pandas.core.frame.DataFrame] With columns lower, upper, factor, ticker
+        """
+        df = pd.DataFrame({
+            'lower': self.lower.stack(dropna=False),
+            'upper': self.upper.stack(dropna=False)
+        })
+        df['ticker'] = df.index.get_level_values(0)
+        df['factor'] = df.index.get_level_values(1)
+        df.index = df.factor.values
+        return df[['lower', 'upper', 'factor', 'ticker']]
+
+@timed('block_bootstrap.bootstrap')
+def bootstrap(excess_returns, factor_returns, factors=FIVE_FACTORS, replicates=1000, block_length=None, confidence=0.95, seed=0):
+    """
+    Estimates how much every ticker's loadings vary with a moving block
+    bootstrap: each replicate resamples the months in blocks of consecutive
+    months, so that it keeps the residuals' autocorrelation, which the OLS
+    p-values assume away, and refits every ticker's loadings on them. A
+    replicate is a count of how many times each month got drawn, so every
+    replicate of every ticker gets fit from the one design matrix, with its
+    X'X and X'y weighted by the counts.
+    @param [pandas.core.frame.DataFrame] excess_returns Months (rows) by tickers (columns)
+    @param [pandas.core.frame.DataFrame] factor_returns Months (rows) by factors (columns), aligned to excess_returns
+    @param [list] factors The factors to regress on, in order
+    @param [int] replicates The count of resamples of the months
+    @param [int] block_length The count of consecutive months in each block,
+        defaulting to the cube root of the count of months
+    @param [float] confidence The coverage of the percentile confidence intervals
+    @param [int] seed
+    @return [BootstrapResults]
+    """
+    X, Y, mask = regression_inputs(excess_returns, factor_returns, factors)
+    terms = [INTERCEPT] + list(factors)
+    n_terms = len(terms)
+    tickers = pd.Index(excess_returns.columns, name='ticker')
+
+    # Only resample the months some ticker has a return for
+    months = np.flatnonzero(mask.any(axis=0))
+    if len(months):
+        months = np.arange(months[0], months[-1] + 1)
+    X, WY, W = zero_filled(X[months], Y[:, months], mask[:, months])
+    if block_length is None:
+        block_length = max(1, int(round(len(months) ** (1 / 3))))
+    block_length = min(block_length, max(1, len(months)))
+
+    # Every month's x x' and x, then every ticker's sums of them weighted by
+    # a replicate's counts are one (tickers x months) @ (months x terms²) product
+    outer = month_outer_products(X)
+
+    rng = np.random.Generator(np.random.PCG64(seed))
+    estimates = np.empty((replicates, len(tickers), n_terms))
+    chunk = max(1, CHUNK_ELEMENTS // max(1, len(tickers) * (n_terms * n_terms + n_terms)))
+    for start in range(0, replicates, chunk):
+        counts = block_counts(rng, min(chunk, replicates - start), len(months), block_length)
+        gram = (W @ (counts.T[:, :, None] * outer[:, None, :]).reshape(len(months), -1)).\
+            reshape(len(tickers), len(counts), n_terms, n_terms)
+        xty = (WY @ (counts.T[:, :, None] * X[:, None, :]).reshape(len(months), -1)).\
+            reshape(len(tickers), len(counts), n_terms)
+        # A replicate that drew fewer of a ticker's months than it has terms can't be fit
+        fittable = W @ (counts.T > 0) >= n_terms
+        estimates[start:start + len(counts)] = solve(gram, xty, fittable).transpose(1, 0, 2)
+
+    tail = 100 * (1 - confidence) / 2
+    with warnings.catch_warnings():
+        # Tickers with too few months for any replicate get NaN bounds
+        warnings.simplefilter('ignore', RuntimeWarning)
+        lower, upper = np.nanpercentile(estimates, [tail, 100 - tail], axis=0)
+    return BootstrapResults(
+        pd.DataFrame(lower, index=tickers, columns=terms),
+        pd.DataFrame(upper, index=tickers, columns=terms),
+        replicates,
+        block_length
+    )
+
+def solve(gram, xty, fittable):
+    """
+    @param [numpy.ndarray] gram Tickers by replicates by terms by terms
+    @param [numpy.ndarray] xty Tickers by replicates by terms
+    @param [numpy.ndarray] fittable Tickers by replicates, False for the ones to leave NaN
+    @return [numpy.ndarray] Tickers by replicates by terms, the params
+    """
+    gram = np.where(fittable[:, :, None, None], gram, np.eye(gram.shape[-1]))
+    try:
+        params = np.linalg.solve(gram, xty[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        # Months that are enough in count but not in variety, like `fit_masked` does
+        params = np.einsum('trij,trj->tri', np.linalg.pinv(gram, hermitian=True), xty)
+    params[~fittable] = np.nan
+    return params
+
+def block_counts(rng, replicates, n_months, block_length):
+    """
+    Draws blocks of consecutive months, uniformly among the ones that fit,
+    until they cover as many months as there are, with the last block cut
+    short.
+    @param [numpy.random.Generator] rng
+    @param [int] replicates
+    @param [int] n_months
+    @param [int] block_length
+    @return [numpy.ndarray] Replicates by months, how many times each month got drawn
+    """
+    n_blocks = -(-n_months // block_length)
+    starts = rng.integers(0, n_months - block_length + 1, size=(replicates, n_blocks))
+    # Each block adds one from its start to its end, as a difference array
+    ends = np.minimum(starts + block_length, starts + n_months - block_length * np.arange(n_blocks))
+    differences = np.zeros((replicates, n_months + 1))
+    rows = np.arange(replicates)[:, None]
+    np.add.at(differences, (rows, starts), 1)
+    np.add.at(differences, (rows, ends), -1)
+    return np.cumsum(differences, axis=1)[:, :n_months]
@@ -1,9 +1,10 @@
 import numpy as np
 
 class ChosenSummarizer:
-    def __init__(self, chosen, relevant_columns):
+    def __init__(self, chosen, relevant_columns, solver_result=None):
         self.chosen = chosen
         self.relevant_columns = relevant_columns
+        self.solver_result = solver_result
 
     def summary(self):
         print({
@@ -0,0 +1,126 @@
+from lib.chosen_summarizer import ChosenSummarizer
+from lib.instrumentation import timed
+from lib.sharpe_ratio_solver import RELEVANT_COLUMNS, minimize_over_simplex, project_onto_simplex, record_solver_result, relevant_factors
+import numpy as np
+import pandas as pd
+
+# `choose_best` picks one point of the trade-off between the funds' mean
+# factor loading and how evenly it's spread across the factors. The efficient
+# frontier is all of them: for each risk aversion, the allocations that
+# maximize mean - risk_aversion / 2 * variance, where the variance is that of
+# the allocations' factor loadings, see `var_covar_root`.
+# https://en.wikipedia.org/wiki/Modern_portfolio_theory#Efficient_frontier_with_no_risk-free_asset
+
+class EfficientFrontier:
+    def __init__(self, df, points, weights, relevant_columns):
+        """
+        @param [pandas.core.frame.DataFrame] df The funds
+        @param [pandas.core.frame.DataFrame] points One row per risk aversion, from
+            the least averse, with its mean, stdev, expense_ratio and sharpe_ratio,
+            like a `ChosenSummarizer`'s
+        @param [pandas.core.frame.DataFrame] weights Points (rows) by funds (columns, indexed like df)
+        @param [list] relevant_columns The factors
+        """
+        self.df = df
+        self.points = points
+        self.weights = weights
+        self.relevant_columns = relevant_columns
+
+    def chosen(self, point):
+        """
+        @param [int] point The position of the point, e.g. `points.sharpe_ratio.argmax()`
+        @return [ChosenSummarizer] Like `choose_best`'s, for the point's allocations
+        """
+        chosen = self.df.assign(allocation=np.round(self.weights.iloc[point], 3))
+        chosen = chosen[(chosen.allocation > 0)].sort_values(by=['allocation'], ascending=False)
+        return ChosenSummarizer(chosen, self.relevant_columns)
+
+    def to_data_frame(self):
+        """
+        @return [pandas.core.frame.DataFrame] One row per point and fund it
+            allocates to, with the point's columns, and the fund's ticker and weight
+        """
+        weights = self.weights.set_axis(self.df.ticker, axis=1).rename_axis(index='point', columns='ticker').stack()
+        weights = weights[weights > 0].rename('weight').reset_index(level='ticker')
+        return self.points.rename_axis(index='point').join(weights).reset_index()
+
+@timed('efficient_frontier.trace_frontier')
+def trace_frontier(df, points=200, risk_aversions=None, decades=4):
+    """
+    Solves for the allocations at each risk aversion, from the least averse,
+    each starting from its neighbors'. Along the frontier, each fund's
+    allocation is linear in 1 / risk_aversion for as long as the funds held
+    don't change, so each solve starts from the line through the previous
+    two solutions, and usually only takes a step to confirm it.
+    @param [pandas.core.frame.DataFrame] df The funds to choose from
+    @param [int] points The count of risk aversions
+    @param [numpy.ndarray] risk_aversions The risk aversions to solve at, in
+        increasing order. Defaults to points of them spaced evenly on a log
+        scale, from the highest one where holding just the fund with the best
+        mean is still optimal, to decades orders of magnitude above it.
+    @param [int] decades
+    @raise [ValueError] If a point's solver fails
+    @return [EfficientFrontier] Or (0, 0, 0) if df is too small, like `choose_best` returns
+    """
+    if df.shape[0] <= 1:
+        print(f'DataFrame is too small ({df.shape[0]}), skipping')
+        return (0, 0, 0)
+
+    factors, factor_means, factor_var_covar_root = relevant_factors(df)
+
+    # Holding just the fund with the best mean is optimal until the gradient
+    # of holding some of another fund instead turns negative
+    best = np.argmax(factor_means)
+    if risk_aversions is None:
+        variance_saved = factor_var_covar_root[best] @ factor_var_covar_root[best] - factor_var_covar_root @ factor_var_covar_root[best]
+        has_less = variance_saved > 0
+        lowest = np.min((factor_means[best] - factor_means[has_less]) / variance_saved[has_less], initial=np.inf)
+        lowest = lowest if 0 < lowest < np.inf else 1
+        risk_aversions = np.geomspace(lowest, lowest * 10**decades, points)
+    risk_aversions = np.asarray(risk_aversions, dtype=float)
+
+    weights = np.empty((len(risk_aversions), len(df)))
+    x = np.zeros(len(df))
+    x[best] = 1
+    step = 1
+    for i, risk_aversion in enumerate(risk_aversions):
+        if i >= 2:
+            # Extrapolate the last two solutions to this risk aversion
+            progress = (1 / risk_aversion - 1 / risk_aversions[i - 1]) / (1 / risk_aversions[i - 1] - 1 / risk_aversions[i - 2])
+            x = project_onto_simplex(weights[i - 1] + progress * (weights[i - 1] - weights[i - 2]))
+        result = minimize_over_simplex(
+            variance_objective_function,
+            x,
+            args=(factor_means, factor_var_covar_root, risk_aversion),
+            step0=step
+        )
+        record_solver_result(result)
+        if not result.success:
+            raise ValueError(result.message)
+        weights[i] = result.x
+        x, step = result.x, result.step
+
+    # Summarized like a ChosenSummarizer, e.g. with its sample standard deviation
+    loadings = weights @ factors
+    means = loadings.mean(axis=1)
+    stdevs = loadings.std(axis=1, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe_ratios = means / stdevs
+    frontier_points = pd.DataFrame({
+        'risk_aversion': risk_aversions,
+        'mean': means,
+        'stdev': stdevs,
+        'expense_ratio': weights @ np.asarray(df.expense_ratio, dtype=float) if 'expense_ratio' in df.columns else np.nan,
+        'sharpe_ratio': sharpe_ratios,
+        'funds': (np.round(weights, 3) > 0).sum(axis=1)
+    })
+    return EfficientFrontier(df, frontier_points, pd.DataFrame(weights, columns=df.index), RELEVANT_COLUMNS)
+
+def variance_objective_function(x, factor_means, factor_var_covar_root, risk_aversion):
+    """
+    @return [tuple] -(mean - risk_aversion / 2 * variance), and its gradient
+    """
+    deviation = np.matmul(x, factor_var_covar_root)
+    objective = -np.matmul(factor_means, x) + risk_aversion / 2 * np.matmul(deviation, deviation)
+    gradient = -factor_means + risk_aversion * np.matmul(factor_var_covar_root, deviation)
+    return objective, gradient
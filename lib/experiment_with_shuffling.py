@@ -1,31 +1,80 @@
-from lib.sharpe_ratio_solver import choose_best
+from concurrent.futures import ProcessPoolExecutor
+from lib.sharpe_ratio_solver import choose_best, choose_best_of_samples, maximize_sharpe_ratio_by_projected_gradient, record_solver_result
 from lib.chosen_summarizer import ChosenSummarizer
-import matplotlib.pyplot as plt
 import numpy as np
+import os
 import pandas as pd
 
-def experiment_with_shuffling(df, market_type):
-    results_df = pd.DataFrame()
-    chosen_summarizers = []
-
-    for i in range(0, 100):
-        print(i)
-        # Randomly sample 80% of the data
-        chosen_summarizer = choose_best(df.sample(frac=0.8))
-        expense_ratio = chosen_summarizer.summarize(relevant_columns=['expense_ratio']).expense_ratio
-        results_df = results_df.append(
-            {
-                'mean': chosen_summarizer.mean(),
-                # 'stdev': chosen_summarizer.stdev(),
-                'sharpe_ratio': chosen_summarizer.sharpe_ratio(),
-                'sharpe_ratio_to_expense_ratio': chosen_summarizer.sharpe_ratio() / expense_ratio
-            },
-            ignore_index=True
-        )
-        chosen_summarizers.append(chosen_summarizer)
+# The data frame to resample, and the allocations to warm start from, set once
+# per worker process rather than pickled along with every iteration
+_worker_df = None
+_worker_warm_start = None
+
+def _set_worker_df(df, warm_start=None):
+    global _worker_df, _worker_warm_start
+    _worker_df = df
+    _worker_warm_start = warm_start
+
+def _choose_best_of_sample(seed):
+    # Randomly sample 80% of the data
+    sample = _worker_df.sample(frac=0.8, random_state=np.random.PCG64(seed))
+    # The batched solver's steps, so that both ways choose the same funds
+    return choose_best(sample, warm_start=_worker_warm_start, solver=maximize_sharpe_ratio_by_projected_gradient)
+
+def experiment_with_shuffling(df, market_type, iterations=100, workers=None, seed=0, warm_start=False, batched=True):
+    """
+    @param [pandas.core.frame.DataFrame] df The funds to choose from
+    @param [string] market_type The market type, e.g. Emerging
+    @param [int] iterations The count of random samples to choose the best funds from
+    @param [int] workers The count of processes to spread the iterations across, defaulting to the CPU count
+    @param [int] seed The master seed. Each iteration gets its own seed from it, so results don't depend on the count of workers.
+    @param [Boolean] warm_start If True, start every iteration's solver from the best allocations for all of the data
+    @param [Boolean] batched If True, solve every iteration's sample at once, see
+        `choose_best_of_samples`, rather than each with its own solver call
+        spread across the workers
+    @return [pandas.core.frame.DataFrame] Each iteration's mean, sharpe_ratio and sharpe_ratio_to_expense_ratio, best last
+    """
+    workers = workers or os.cpu_count()
+    seeds = np.random.SeedSequence(seed).spawn(iterations)
+    warm_start_allocation = choose_best(df.copy()).chosen.allocation if warm_start else None
+
+    if batched:
+        # The same samples as _choose_best_of_sample's
+        samples = [df.sample(frac=0.8, random_state=np.random.PCG64(iteration_seed)).index for iteration_seed in seeds]
+        chosen_summarizers = choose_best_of_samples(df, samples, warm_start=warm_start_allocation)
+    elif workers == 1:
+        _set_worker_df(df, warm_start_allocation)
+        chosen_summarizers = [_choose_best_of_sample(iteration_seed) for iteration_seed in seeds]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_set_worker_df, initargs=(df, warm_start_allocation)) as executor:
+            chunksize = max(1, iterations // (workers * 4))
+            chosen_summarizers = list(executor.map(_choose_best_of_sample, seeds, chunksize=chunksize))
+        # The workers' counts stay in their processes, so count their solver runs here
+        for chosen_summarizer in chosen_summarizers:
+            record_solver_result(chosen_summarizer.solver_result)
+
+    means = np.empty(iterations)
+    sharpe_ratios = np.empty(iterations)
+    expense_ratios = np.empty(iterations)
+    solver_iterations = np.empty(iterations, dtype=int)
+    solver_evaluations = np.empty(iterations, dtype=int)
+    for i, chosen_summarizer in enumerate(chosen_summarizers):
+        means[i] = chosen_summarizer.mean()
+        sharpe_ratios[i] = chosen_summarizer.sharpe_ratio()
+        expense_ratios[i] = chosen_summarizer.summarize(relevant_columns=['expense_ratio']).expense_ratio
+        solver_iterations[i] = chosen_summarizer.solver_result.nit
+        solver_evaluations[i] = chosen_summarizer.solver_result.nfev
+    print(f'Solver took {solver_iterations.sum()} iterations and {solver_evaluations.sum()} function evaluations over {iterations} samples')
+    results_df = pd.DataFrame({
+        'mean': means,
+        'sharpe_ratio': sharpe_ratios,
+        'sharpe_ratio_to_expense_ratio': sharpe_ratios / expense_ratios
+    })
 
     results_df = results_df.sort_values(by=['sharpe_ratio_to_expense_ratio'])
 
+    # Only the plot needs it, and it's slow to import
+    import matplotlib.pyplot as plt
     _, axs = plt.subplots(2, 1, sharex=True)
     means_line, = axs[0].plot(results_df.sharpe_ratio_to_expense_ratio, results_df['mean'], 'o', color='blue', label='Mean', linestyle='-')
     stdevs_line, = axs[1].plot(results_df.sharpe_ratio_to_expense_ratio, results_df.sharpe_ratio, 'o', color='red', label='Sharpe Ratio', linestyle='-')
@@ -39,3 +88,5 @@ def experiment_with_shuffling(df, market_type):
     for i in results_df.sort_values(by=['sharpe_ratio_to_expense_ratio'], ascending=False).round(3).head().index:
         print(chosen_summarizers[i].summary())
         print()
+
+    return results_df
@@ -0,0 +1,186 @@
+from lib.instrumentation import timed
+import numpy as np
+import pandas as pd
+# To turn t-values into p-values, without importing all of scipy.stats
+from scipy import special
+
+INTERCEPT = 'Intercept'
+
+FIVE_FACTORS = [
+    'market_minus_risk_free',
+    'small_minus_big',
+    'high_minus_low',
+    'robust_minus_weak',
+    'conservative_minus_aggressive'
+]
+
+class FactorRegressionResults:
+    def __init__(self, params, tvalues, pvalues, nobs):
+        """
+        @param [pandas.core.frame.DataFrame] params Tickers (rows) by terms (columns)
+        @param [pandas.core.frame.DataFrame] tvalues Tickers (rows) by terms (columns)
+        @param [pandas.core.frame.DataFrame] pvalues Tickers (rows) by terms (columns)
+        @param [pandas.core.series.Series] nobs The count of months used for each ticker
+        """
+        self.params = params
+        self.tvalues = tvalues
+        self.pvalues = pvalues
+        self.nobs = nobs
+
+    def to_data_frame(self):
+        """
+        Long format, one row per ticker and term, like the per-ticker
+        statsmodels results used to be concatenated into.
+        @return [pandas.core.frame.DataFrame] With columns coef, tvalue, pvalue, factor, ticker
+        """
+        df = pd.DataFrame({
+            'coef': self.params.stack(),
+            'tvalue': self.tvalues.stack(),
+            'pvalue': self.pvalues.stack()
+        })
+        df['ticker'] = df.index.get_level_values(0)
+        df['factor'] = df.index.get_level_values(1)
+        df.index = df.factor.values
+        return df[['coef', 'tvalue', 'pvalue', 'factor', 'ticker']]
+
+def excess_returns(returns, factor_returns):
+    """
+    Aligns the returns to the factor returns' months and subtracts the risk
+    free rate from them.
+    @param [pandas.core.frame.DataFrame] returns Months (rows) by tickers (columns)
+    @param [pandas.core.frame.DataFrame] factor_returns Months (rows) by factors (columns), including risk_free
+    @return [pandas.core.frame.DataFrame] Months (rows) by tickers (columns), NaN where a ticker has no return
+    """
+    returns = returns.reindex(factor_returns.index).astype(float)
+    return returns.sub(factor_returns.risk_free.astype(float), axis='index')
+
+def design_matrix(factor_returns, factors=FIVE_FACTORS):
+    """
+    @param [pandas.core.frame.DataFrame] factor_returns Months (rows) by factors (columns)
+    @param [list] factors The factors to regress on, in order
+    @return [numpy.ndarray] Months by (intercept + factors), NaN rows left in place
+    """
+    factor_values = np.asarray(factor_returns[factors], dtype=float)
+    return np.column_stack([np.ones(len(factor_values)), factor_values])
+
+def regression_inputs(excess_returns, factor_returns, factors=FIVE_FACTORS):
+    """
+    @param [pandas.core.frame.DataFrame] excess_returns Months (rows) by tickers (columns)
+    @param [pandas.core.frame.DataFrame] factor_returns Months (rows) by factors (columns), aligned to excess_returns
+    @param [list] factors The factors to regress on, in order
+    @return [tuple] The months by terms design matrix X, the tickers by months
+        returns Y, and the tickers by months mask, True where both the ticker
+        and all the factors have data, which is what patsy's NA dropping kept [numpy.ndarray]
+    """
+    X = design_matrix(factor_returns, factors)
+    Y = np.asarray(excess_returns, dtype=float).T
+    return X, Y, np.isfinite(Y) & np.isfinite(X).all(axis=1)
+
+def zero_filled(X, Y, mask):
+    """
+    @param [numpy.ndarray] X Months by terms design matrix
+    @param [numpy.ndarray] Y Tickers by months
+    @param [numpy.ndarray] mask Tickers by months, True where the month is used
+    @return [tuple] X and Y with zeros for the months that aren't used, so
+        that they add nothing to any sum over months, and the mask as weights W [numpy.ndarray]
+    """
+    return np.where(np.isfinite(X), X, 0), np.where(mask, Y, 0), mask.astype(float)
+
+def month_outer_products(X):
+    """
+    @param [numpy.ndarray] X Months by terms design matrix, zero filled
+    @return [numpy.ndarray] Months by terms², each month's x x' flattened, so
+        that a weighted sum of them over months is a single matrix product
+    """
+    return (X[:, :, None] * X[:, None, :]).reshape(len(X), X.shape[1] * X.shape[1])
+
+def cross_products(X, Y, mask):
+    """
+    @param [numpy.ndarray] X Months by terms design matrix
+    @param [numpy.ndarray] Y Tickers by months
+    @param [numpy.ndarray] mask Tickers by months, True where the month is used
+    @return [tuple] Every ticker's X'WX, X'Wy, y'Wy and count of months used [numpy.ndarray]
+    """
+    X, Y, W = zero_filled(X, Y, mask)
+    n_terms = X.shape[1]
+    # Every ticker's X'WX, as a single (tickers x months) @ (months x terms²) product
+    gram = (W @ month_outer_products(X)).reshape(len(Y), n_terms, n_terms)
+    return gram, Y @ X, (Y ** 2).sum(axis=1), W.sum(axis=1)
+
+def solve_normal_equations(gram, xty, yty, nobs):
+    """
+    Solves the normal equations of every ticker, with the intercept as the
+    first term.
+    @param [numpy.ndarray] gram Tickers by terms by terms, X'WX
+    @param [numpy.ndarray] xty Tickers by terms, X'Wy
+    @param [numpy.ndarray] yty Tickers, y'Wy
+    @param [numpy.ndarray] nobs Tickers, the count of months used
+    @return [tuple] params, tvalues, pvalues and adjusted R² [numpy.ndarray]
+    """
+    gram_inverse, rank = pseudo_inverse_and_rank(gram)
+    params = np.einsum('tij,tj->ti', gram_inverse, xty)
+    # The sum of squared residuals, (y - Xb)'(y - Xb), from the cross products alone
+    ssr = yty - 2 * np.einsum('ti,ti->t', params, xty) + np.einsum('ti,tij,tj->t', params, gram, params)
+    # The intercept's column is all ones, so X'y's first entry is the sum of y
+    tss = yty - xty[:, 0] ** 2 / np.where(nobs > 0, nobs, np.nan)
+    df_resid = nobs - rank
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(df_resid > 0, ssr / df_resid, np.nan)
+        bse = np.sqrt(scale[:, None] * np.diagonal(gram_inverse, axis1=1, axis2=2))
+        tvalues = params / bse
+        pvalues = 2 * special.stdtr(df_resid[:, None], -np.abs(tvalues))
+        rsquared_adj = np.where(df_resid > 0, 1 - (nobs - 1) / df_resid * ssr / tss, np.nan)
+    return params, tvalues, pvalues, rsquared_adj
+
+def pseudo_inverse_and_rank(gram):
+    """
+    Like np.linalg.pinv and np.linalg.matrix_rank, with their default
+    tolerances, but from a single eigendecomposition of each matrix rather
+    than an SVD each.
+    @param [numpy.ndarray] gram Tickers by terms by terms, symmetric
+    @return [tuple] The pseudo-inverses, and the ranks [numpy.ndarray]
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(gram)
+    magnitudes = np.abs(eigenvalues)
+    largest = magnitudes.max(axis=1, keepdims=True, initial=0)
+    kept = magnitudes > 1e-15 * largest
+    inverse_eigenvalues = np.where(kept, 1 / np.where(kept, eigenvalues, 1), 0)
+    gram_inverse = np.einsum('tij,tj,tkj->tik', eigenvectors, inverse_eigenvalues, eigenvectors)
+    rank = (magnitudes > largest * gram.shape[-1] * np.finfo(float).eps).sum(axis=1)
+    return gram_inverse, rank
+
+@timed('factor_regression.fit')
+def fit(excess_returns, factor_returns, factors=FIVE_FACTORS):
+    """
+    Runs an OLS regression of every ticker's excess returns on the factors in
+    one vectorized pass. Each ticker only uses the months where both it and
+    all the factors have data, see `regression_inputs`.
+    @param [pandas.core.frame.DataFrame] excess_returns Months (rows) by tickers (columns)
+    @param [pandas.core.frame.DataFrame] factor_returns Months (rows) by factors (columns), aligned to excess_returns
+    @param [list] factors The factors to regress on, in order
+    @return [FactorRegressionResults]
+    """
+    X, Y, mask = regression_inputs(excess_returns, factor_returns, factors)
+    return fit_masked(X, Y, mask, excess_returns.columns, [INTERCEPT] + list(factors))
+
+def fit_masked(X, Y, mask, tickers, terms):
+    """
+    @param [numpy.ndarray] X Months by terms design matrix
+    @param [numpy.ndarray] Y Tickers by months
+    @param [numpy.ndarray] mask Tickers by months, True where the month is used
+    @param [list] tickers Labels for the rows of Y
+    @param [list] terms Labels for the columns of X
+    @return [FactorRegressionResults]
+    """
+    gram, xty, yty, nobs = cross_products(X, Y, mask)
+    params, tvalues, pvalues, _ = solve_normal_equations(gram, xty, yty, nobs)
+
+    def frame(values):
+        return pd.DataFrame(values, index=pd.Index(tickers, name='ticker'), columns=terms)
+
+    return FactorRegressionResults(
+        frame(params),
+        frame(tvalues),
+        frame(pvalues),
+        pd.Series(nobs, index=pd.Index(tickers, name='ticker'))
+    )
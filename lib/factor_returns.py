@@ -1,41 +1,132 @@
+from db.bulk_upsert import bulk_upsert
 from db.db import Session
 from db.factor_return import FactorReturn
 from db.market_type import MarketType
+from db.read_frame import read_frame
 from lib.factor_returns_downloader import FactorReturnsDownloader
-# Pandas to read and write sql
-import pandas as pd
+from lib.instrumentation import timed
+from lib.snapshot_cache import SnapshotCache
+import numpy as np
+from sqlalchemy.sql import func
 
 class FactorReturns:
     @staticmethod
     def download_and_write_data():
         for market_type_name, data_frame in FactorReturnsDownloader.download_all().items():
-            FactorReturns.write(market_type_name, data_frame)
+            FactorReturns.sync(market_type_name, data_frame)
 
     @staticmethod
-    def write(market_type_name, data_frame):
+    @timed('factor_returns.refresh')
+    def refresh(changed_only=True):
+        """
+        Re-downloads the factor returns that have changed since the last
+        download, and writes just the months that are new or changed.
+        @param [Boolean] changed_only If False, syncs every market type, not
+            just the ones whose files changed
+        @raise [urllib.error.URLError] If a file can't be downloaded
+        @return [dict] For each synced market type, the key is its name, and the value is the count of months written
+        """
+        return {
+            market_type_name: FactorReturns.sync(market_type_name, data_frame)
+            for market_type_name, data_frame in FactorReturnsDownloader.refresh_all(changed_only=changed_only).items()
+        }
+
+    @staticmethod
+    @timed('factor_returns.sync')
+    def sync(market_type_name, data_frame):
+        """
+        Upserts the months after the last one in the DB, plus any earlier
+        months whose values have been revised, and leaves the rest alone.
+        It's all one transaction, so concurrent readers see either the old
+        rows or the new ones, never an empty or half-written market type.
+        @param [String] market_type_name The market type, e.g. Emerging
+        @param [pandas.core.frame.DataFrame] data_frame Factor returns, with an occurred_at column
+        @return [int] The count of months written
+        """
         session = Session()
+        market_types = session.query(MarketType).filter(MarketType.name == market_type_name)
+        # Lock the market type, so that concurrent syncs of it take turns.
+        # DuckDB can't, but only one process can open it for writing anyway.
+        if session.get_bind().dialect.name != 'duckdb':
+            market_types = market_types.with_for_update()
+        market_type = market_types.one()
         factor_returns = FactorReturn.query_by_market_type_name(market_type_name)
-        if not session.query(factor_returns.exists()).scalar():
-            market_type = session.query(MarketType).filter(MarketType.name == market_type_name).one()
-            data_frame['market_type_id'] = market_type.id
-            session.add_all([FactorReturn(**row) for _, row in data_frame.iterrows()])
-            session.commit()
+        last_occurred_at = factor_returns.with_entities(func.max(FactorReturn.occurred_at)).scalar()
+
+        changed = data_frame.drop(columns=['market_type_id'], errors='ignore')
+        if last_occurred_at is not None:
+            later = (changed.occurred_at > last_occurred_at).to_numpy()
+            # Only the months up to the last one can have been revised
+            existing = read_frame(factor_returns.statement, session.get_bind()).set_index('occurred_at')
+            incoming = changed[~later].set_index('occurred_at')
+            known = incoming.index.isin(existing.index)
+            existing = existing.reindex(incoming.index)[incoming.columns].astype('float64')
+            same_values = (np.isclose(existing, incoming, rtol=0, atol=10**-12) | (existing.isna() & incoming.isna())).all(axis='columns')
+            revised = np.zeros(len(changed), dtype=bool)
+            revised[~later] = ~(known & same_values.to_numpy())
+            changed = changed[later | revised]
+
+        changed = changed.assign(market_type_id=market_type.id)
+        count = bulk_upsert(session.connection(), FactorReturn.__table__, changed, ['market_type_id', 'occurred_at'])
+        session.commit()
+        if count:
+            SnapshotCache().invalidate('factor_returns')
+        return count
 
     @staticmethod
+    @timed('factor_returns.fetch')
     def fetch(market_type_name, force_refresh=False):
         """
         @param [String] market_type_name The market type, e.g. Emerging
-        @param [Boolean] force_refresh If True, will wipe data and reimport it.
+        @param [Boolean] force_refresh If True, will re-download the data and
+            sync it, rather than just importing it if it's missing.
         @raise [???] If file can't be found
         @raise [???] If the file isn't a CSV
         @return [pandas.core.frame.DataFrame]
         """
         session = Session()
-        # If force_refresh, delete the data so that the rest of the code here
-        # picks up on the need to re-download and write it.
         if force_refresh:
-            FactorReturn.delete_by_market_type_name(market_type_name)
+            FactorReturns.refresh(changed_only=False)
         factor_returns = FactorReturn.query_by_market_type_name(market_type_name)
         if not session.query(factor_returns.exists()).scalar():
             FactorReturns.download_and_write_data()
-        return pd.read_sql(factor_returns.statement, factor_returns.session.bind)
+        return read_frame(factor_returns.statement, factor_returns.session.bind)
+
+    @staticmethod
+    @timed('factor_returns.fetch_snapshot')
+    def fetch_snapshot(market_type_name):
+        """
+        Like `fetch`, but as float64 columns indexed by occurred_at, and from a
+        local snapshot unless the factor returns in the DB have changed since.
+        @param [String] market_type_name The market type, e.g. Emerging
+        @return [pandas.core.frame.DataFrame]
+        """
+        version = FactorReturns.data_version(market_type_name)
+        if version is None:
+            FactorReturns.fetch(market_type_name)
+            version = FactorReturns.data_version(market_type_name)
+
+        def load():
+            return FactorReturns.fetch(market_type_name).\
+                set_index('occurred_at').\
+                drop(columns=['id', 'market_type_id']).\
+                astype('float64')
+        return SnapshotCache().fetch(f'factor_returns/{market_type_name}', version, load)
+
+    @staticmethod
+    def data_version(market_type_name):
+        """
+        @param [String] market_type_name The market type, e.g. Emerging
+        @return [string] A fingerprint of the market type's factor returns in
+            the DB, or None if there are none
+        """
+        # Weighted by id, so that a month revised in place, or values swapped
+        # between months, changes them too
+        count, max_id, *checksums = FactorReturn.query_by_market_type_name(market_type_name).\
+            with_entities(
+                func.count(FactorReturn.id),
+                func.max(FactorReturn.id),
+                *[func.sum(column * FactorReturn.id) for column in FactorReturn.value_columns()]
+            ).\
+            one()
+        return SnapshotCache.version(count, max_id, *checksums) if count else None
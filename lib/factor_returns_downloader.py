@@ -1,20 +1,23 @@
-# To find the last day of the month
-import calendar
-# To parse the CSV
-import csv
-# To convert the 'occurred_at' values
-import datetime
+# To download the data sources in parallel
+from concurrent.futures import ThreadPoolExecutor
 # To help merging data frames
 import functools
+# To tell whether a downloaded file has changed
+import hashlib
+# To read the CSV out of the zip file as text
+import io
+from lib.instrumentation import Instrumentation
 # To do some conversions and to merge data frames
 import pandas as pd
 # To download the Fama French data from the web
 import urllib.request
+# To keep track of the downloaded files' HTTP caching headers and hashes
+import json
 # To unzip the downloaded zip file
 import zipfile
 
-# To check if a file exists
-from os import path
+# To check if a file exists, and to replace it
+from os import path, replace
 
 class FactorReturnsDownloader:
     class BaseDataSource:
@@ -25,40 +28,61 @@ class FactorReturnsDownloader:
         def market_type(self):
             return self.__market_type
 
-        def set_csv_filename(self, given_filename):
-            self.__csv_filename = given_filename
+        BASE_URL = 'http://mba.tuck.dartmouth.edu/pages/faculty/ken.french/ftp'
 
-        def csv_filename(self):
-            return f'downloads/{self.__csv_filename}'
-
-        def url(self):
-            return f'http://mba.tuck.dartmouth.edu/pages/faculty/ken.french/ftp/{self.__filename}_CSV.zip'
+        def url(self, base_url=BASE_URL):
+            return f'{base_url}/{self.__filename}_CSV.zip'
 
         def zip_filename(self):
             return f'downloads/{self.__filename}_CSV.zip'
 
+        def metadata_filename(self):
+            return f'downloads/{self.__filename}_CSV.json'
+
         DATE_FORMAT = '%Y%m'
 
-        @classmethod
-        def parse_date(self, given_date):
-            d = datetime.datetime.strptime(given_date.strip(), self.DATE_FORMAT).date()
-            return datetime.date(d.year, d.month, calendar.monthrange(d.year, d.month)[-1])
+        def to_occurred_at(self, dates):
+            """
+            @param [pandas.core.series.Series] dates Parsed with DATE_FORMAT
+            @return [pandas.core.series.Series] The last day of each month
+            """
+            return dates + pd.offsets.MonthEnd(0)
 
         MISSING = -99.99
 
-        @classmethod
-        def parse_float(self, given_float):
-            f = float(given_float)
-            return None if f == self.MISSING else f / 100
+        def parse(self, text):
+            """
+            Parses the first table in a Ken French CSV file, e.g. the monthly
+            factors, which is followed by the annual ones. Rows that don't have
+            a value for every column or don't start with a date are dropped.
+            @param [string] text The contents of the CSV file
+            @return [pandas.core.frame.DataFrame]
+            """
+            lines = text.splitlines()
+            # The table starts after its header, e.g. ",Mkt-RF,SMB,HML,RMW,CMA,RF",
+            # and ends at the next blank line
+            header = next((i for i, line in enumerate(lines) if line.startswith(',')), len(lines))
+            end = next((i for i in range(header + 1, len(lines)) if not lines[i].strip()), len(lines))
 
-        def parse(self, given_row):
-            if not len(given_row) == len(self.columns()):
-                return
-            try:
-                head, *tail = given_row
-                return [self.parse_date(head)] + [self.parse_float(el) for el in tail]
-            except ValueError:
-                return
+            columns = self.columns()
+            table = pd.read_csv(
+                io.StringIO('\n'.join(lines[header + 1:end])),
+                header=None,
+                names=columns,
+                index_col=False,
+                dtype={columns[0]: str},
+                on_bad_lines='skip',
+                # Parse floats exactly the way Python's float() does
+                float_precision='round_trip'
+            )
+            dates = pd.to_datetime(table[columns[0]].str.strip(), format=self.DATE_FORMAT, errors='coerce')
+            values = table[columns[1:]].apply(pd.to_numeric, errors='coerce')
+            valid = dates.notna() & values.notna().all(axis='columns')
+
+            values = values[valid]
+            data_frame = values.mask(values == self.MISSING) / 100
+            data_frame.insert(0, columns[0], self.to_occurred_at(dates[valid]).dt.date)
+            return data_frame.reset_index(drop=True)
 
 
     class FiveFactorDataSource(BaseDataSource):
@@ -77,12 +101,37 @@ class FactorReturnsDownloader:
         def columns(self):
             return self.__columns
 
+    class MomentumDataSource(BaseDataSource):
+        def __init__(self, market_type, filename):
+            self.__columns = [
+                'occurred_at',
+                'winners_minus_losers'
+            ]
+            super().__init__(market_type, filename)
+
+        def columns(self):
+            return self.__columns
+
     DATA_SOURCES = [
         FiveFactorDataSource('Emerging', 'Emerging_5_Factors'),
         FiveFactorDataSource('Developed ex US', 'Developed_ex_US_5_Factors'),
         FiveFactorDataSource('US', 'F-F_Research_Data_5_Factors_2x3'),
+        # Merged into the five factors of the same market type, see `merge`
+        MomentumDataSource('Emerging', 'Emerging_MOM_Factor'),
+        MomentumDataSource('Developed ex US', 'Developed_ex_US_Mom_Factor'),
+        MomentumDataSource('US', 'F-F_Momentum_Factor'),
     ]
 
+    @staticmethod
+    def merge(data_frames):
+        """
+        @param [list] data_frames A market type's data frames, in the order of DATA_SOURCES
+        @return [pandas.core.frame.DataFrame] The first data frame's months,
+            with the columns of the others, which are missing where they
+            don't have the month, e.g. momentum before it starts
+        """
+        return functools.reduce(lambda a, b: pd.merge(a, b, on='occurred_at', how='left'), data_frames)
+
     @staticmethod
     def download_all():
         """
@@ -96,7 +145,34 @@ class FactorReturnsDownloader:
             data_frame = FactorReturnsDownloader(data_source).to_data_frame()
             result[data_source.market_type()].append(data_frame)
         for key, data_frames in result.items():
-            result[key] = functools.reduce(lambda a, b: pd.merge(a, b, on='occurred_at'), data_frames)
+            result[key] = FactorReturnsDownloader.merge(data_frames)
+        return result
+
+    @staticmethod
+    def refresh_all(base_url=BaseDataSource.BASE_URL, changed_only=True):
+        """
+        Re-downloads every data source in parallel, but only if it has changed
+        since the last download, and parses only the ones that have.
+        @param [string] base_url Where to download the zip files from, e.g. a local file server
+        @param [Boolean] changed_only If False, parses every data source, changed or not
+        @raise [urllib.error.URLError] If a file can't be downloaded
+        @return [dict] For each market type with a changed data source, the key is a [string], and the value is a [pandas.core.frame.DataFrame]
+        """
+        downloaders = [FactorReturnsDownloader(data_source) for data_source in FactorReturnsDownloader.DATA_SOURCES]
+        with ThreadPoolExecutor(max_workers=len(downloaders)) as executor:
+            changed = list(executor.map(lambda downloader: downloader.refresh_zipfile(base_url), downloaders))
+
+        changed_market_types = {
+            downloader.data_source.market_type()
+            for downloader, is_changed in zip(downloaders, changed)
+            if is_changed or not changed_only
+        }
+        result = {}
+        for downloader in downloaders:
+            if downloader.data_source.market_type() in changed_market_types:
+                result.setdefault(downloader.data_source.market_type(), []).append(downloader.from_csv())
+        for key, data_frames in result.items():
+            result[key] = FactorReturnsDownloader.merge(data_frames)
         return result
 
     def __init__(self, data_source):
@@ -110,7 +186,6 @@ class FactorReturnsDownloader:
         @return [pandas.core.frame.DataFrame]
         """
         self.download_zipfile()
-        self.extract_zipfile()
         return self.from_csv()
 
     def download_zipfile(self):
@@ -123,30 +198,63 @@ class FactorReturnsDownloader:
         if path.isfile(self.data_source.zip_filename()):
             return
 
-        urllib.request.urlretrieve(self.data_source.url(), self.data_source.zip_filename())
+        with Instrumentation().http_call('ken_french'):
+            urllib.request.urlretrieve(self.data_source.url(), self.data_source.zip_filename())
 
-    def extract_zipfile(self):
+    def refresh_zipfile(self, base_url=BaseDataSource.BASE_URL):
         """
-        @raise [FileNotFoundError] If file can't be found
-        @raise [???] If the file isn't a zip file
-        @return [None]
+        Downloads the zip file with a conditional request, so that the server
+        can answer 304 Not Modified if it hasn't changed since the last time.
+        Even if the server sends it anyway, it only counts as changed if its
+        hash is different.
+        @param [string] base_url Where to download the zip file from
+        @raise [FileNotFoundError] If downloads directory doesn't exist
+        @raise [urllib.error.URLError] If file can't be downloaded
+        @return [Boolean] Whether the zip file changed
         """
-        with zipfile.ZipFile(self.data_source.zip_filename(), 'r') as z:
-            # Capture CSV's filename, as it varies slightly and thus cannot be arrived at programmatically
-            self.data_source.set_csv_filename(z.namelist()[0])
+        metadata = {}
+        if path.isfile(self.data_source.zip_filename()) and path.isfile(self.data_source.metadata_filename()):
+            with open(self.data_source.metadata_filename()) as metadata_file:
+                metadata = json.load(metadata_file)
 
-            if path.isfile(self.data_source.csv_filename()):
-                return
+        request = urllib.request.Request(self.data_source.url(base_url))
+        if metadata.get('etag'):
+            request.add_header('If-None-Match', metadata['etag'])
+        if metadata.get('last_modified'):
+            request.add_header('If-Modified-Since', metadata['last_modified'])
+        try:
+            with Instrumentation().http_call('ken_french'), urllib.request.urlopen(request) as response:
+                content = response.read()
+                headers = response.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return False
+            raise
 
-            z.extractall('downloads')
+        sha256 = hashlib.sha256(content).hexdigest()
+        changed = sha256 != metadata.get('sha256')
+        if changed:
+            # Replace the old file in one go, so a failed download can't leave half a file behind
+            with open(f'{self.data_source.zip_filename()}.tmp', 'wb') as zip_file:
+                zip_file.write(content)
+            replace(f'{self.data_source.zip_filename()}.tmp', self.data_source.zip_filename())
+        with open(self.data_source.metadata_filename(), 'w') as metadata_file:
+            json.dump({
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'sha256': sha256
+            }, metadata_file)
+        return changed
 
     def from_csv(self):
         """
+        Parses the CSV straight out of the zip file, without extracting it.
         @raise [FileNotFoundError] If file can't be found
+        @raise [zipfile.BadZipFile] If the file isn't a zip file
         @raise [???] If the file isn't a CSV
         @return [pandas.core.frame.DataFrame] A cleaned-up data frame, parsed from the CSV
         """
-        with open(self.data_source.csv_filename(), 'r') as input_file:
-            rows = [self.data_source.parse(row) for row in csv.reader(input_file)]
-            rows = [row for row in rows if row]
-            return pd.DataFrame(rows, columns=self.data_source.columns())
+        with zipfile.ZipFile(self.data_source.zip_filename(), 'r') as z:
+            # The CSV's filename varies slightly and thus cannot be arrived at programmatically
+            with z.open(z.namelist()[0]) as input_file:
+                return self.data_source.parse(io.TextIOWrapper(input_file, errors='replace').read())
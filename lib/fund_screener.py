@@ -0,0 +1,58 @@
+
+RENAMED_FACTORS = {
+    'market_minus_risk_free': 'mmrf',
+    'small_minus_big': 'smb',
+    'high_minus_low': 'hml',
+    'robust_minus_weak': 'rmw',
+    'conservative_minus_aggressive': 'cma'
+}
+
+def screen(df, investments_df, max_pvalue=0.05):
+    """
+    Turns the regression results into the funds to choose from: one row per
+    fund, with its statistically significant factor loadings, expense ratio
+    and dividend yield.
+    @param [pandas.core.frame.DataFrame] df The regression results, see `FactorRegressionResults.to_data_frame`,
+        optionally with the lower and upper columns of `BootstrapResults.to_data_frame`
+    @param [pandas.core.frame.DataFrame] investments_df With ticker, expense_ratio and dividend_yield columns
+    @param [float] max_pvalue Loadings with a higher p-value count as zero,
+        unless df has confidence intervals, then the ones whose interval has zero in it do
+    @return [pandas.core.frame.DataFrame] With columns ticker, mmrf, smb, hml, rmw, cma, expense_ratio, dividend_yield
+    """
+    # Remove inverse funds
+    inversed = df[(df.coef <= 0) & (df.factor == 'market_minus_risk_free')]
+    df = df[~df.ticker.isin(inversed.ticker)]
+    # Remove leveraged funds
+    leveraged = df[(df.coef >= 2) & (df.factor == 'market_minus_risk_free')]
+    df = df[~df.ticker.isin(leveraged.ticker)]
+    # Exclude 'Intercept' because it almost always very close to zero
+    df = df[~df.factor.isin(['Intercept'])]
+    # Exclude 'market_minus_risk_free' because it usually close to one
+    # df = df[~df.factor.isin(['market_minus_risk_free'])]
+
+    # Exclude statistically insignificant results
+    if {'lower', 'upper'} <= set(df.columns):
+        df = df[(df.lower > 0) | (df.upper < 0)]
+    else:
+        df = df[df.pvalue <= max_pvalue]
+
+    df = df[['ticker', 'factor', 'coef']].\
+        pivot(index='ticker', columns='factor', values='coef').\
+        rename(columns=RENAMED_FACTORS)
+    df = df.reset_index() # Make index integers rather than ticker
+
+    investments_df = investments_df[['ticker', 'expense_ratio', 'dividend_yield']]
+    investments_df = investments_df.fillna(0)
+    # Throw out funds missing their expense ratio
+    investments_df = investments_df[investments_df.expense_ratio > 0]
+
+    df = df.merge(investments_df, on='ticker')
+
+    # Replacing all NaNs with zero. This isn't perfect because:
+    # * Factors with just barely insignificant p-values will be zero, when in
+    #   fact they might be negative.
+    # * Dividend yield that are missing in the API will appear as zero.
+    df = df.fillna(0)
+
+    # Reorder columns
+    return df.filter(['ticker', 'mmrf', 'smb', 'hml', 'rmw', 'cma', 'expense_ratio', 'dividend_yield'])
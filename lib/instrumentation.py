@@ -0,0 +1,253 @@
+import contextlib
+import datetime
+from db.query_counter import QueryCounter
+import functools
+import json
+import os
+# To find the peak memory of the process
+import resource
+import threading
+import time
+# To find the peak memory of each stage, if asked to
+import tracemalloc
+
+class Instrumentation:
+    """
+    Keeps track of where a run's time goes: wall time, DB round trips and rows,
+    HTTP calls and their latency, solver iterations and peak memory, per stage
+    of the run and per instrumented function. It's a singleton, so the classes
+    it instruments don't need to have it passed around.
+    ```py
+    instrumentation = Instrumentation().start(engine(), profiler='cprofile')
+    with instrumentation.stage('regressions'):
+        ...
+    instrumentation.stop()
+    print(instrumentation.write_report())
+    ```
+    """
+    _instance = None
+
+    PROFILERS = ['cprofile', 'pyinstrument']
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(Instrumentation, cls).__new__(cls)
+            cls._instance.reset()
+        return cls._instance
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.started_at = None
+        self.perf_counter_at_start = None
+        self.seconds = None
+        self.query_counter = None
+        self.profiler = None
+        self.profiler_name = None
+        self.stages = []
+        self.timers = {}
+        self.http = {}
+        self.counters = {}
+        # The DB round trips and rows of other processes' runs, see `merge`
+        self.merged_queries = 0
+        self.merged_rows = 0
+
+    def start(self, engine=None, profiler=None, trace_memory=False):
+        """
+        @param [sqlalchemy.engine.Engine] engine The engine whose statements to count
+        @param [string] profiler One of PROFILERS, to also profile the run, or None
+        @param [Boolean] trace_memory If True, finds the peak memory allocated
+            during each stage with tracemalloc, which slows everything down
+        @raise [ValueError] If the profiler isn't one of PROFILERS
+        @raise [ImportError] If the profiler is pyinstrument, and it isn't installed
+        @return [Instrumentation]
+        """
+        self.reset()
+        self.started_at = datetime.datetime.now()
+        self.perf_counter_at_start = time.perf_counter()
+        if engine is not None:
+            self.query_counter = QueryCounter(engine).start()
+        if trace_memory:
+            tracemalloc.start()
+        if profiler:
+            self.start_profiler(profiler)
+        return self
+
+    def stop(self):
+        if self.profiler_name == 'cprofile':
+            self.profiler.disable()
+        elif self.profiler_name == 'pyinstrument':
+            self.profiler.stop()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if self.query_counter is not None:
+            self.query_counter.stop()
+        self.seconds = time.perf_counter() - self.perf_counter_at_start
+
+    def start_profiler(self, profiler):
+        if profiler not in self.PROFILERS:
+            raise ValueError(f'Profiler ({profiler}) is not one of {", ".join(self.PROFILERS)}')
+        if profiler == 'cprofile':
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            try:
+                import pyinstrument
+            except ImportError as e:
+                raise ImportError('Profiling with pyinstrument needs it installed, e.g. `pip install pyinstrument`') from e
+            self.profiler = pyinstrument.Profiler()
+            self.profiler.start()
+        self.profiler_name = profiler
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Measures one stage of the run, e.g. fetching the factor returns.
+        @param [string] name
+        """
+        queries, rows = self.sql_counts()
+        http_calls = sum(http['calls'] for http in self.http.values())
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started_at
+            end_queries, end_rows = self.sql_counts()
+            self.stages.append({
+                'name': name,
+                'seconds': seconds,
+                'sql_queries': end_queries - queries,
+                'sql_rows': end_rows - rows,
+                'http_calls': sum(http['calls'] for http in self.http.values()) - http_calls,
+                'peak_traced_memory_bytes': tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None,
+                'max_rss_bytes': self.max_rss_bytes()
+            })
+
+    @contextlib.contextmanager
+    def http_call(self, service):
+        """
+        Counts an HTTP call to the service, and how long it took.
+        @param [string] service E.g. yahoo
+        """
+        started_at = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            seconds = time.perf_counter() - started_at
+            # HTTP calls are made from many threads at once
+            with self.lock:
+                http = self.http.setdefault(service, {'calls': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+                http['calls'] += 1
+                http['errors'] += failed
+                http['seconds'] += seconds
+                http['max_seconds'] = max(http['max_seconds'], seconds)
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            timer = self.timers.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            timer['calls'] += 1
+            timer['seconds'] += seconds
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def sql_counts(self):
+        if self.query_counter is None:
+            return self.merged_queries, self.merged_rows
+        return self.query_counter.count + self.merged_queries, self.query_counter.rows + self.merged_rows
+
+    def merge(self, report):
+        """
+        Adds in the report of a run in another process, e.g. a worker's.
+        @param [dict] report See `report`
+        """
+        with self.lock:
+            self.merged_queries += report['sql_queries']
+            self.merged_rows += report['sql_rows']
+            self.stages += report['stages']
+            for name, timer in report['timers'].items():
+                merged = self.timers.setdefault(name, {'calls': 0, 'seconds': 0.0})
+                merged['calls'] += timer['calls']
+                merged['seconds'] += timer['seconds']
+            for service, http in report['http'].items():
+                merged = self.http.setdefault(service, {'calls': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+                merged['calls'] += http['calls']
+                merged['errors'] += http['errors']
+                merged['seconds'] += http['seconds']
+                merged['max_seconds'] = max(merged['max_seconds'], http['max_seconds'])
+            for name, value in report['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    @staticmethod
+    def max_rss_bytes():
+        # Linux reports it in kilobytes
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def report(self):
+        """
+        @return [dict]
+        """
+        queries, rows = self.sql_counts()
+        return {
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'seconds': self.seconds,
+            'sql_queries': queries,
+            'sql_rows': rows,
+            'max_rss_bytes': self.max_rss_bytes(),
+            'stages': self.stages,
+            'timers': self.timers,
+            'http': self.http,
+            'counters': self.counters,
+            'profile': self.profiler_name
+        }
+
+    DIRECTORY = 'reports'
+
+    def write_report(self, directory=DIRECTORY):
+        """
+        Writes the report as JSON, plus the profile if there is one, named
+        after when the run started.
+        @param [string] directory
+        @return [string] The report's filename
+        """
+        os.makedirs(directory, exist_ok=True)
+        filename = os.path.join(directory, f'run-{self.started_at:%Y%m%dT%H%M%S}')
+        with open(f'{filename}.json', 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+        if self.profiler_name == 'cprofile':
+            # For e.g. `python -m pstats` or snakeviz
+            self.profiler.dump_stats(f'{filename}.prof')
+        elif self.profiler_name == 'pyinstrument':
+            with open(f'{filename}.html', 'w') as profile_file:
+                profile_file.write(self.profiler.output_html())
+        return f'{filename}.json'
+
+def timed(name):
+    """
+    Decorates a function to add its calls and wall time to the timer of the
+    given name.
+    ```py
+    @staticmethod
+    @timed('factor_returns.sync')
+    def sync(market_type_name, data_frame):
+        ...
+    ```
+    @param [string] name
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                Instrumentation().add_time(name, time.perf_counter() - started_at)
+        return wrapper
+    return decorator
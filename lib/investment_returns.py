@@ -1,11 +1,16 @@
 from calendar import monthrange
 from datetime import date
+from db.bulk_upsert import bulk_upsert
 from db.db import Session
 from db.investment_return import InvestmentReturn
+from db.read_frame import read_frame
+import hashlib
+import json
+from lib.instrumentation import Instrumentation, timed
+from lib.snapshot_cache import SnapshotCache
 # Pandas to read sql into a dataframe
 import pandas as pd
-# Datareader to download price data from the Yahoo API
-import pandas_datareader as web
+from sqlalchemy import and_, case
 from sqlalchemy.sql import func
 import time
 
@@ -19,7 +24,10 @@ class InvestmentReturns:
         @raise [pandas_datareader._utils.RemoteDataError] If Yahoo API response is not 200
         @return [pandas.core.frame.DataFrame]
         """
-        data = web.get_data_yahoo(ticker_symbol, start, end)
+        # Only backfills need it, and it's slow to import
+        import pandas_datareader as web
+        with Instrumentation().http_call('yahoo'):
+            data = web.get_data_yahoo(ticker_symbol, start, end)
 
         # Keep only the adjusted close column
         data = data['Adj Close']
@@ -53,43 +61,160 @@ class InvestmentReturns:
         @raise [pandas_datareader._utils.RemoteDataError] If Yahoo API response is not 200
         @raise [requests.exceptions.ConnectionError] If unable to connect to the Yahoo API
         """
-        session = Session()
-        query = session.query(InvestmentReturn).\
-            filter(InvestmentReturn.ticker_symbol == ticker_symbol).\
-            filter(InvestmentReturn.occurred_at >= start).\
-            filter(InvestmentReturn.occurred_at <= end)
-        if session.query(query.exists()).scalar():
-            max_occurred_at = session.query(func.max(InvestmentReturn.occurred_at)).filter(InvestmentReturn.ticker_symbol == ticker_symbol).scalar()
-            if max_occurred_at < end:
-                print(f'Ticker price data for ({ticker_symbol}, {max_occurred_at}, {end}) not found in the DB, backfilling it from the Yahoo API')
-                new_start = date(max_occurred_at.year, max_occurred_at.month, 1)
-                percentage_change_data = InvestmentReturns.get_percentage_change_data(ticker_symbol, new_start, end)
-                if percentage_change_data.empty:
-                    print(f'WARNING: No new ticker price data found for ({ticker_symbol}, {max_occurred_at}, {end}) in the Yahoo API')
-                session.add_all([InvestmentReturn(**row) for _, row in percentage_change_data.iterrows()])
-                session.commit()
-        else:
-            print(f'Ticker price data for ({ticker_symbol}, {start}, {end}) not found in the DB, backfilling it from the Yahoo API')
-            one_month_ago = date.today() + pd.offsets.DateOffset(months=-1)
-            _, last_day = monthrange(one_month_ago.year, one_month_ago.month)
-            end = date(one_month_ago.year, one_month_ago.month, last_day)
-            percentage_change_data = InvestmentReturns.get_percentage_change_data(ticker_symbol, start, end)
-            session.add_all([InvestmentReturn(**row) for _, row in percentage_change_data.iterrows()])
-            session.commit()
+        backfill_range = InvestmentReturns.backfill_ranges([ticker_symbol], start, end).get(ticker_symbol)
+        if backfill_range is None:
+            return
+        new_start, new_end = backfill_range
+        print(f'Ticker price data for ({ticker_symbol}, {new_start}, {new_end}) not found in the DB, backfilling it from the Yahoo API')
+        percentage_change_data = InvestmentReturns.get_percentage_change_data(ticker_symbol, new_start, new_end)
+        if percentage_change_data.empty:
+            print(f'WARNING: No new ticker price data found for ({ticker_symbol}, {new_start}, {new_end}) in the Yahoo API')
+        InvestmentReturns.write(percentage_change_data)
 
     @staticmethod
-    def fetch(ticker_symbol, start, end):
+    @timed('investment_returns.backfill_ranges')
+    def backfill_ranges(ticker_symbols, start, end, chunk_size=1000):
         """
-        @param [string] ticker_symbol Ticker symbol of the stock
+        Works out, in one query per chunk of tickers, which date range each ticker needs
+        backfilled. If a ticker has returns between the given start and end
+        date, that's the gap after its latest return, if any. If it has none,
+        that's everything from the given start date through last month.
+        @param [list] ticker_symbols Ticker symbols of the stocks
         @param [Date] start Start date of the range (inclusive) of desired data
         @param [Date] end End date of the range (inclusive) of desired data
-        @raise [pandas_datareader._utils.RemoteDataError] If Yahoo API response is not 200
-        @raise [requests.exceptions.ConnectionError] If unable to connect to the Yahoo API
-        @return [pandas.core.frame.DataFrame]
+        @param [int] chunk_size The most ticker symbols to put in a single query
+        @return [dict] For each ticker needing a backfill, the key is its ticker symbol, and the value is a (start, end) [tuple]
+        """
+        session = Session()
+        in_range = case(
+            (and_(InvestmentReturn.occurred_at >= start, InvestmentReturn.occurred_at <= end), 1),
+            else_=0
+        )
+        ticker_symbols = list(ticker_symbols)
+        found = {}
+        for i in range(0, len(ticker_symbols), chunk_size):
+            found.update({
+                ticker_symbol: (max_occurred_at, count_in_range)
+                for ticker_symbol, max_occurred_at, count_in_range in session.query(
+                        InvestmentReturn.ticker_symbol,
+                        func.max(InvestmentReturn.occurred_at),
+                        func.sum(in_range)
+                    ).\
+                    filter(InvestmentReturn.ticker_symbol.in_(ticker_symbols[i:i + chunk_size])).\
+                    group_by(InvestmentReturn.ticker_symbol)
+            })
+
+        one_month_ago = date.today() + pd.offsets.DateOffset(months=-1)
+        _, last_day = monthrange(one_month_ago.year, one_month_ago.month)
+        end_of_last_month = date(one_month_ago.year, one_month_ago.month, last_day)
+
+        ranges = {}
+        for ticker_symbol in ticker_symbols:
+            max_occurred_at, count_in_range = found.get(ticker_symbol, (None, 0))
+            if count_in_range:
+                if max_occurred_at < end:
+                    ranges[ticker_symbol] = (date(max_occurred_at.year, max_occurred_at.month, 1), end)
+            else:
+                ranges[ticker_symbol] = (start, end_of_last_month)
+        return ranges
+
+    @staticmethod
+    @timed('investment_returns.write')
+    def write(data_frame):
+        """
+        Upserts the returns in bulk, so writing the same months twice is
+        harmless.
+        @param [pandas.core.frame.DataFrame] data_frame With ticker_symbol, occurred_at, and percentage_change columns
+        @return [int] The count of rows inserted or updated
+        """
+        session = Session()
+        count = bulk_upsert(
+            session.connection(),
+            InvestmentReturn.__table__,
+            data_frame[['ticker_symbol', 'occurred_at', 'percentage_change']],
+            ['ticker_symbol', 'occurred_at']
+        )
+        session.commit()
+        SnapshotCache().invalidate('investment_returns')
+        return count
+
+    @staticmethod
+    @timed('investment_returns.fetch_panel')
+    def fetch_panel(ticker_symbols, occurred_ats, chunk_size=1000, dtype='float64'):
+        """
+        Fetches the returns of many tickers with one query per chunk of
+        tickers, rather than one query per ticker.
+        @param [list] ticker_symbols Ticker symbols of the stocks
+        @param [list] occurred_ats The months to align the returns to, e.g. the factor returns' dates
+        @param [int] chunk_size The most ticker symbols to put in a single query
+        @param [string] dtype float64, or float32 to halve the memory
+        @return [pandas.core.frame.DataFrame] Months (rows) by tickers (columns), NaN where a ticker has no return
+        """
+        session = Session()
+        ticker_symbols = list(ticker_symbols)
+        data_frames = []
+        for i in range(0, len(ticker_symbols), chunk_size):
+            query = session.query(
+                    InvestmentReturn.ticker_symbol,
+                    InvestmentReturn.occurred_at,
+                    InvestmentReturn.percentage_change
+                ).\
+                filter(InvestmentReturn.ticker_symbol.in_(ticker_symbols[i:i + chunk_size])).\
+                filter(InvestmentReturn.occurred_at >= min(occurred_ats)).\
+                filter(InvestmentReturn.occurred_at <= max(occurred_ats))
+            data_frames.append(read_frame(query.statement, query.session.bind, dtype=dtype))
+
+        columns = ['ticker_symbol', 'occurred_at', 'percentage_change']
+        data = pd.concat(data_frames) if data_frames else pd.DataFrame(columns=columns)
+        return data.\
+            pivot(index='occurred_at', columns='ticker_symbol', values='percentage_change').\
+            reindex(index=occurred_ats, columns=ticker_symbols).\
+            astype(dtype)
+
+    @staticmethod
+    @timed('investment_returns.fetch_panel_snapshot')
+    def fetch_panel_snapshot(ticker_symbols, occurred_ats):
+        """
+        Like `fetch_panel`, but from a local snapshot unless the tickers'
+        returns in the DB have changed since.
+        @param [list] ticker_symbols Ticker symbols of the stocks
+        @param [list] occurred_ats The months to align the returns to, e.g. the factor returns' dates
+        @return [pandas.core.frame.DataFrame] Months (rows) by tickers (columns), float64, NaN where a ticker has no return
+        """
+        ticker_symbols = list(ticker_symbols)
+        occurred_ats = list(occurred_ats)
+        panel = hashlib.sha1(json.dumps([ticker_symbols, [str(d) for d in occurred_ats]]).encode()).hexdigest()
+        return SnapshotCache().fetch(
+            f'investment_returns/{panel}',
+            InvestmentReturns.data_version(ticker_symbols, occurred_ats),
+            lambda: InvestmentReturns.fetch_panel(ticker_symbols, occurred_ats)
+        )
+
+    @staticmethod
+    def data_version(ticker_symbols, occurred_ats, chunk_size=1000):
+        """
+        @param [list] ticker_symbols Ticker symbols of the stocks
+        @param [list] occurred_ats The months of interest
+        @param [int] chunk_size The most ticker symbols to put in a single query
+        @return [string] A fingerprint of the tickers' returns in the DB
         """
         session = Session()
-        query = session.query(InvestmentReturn).\
-            filter(InvestmentReturn.ticker_symbol == ticker_symbol).\
-            filter(InvestmentReturn.occurred_at >= start).\
-            filter(InvestmentReturn.occurred_at <= end)
-        return pd.read_sql(query.statement, query.session.bind)
+        ticker_symbols = list(ticker_symbols)
+        count, max_id, checksums = 0, None, []
+        for i in range(0, len(ticker_symbols), chunk_size):
+            # Weighted by id, so that a return revised in place, e.g. by a
+            # backfill's upsert, changes it too
+            chunk_count, chunk_max_id, checksum = session.query(
+                    func.count(InvestmentReturn.id),
+                    func.max(InvestmentReturn.id),
+                    func.sum(InvestmentReturn.percentage_change * InvestmentReturn.id)
+                ).\
+                filter(InvestmentReturn.ticker_symbol.in_(ticker_symbols[i:i + chunk_size])).\
+                filter(InvestmentReturn.occurred_at >= min(occurred_ats)).\
+                filter(InvestmentReturn.occurred_at <= max(occurred_ats)).\
+                one()
+            count += chunk_count
+            if chunk_max_id is not None:
+                max_id = chunk_max_id if max_id is None else max(max_id, chunk_max_id)
+            checksums.append(checksum)
+        return SnapshotCache.version(count, max_id, *checksums)
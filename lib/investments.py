@@ -1,10 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
 import datetime
-from db.db import Engine, sessionmaker
+from db.db import engine, sessionmaker
 from db.investment import Investment
 from db.queries.investment_query import InvestmentQuery
+from lib.instrumentation import Instrumentation, timed
 from os import environ
-import requests
-import yfinance as yf
 
 class Investments:
     # https://python-patterns.guide/gang-of-four/singleton/
@@ -13,7 +13,9 @@ class Investments:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(Investments, cls).__new__(cls)
-            session = sessionmaker(bind=Engine, query_cls=InvestmentQuery)
+            # Updates go through Core statements rather than these objects, so
+            # there's no need to reload them after each commit
+            session = sessionmaker(bind=engine(), query_cls=InvestmentQuery, expire_on_commit=False)
             cls._instance.query = session().query(Investment)
         return cls._instance
 
@@ -29,43 +31,60 @@ class Investments:
         self.backfill_facts_from_yahoo(market_type_name)
         self.backfill_facts_from_seeking_alpha(market_type_name)
 
-    def backfill_facts_from_yahoo(self, market_type_name):
+    @timed('investments.backfill_facts_from_yahoo')
+    def backfill_facts_from_yahoo(self, market_type_name, batch_size=50):
         """
         Looks for investments that are missing facts -- either their dividend
         yield, expense ratio, or inception date are null -- and attempts to
         backfill this data by scraping it from Yahoo.
         @param [string] market_type_name The market type by which to query
             investments
+        @param [int] batch_size How many tickers' facts to write to the DB at
+            once
         @raise [urllib.error.HTTPError] If Yahoo response is not 200
         """
+        # Only backfills need it, and it's slow to import
+        import yfinance as yf
+
         investments_missing_facts = self.query.\
             by_market_type_name(market_type_name).\
             missing_facts()
 
-        for investment in investments_missing_facts:
-            ticker_symbol = investment.ticker_symbol
-            print(f'Either expense ratio, dividend yield, or inception date is null for ({ticker_symbol}), backfilling this data from Yahoo')
-            info = yf.Ticker(ticker_symbol).info
-            dividend_yield = info.get('yield')
-            expense_ratio = info.get('annualReportExpenseRatio')
-            inception_date = info.get('fundInceptionDate')
-            payload = {}
-            if dividend_yield is not None and investment.dividend_yield is None:
-                payload['dividend_yield'] = dividend_yield
-            if expense_ratio is not None and investment.expense_ratio is None:
-                payload['expense_ratio'] = expense_ratio
-            if inception_date is not None and investment.inception_date is None:
-                payload['inception_date'] = datetime.datetime.fromtimestamp(inception_date)
-            if payload.keys():
-                self.query.update_by_ticker_symbol(ticker_symbol, payload)
+        with self.query.bulk_updater(batch_size) as updater:
+            for investment in investments_missing_facts:
+                ticker_symbol = investment.ticker_symbol
+                print(f'Either expense ratio, dividend yield, or inception date is null for ({ticker_symbol}), backfilling this data from Yahoo')
+                with Instrumentation().http_call('yahoo'):
+                    info = yf.Ticker(ticker_symbol).info
+                dividend_yield = info.get('yield')
+                expense_ratio = info.get('annualReportExpenseRatio')
+                inception_date = info.get('fundInceptionDate')
+                payload = {}
+                if dividend_yield is not None and investment.dividend_yield is None:
+                    payload['dividend_yield'] = dividend_yield
+                if expense_ratio is not None and investment.expense_ratio is None:
+                    payload['expense_ratio'] = expense_ratio
+                if inception_date is not None and investment.inception_date is None:
+                    payload['inception_date'] = datetime.datetime.fromtimestamp(inception_date)
+                if payload.keys():
+                    updater.add(ticker_symbol, payload)
+
+    SEEKING_ALPHA_ROOT_URL = 'https://seeking-alpha.p.rapidapi.com/symbols'
 
-    def backfill_facts_from_seeking_alpha(self, market_type_name):
+    @timed('investments.backfill_facts_from_seeking_alpha')
+    def backfill_facts_from_seeking_alpha(self, market_type_name, concurrency=8, root_url=SEEKING_ALPHA_ROOT_URL, batch_size=50):
         """
         Looks for investments that are missing facts -- either their dividend
         yield, expense ratio, or inception date are null -- and attempts to
-        backfill this data by querying the Seeking Alpha API.
+        backfill this data by querying the Seeking Alpha API. Requests for
+        many batches are in flight at once, over a shared pool of connections.
         @param [string] market_type_name The market type by which to query
             investments
+        @param [int] concurrency The most requests to have in flight at once
+        @param [string] root_url The Seeking Alpha API to query, e.g. a local
+            stub of it
+        @param [int] batch_size How many tickers' facts to write to the DB at
+            once
         @raise [urllib.error.HTTPError] If the HTTP response is not 200
         """
         investments_missing_facts = self.query.\
@@ -78,39 +97,52 @@ class Investments:
             for ndx in range(0, total_size, batch_size):
                 yield iterable[ndx:min(ndx + batch_size, total_size)]
 
-        root_url = 'https://seeking-alpha.p.rapidapi.com/symbols'
-        headers = {
+        import requests
+        http = requests.Session()
+        http.headers.update({
             'x-rapidapi-host': 'seeking-alpha.p.rapidapi.com',
             'x-rapidapi-key': environ['SEEKING_ALPHA_RAPIDAPI_KEY']
-        }
-        seeking_alpha_batch_size = 4 # Apparent hard cap?
-        for investments in batch(list(investments_missing_facts), seeking_alpha_batch_size):
-            ticker_symbols = [investment.ticker_symbol for investment in investments]
-            ticker_symbols_joined = ','.join(ticker_symbols)
-            print(f'Either expense ratio, dividend yield, or inception date is null for ({ticker_symbols_joined}), backfilling this data from the Seeking Alpha API')
+        })
+        # Keep a connection alive for every request that can be in flight
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+        http.mount('http://', adapter)
+        http.mount('https://', adapter)
 
-            querystring = {'symbols': ticker_symbols_joined}
-            profile_payloads = requests.\
-                request('GET', f'{root_url}/get-profile', headers=headers, params=querystring).\
-                json().\
-                get('data', [])
-            summary_payloads = requests.\
-                request('GET', f'{root_url}/get-summary', headers=headers, params=querystring).\
-                json().\
-                get('data', [])
-            profile_payloads = {profile_payload['id']: profile_payload['attributes'] for profile_payload in profile_payloads}
-            summary_payloads = {summary_payload['id']: summary_payload['attributes'] for summary_payload in summary_payloads}
+        def get_attributes(endpoint, ticker_symbols):
+            with Instrumentation().http_call('seeking_alpha'):
+                payloads = http.\
+                    get(f'{root_url}/{endpoint}', params={'symbols': ','.join(ticker_symbols)}).\
+                    json().\
+                    get('data', [])
+            return {payload['id']: payload['attributes'] for payload in payloads}
 
-            for investment in investments:
-                dividend_yield = summary_payloads.get(investment.ticker_symbol, {}).get('divYield')
-                expense_ratio = profile_payloads.get(investment.ticker_symbol, {}).get('expenseRatio')
-                inception_date = profile_payloads.get(investment.ticker_symbol, {}).get('inceptionDate')
-                payload = {}
-                if dividend_yield is not None and investment.dividend_yield is None:
-                    payload['dividend_yield'] = dividend_yield
-                if expense_ratio is not None and investment.expense_ratio is None:
-                    payload['expense_ratio'] = expense_ratio
-                if inception_date is not None and investment.inception_date is None:
-                    payload['inception_date'] = datetime.datetime.strptime(inception_date, '%m/%d/%Y')
-                if payload.keys():
-                    self.query.update_by_ticker_symbol(investment.ticker_symbol, payload)
+        seeking_alpha_batch_size = 4 # Apparent hard cap?
+        batches = list(batch(list(investments_missing_facts), seeking_alpha_batch_size))
+        with http, ThreadPoolExecutor(max_workers=concurrency) as executor, self.query.bulk_updater(batch_size) as updater:
+            responses = [
+                (
+                    executor.submit(get_attributes, 'get-profile', [investment.ticker_symbol for investment in investments]),
+                    executor.submit(get_attributes, 'get-summary', [investment.ticker_symbol for investment in investments])
+                )
+                for investments in batches
+            ]
+            # Write each batch as soon as it's in, while later batches are still in flight
+            for investments, (profile_response, summary_response) in zip(batches, responses):
+                ticker_symbols_joined = ','.join(investment.ticker_symbol for investment in investments)
+                print(f'Either expense ratio, dividend yield, or inception date is null for ({ticker_symbols_joined}), backfilling this data from the Seeking Alpha API')
+                profile_payloads = profile_response.result()
+                summary_payloads = summary_response.result()
+
+                for investment in investments:
+                    dividend_yield = summary_payloads.get(investment.ticker_symbol, {}).get('divYield')
+                    expense_ratio = profile_payloads.get(investment.ticker_symbol, {}).get('expenseRatio')
+                    inception_date = profile_payloads.get(investment.ticker_symbol, {}).get('inceptionDate')
+                    payload = {}
+                    if dividend_yield is not None and investment.dividend_yield is None:
+                        payload['dividend_yield'] = dividend_yield
+                    if expense_ratio is not None and investment.expense_ratio is None:
+                        payload['expense_ratio'] = expense_ratio
+                    if inception_date is not None and investment.inception_date is None:
+                        payload['inception_date'] = datetime.datetime.strptime(inception_date, '%m/%d/%Y')
+                    if payload.keys():
+                        updater.add(investment.ticker_symbol, payload)
@@ -0,0 +1,3 @@
+# The market types in `db/01_seeds.sql`, which each have their own factor
+# returns and investments
+MARKET_TYPES = ['US', 'Developed ex US', 'Emerging']
@@ -0,0 +1,136 @@
+from lib.factor_regression import FIVE_FACTORS, INTERCEPT, cross_products, design_matrix, solve_normal_equations
+from lib.instrumentation import timed
+import numpy as np
+import pandas as pd
+
+THREE_FACTORS = [
+    'market_minus_risk_free',
+    'small_minus_big',
+    'high_minus_low'
+]
+
+MOMENTUM = 'winners_minus_losers'
+
+# The models to compare, by name. The ones with momentum only get fit if the
+# factor returns have it, see `FactorReturnsDownloader.MomentumDataSource`.
+MODELS = {
+    'three_factor': THREE_FACTORS,
+    'carhart': THREE_FACTORS + [MOMENTUM],
+    'five_factor': FIVE_FACTORS,
+    'five_factor_momentum': FIVE_FACTORS + [MOMENTUM]
+}
+
+class ModelSuiteResults:
+    def __init__(self, params, tvalues, pvalues, rsquared_adj, nobs):
+        """
+        @param [dict] params For each model, the key is its name, and the value
+            is tickers (rows) by terms (columns) [pandas.core.frame.DataFrame]
+        @param [dict] tvalues Like params
+        @param [dict] pvalues Like params
+        @param [pandas.core.frame.DataFrame] rsquared_adj Tickers (rows) by models (columns)
+        @param [pandas.core.frame.DataFrame] nobs Tickers (rows) by models (columns), the count of months used
+        """
+        self.params = params
+        self.tvalues = tvalues
+        self.pvalues = pvalues
+        self.rsquared_adj = rsquared_adj
+        self.nobs = nobs
+
+    def to_data_frame(self):
+        """
+        The models side by side, one row per ticker and term.
+        @return [pandas.core.frame.DataFrame] With a coef, tvalue and pvalue column per model, e.g. five_factor_coef,
+            NaN where the model doesn't have the term, and a rsquared_adj column per model
+        """
+        columns = {}
+        for model in self.params:
+            columns[f'{model}_coef'] = self.params[model].stack(dropna=False)
+            columns[f'{model}_tvalue'] = self.tvalues[model].stack(dropna=False)
+            columns[f'{model}_pvalue'] = self.pvalues[model].stack(dropna=False)
+        df = pd.DataFrame(columns)
+        df.index.names = ['ticker', 'factor']
+        df = df.join(self.rsquared_adj.add_suffix('_rsquared_adj'), on='ticker')
+        return df.reset_index()
+
+    def summary(self):
+        """
+        @return [pandas.core.frame.DataFrame] For each model (rows), the count of
+            tickers fit, and the median of their adjusted R²
+        """
+        return pd.DataFrame({
+            'tickers': self.rsquared_adj.count(),
+            'median_rsquared_adj': self.rsquared_adj.median()
+        })
+
+def available_models(factor_returns, models=MODELS):
+    """
+    @param [pandas.core.frame.DataFrame] factor_returns Months (rows) by factors (columns)
+    @param [dict] models
+    @return [dict] The models whose factors are all in the factor returns,
+        with data for some months, e.g. not momentum in a DB that has the column but hasn't synced it yet
+    """
+    return {
+        name: factors
+        for name, factors in models.items()
+        if all(factor in factor_returns.columns and factor_returns[factor].notna().any() for factor in factors)
+    }
+
+@timed('model_suite.fit_models')
+def fit_models(excess_returns, factor_returns, models=MODELS):
+    """
+    Runs an OLS regression of every ticker's excess returns on each model's
+    factors. Every ticker's cross products (X'X, X'y and y'y) get computed
+    once, over the union of the models' factors, and each model is solved
+    from its submatrix of them, so another model costs a small solve per
+    ticker rather than another pass over the returns. Each model still only
+    uses the months where all of its own factors have data; models that
+    agree on those months share their cross products.
+    @param [pandas.core.frame.DataFrame] excess_returns Months (rows) by tickers (columns)
+    @param [pandas.core.frame.DataFrame] factor_returns Months (rows) by factors (columns), aligned to excess_returns
+    @param [dict] models For each model, the key is its name, and the value
+        is its factors [list]. Models whose factors aren't all in the factor
+        returns get skipped, see `available_models`.
+    @return [ModelSuiteResults]
+    """
+    models = available_models(factor_returns, models)
+    factors = [
+        factor for factor in factor_returns.columns
+        if any(factor in model_factors for model_factors in models.values())
+    ]
+    terms = [INTERCEPT] + factors
+    X = design_matrix(factor_returns, factors)
+    Y = np.asarray(excess_returns, dtype=float).T
+    tickers = pd.Index(excess_returns.columns, name='ticker')
+    has_return = np.isfinite(Y)
+
+    cross_products_by_months = {}
+    params, tvalues, pvalues, rsquared_adj, nobs = {}, {}, {}, {}, {}
+    for name, model_factors in models.items():
+        columns = [0] + [terms.index(factor) for factor in model_factors]
+        months = np.isfinite(X[:, columns]).all(axis=1)
+        key = months.tobytes()
+        if key not in cross_products_by_months:
+            cross_products_by_months[key] = cross_products(X, Y, has_return & months)
+        gram, xty, yty, n = cross_products_by_months[key]
+
+        model_params, model_tvalues, model_pvalues, model_rsquared_adj = solve_normal_equations(
+            gram[:, columns][:, :, columns],
+            xty[:, columns],
+            yty,
+            n
+        )
+        model_terms = [INTERCEPT] + list(model_factors)
+        # Every model's frames have all the terms, so that they line up side by side
+        params[name] = pd.DataFrame(model_params, index=tickers, columns=model_terms).reindex(columns=terms)
+        tvalues[name] = pd.DataFrame(model_tvalues, index=tickers, columns=model_terms).reindex(columns=terms)
+        pvalues[name] = pd.DataFrame(model_pvalues, index=tickers, columns=model_terms).reindex(columns=terms)
+        rsquared_adj[name] = model_rsquared_adj
+        nobs[name] = n
+
+    return ModelSuiteResults(
+        params,
+        tvalues,
+        pvalues,
+        pd.DataFrame(rsquared_adj, index=tickers),
+        pd.DataFrame(nobs, index=tickers)
+    )
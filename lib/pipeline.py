@@ -0,0 +1,284 @@
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+from db.db import Session, engine
+import io
+from lib import block_bootstrap, factor_regression, fund_screener
+from lib.efficient_frontier import EfficientFrontier, trace_frontier
+from lib.experiment_with_shuffling import experiment_with_shuffling
+from lib.factor_returns import FactorReturns
+from lib.instrumentation import Instrumentation
+from lib.investment_returns import InvestmentReturns
+from lib.investments import Investments
+from lib.market_types import MARKET_TYPES
+from lib.model_suite import MODELS, fit_models
+from lib.regression_cache import RegressionCache
+from lib.rolling_factor_regression import fit_rolling
+import os
+import pandas as pd
+from sqlalchemy.pool import StaticPool
+
+def analyze(market_type, factor_data, iterations=100, workers=None, seed=0, cache=False, batched=True, bootstrap=0):
+    """
+    Runs one market type's pipeline: fetches its investments and their
+    returns, regresses them on the factor returns, screens the funds for
+    significant loadings, and chooses the best allocations of them.
+    @param [string] market_type The market type, e.g. Emerging
+    @param [pandas.core.frame.DataFrame] factor_data The market type's factor returns, indexed by occurred_at
+    @param [int] iterations The count of random samples to choose the best funds from
+    @param [int] workers The count of processes to spread the iterations across, defaulting to the CPU count
+    @param [int] seed The master seed of experiment_with_shuffling
+    @param [Boolean] cache If True, reuses the cached results of the funds
+        whose data hasn't changed since they were cached, see `RegressionCache`,
+        rather than refit every fund
+    @param [Boolean] batched If False, solves each sample with its own solver
+        call, spread across the workers, see `experiment_with_shuffling`
+    @param [int] bootstrap If more than 0, screens the loadings by the
+        confidence intervals of this many block bootstrap replicates, rather
+        than by their p-values, see `screen_funds`
+    @return [tuple] The screened funds, one per row, and the results of experiment_with_shuffling [pandas.core.frame.DataFrame]
+    """
+    instrumentation = Instrumentation()
+    df = screen_funds(market_type, factor_data, cache, bootstrap, seed)
+
+    with instrumentation.stage(f'{market_type}/experiment_with_shuffling'):
+        results_df = experiment_with_shuffling(df, market_type, iterations=iterations, workers=workers, seed=seed, batched=batched)
+
+    return df, results_df
+
+def screen_funds(market_type, factor_data, cache=False, bootstrap=0, seed=0):
+    """
+    Fetches a market type's investments and their returns, regresses them on
+    the factor returns, and screens the funds for significant loadings.
+    @param [string] market_type The market type, e.g. Emerging
+    @param [pandas.core.frame.DataFrame] factor_data The market type's factor returns, indexed by occurred_at
+    @param [Boolean] cache If True, reuses the cached regression results, see `analyze`
+    @param [int] bootstrap If more than 0, the count of block bootstrap
+        replicates whose confidence intervals to screen the loadings by,
+        rather than by their p-values, see `block_bootstrap.bootstrap`
+    @param [int] seed The seed of the block bootstrap
+    @return [pandas.core.frame.DataFrame] The screened funds, one per row
+    """
+    instrumentation = Instrumentation()
+    investments_df, returns = fetch_returns(market_type, factor_data)
+
+    # Run every OLS regression in one pass. That takes less time than
+    # reading and writing the cache, so it only gets used when asked for.
+    with instrumentation.stage(f'{market_type}/regressions'):
+        excess_returns = factor_regression.excess_returns(returns, factor_data)
+        if cache:
+            regression_cache = RegressionCache()
+            df = regression_cache.fit(excess_returns, factor_data).to_data_frame()
+            print(f'Reused {regression_cache.hits} cached regressions, fit {regression_cache.misses}')
+        else:
+            df = factor_regression.fit(excess_returns, factor_data).to_data_frame()
+
+    # The OLS p-values assume the monthly residuals are independent, the
+    # block bootstrap's intervals don't
+    if bootstrap:
+        with instrumentation.stage(f'{market_type}/block_bootstrap'):
+            intervals = block_bootstrap.bootstrap(excess_returns, factor_data, replicates=bootstrap, seed=seed)
+            df = df.merge(intervals.to_data_frame(), on=['ticker', 'factor'])
+
+    # Keep the funds' significant loadings, one row per fund
+    with instrumentation.stage(f'{market_type}/screen'):
+        df = fund_screener.screen(df, investments_df)
+
+    return df
+
+def fetch_returns(market_type, factor_data):
+    """
+    @param [string] market_type The market type, e.g. Emerging
+    @param [pandas.core.frame.DataFrame] factor_data The market type's factor returns, indexed by occurred_at
+    @return [tuple] The investments to study, and their returns aligned to the
+        factor returns, skipping those with less than 12 months of them [pandas.core.frame.DataFrame]
+    """
+    instrumentation = Instrumentation()
+    ff_ends_at = factor_data.index.max()
+
+    # Get the investments to study
+    with instrumentation.stage(f'{market_type}/investments'):
+        print(f'Looking for investment returns through {ff_ends_at}')
+        investments_df = Investments().query.for_analysis(market_type, ff_ends_at).to_data_frame()
+        print(f'Found {len(investments_df)} investments of market type {market_type}')
+
+    # Get the returns of all the investments, already aligned to the FF data
+    with instrumentation.stage(f'{market_type}/investment_returns'):
+        returns = InvestmentReturns.fetch_panel_snapshot(investments_df.ticker, factor_data.index)
+        too_short = returns.columns[returns.count() < 12]
+        for ticker_symbol in too_short:
+            print(f'Less than 12 months of data, skipping {ticker_symbol}!')
+        returns = returns.drop(columns=too_short)
+
+    return investments_df, returns
+
+def compare_models(market_types=MARKET_TYPES, models=MODELS):
+    """
+    Fits every model of each market type's funds, see `model_suite.fit_models`,
+    and prints how well each model explains them.
+    @param [list] market_types E.g. ['US', 'Emerging']
+    @param [dict] models For each model, the key is its name, and the value is its factors [list]
+    @return [pandas.core.frame.DataFrame] The models side by side, see
+        `ModelSuiteResults.to_data_frame`, with a market_type column
+    """
+    instrumentation = Instrumentation()
+    data_frames = []
+    for market_type in market_types:
+        with instrumentation.stage(f'{market_type}/factor_returns'):
+            factor_data = FactorReturns.fetch_snapshot(market_type)
+        _, returns = fetch_returns(market_type, factor_data)
+        with instrumentation.stage(f'{market_type}/model_suite'):
+            excess_returns = factor_regression.excess_returns(returns, factor_data)
+            results = fit_models(excess_returns, factor_data, models)
+        skipped = [name for name in models if name not in results.params]
+        if skipped:
+            print(f'Skipping {", ".join(skipped)}, the {market_type} factor returns lack some of their factors')
+        print(results.summary())
+        data_frames.append(results.to_data_frame().assign(market_type=market_type))
+    return pd.concat(data_frames, ignore_index=True)
+
+def fit_rolling_loadings(market_types=MARKET_TYPES, window=36, step=1, min_observations=24):
+    """
+    Fits every fund's five-factor loadings over each rolling window of
+    months, see `rolling_factor_regression.fit_rolling`, and prints how many
+    funds have loadings in each market type's latest window.
+    @param [list] market_types E.g. ['US', 'Emerging']
+    @param [int] window The count of months in each window
+    @param [int] step The count of months between the ends of consecutive windows
+    @param [int] min_observations Windows where a fund has fewer months of returns than this are skipped
+    @return [pandas.core.frame.DataFrame] One row per fund and window with
+        loadings, see `RollingFactorRegressionResults.to_data_frame`, with a market_type column
+    """
+    instrumentation = Instrumentation()
+    data_frames = []
+    for market_type in market_types:
+        with instrumentation.stage(f'{market_type}/factor_returns'):
+            factor_data = FactorReturns.fetch_snapshot(market_type)
+        _, returns = fetch_returns(market_type, factor_data)
+        with instrumentation.stage(f'{market_type}/rolling_regressions'):
+            excess_returns = factor_regression.excess_returns(returns, factor_data)
+            results = fit_rolling(excess_returns, factor_data, window=window, step=step, min_observations=min_observations)
+        df = results.to_data_frame().dropna(subset=results.terms, how='all').reset_index()
+        if df.empty:
+            print(f'No {market_type} fund has {min_observations} months of returns in any {window} month window')
+        else:
+            latest = df[df.occurred_at == df.occurred_at.max()]
+            print(f'Fit {len(df)} windows of {df.ticker.nunique()} {market_type} funds, {len(latest)} of them in the window ending {latest.occurred_at.iloc[0]}')
+            print(latest[results.terms].median().rename('median').to_frame().T)
+        data_frames.append(df.assign(market_type=market_type))
+    return pd.concat(data_frames, ignore_index=True)
+
+def trace_frontiers(market_types=MARKET_TYPES, points=200, cache=False, bootstrap=0):
+    """
+    Traces the efficient frontier of each market type's screened funds, see
+    `efficient_frontier.trace_frontier`, and prints the allocations of its
+    point with the best Sharpe ratio.
+    @param [list] market_types E.g. ['US', 'Emerging']
+    @param [int] points The count of risk aversions to solve at
+    @param [Boolean] cache If True, reuses the cached regression results, see `analyze`
+    @param [int] bootstrap If more than 0, screens the loadings by block bootstrap confidence intervals, see `analyze`
+    @return [pandas.core.frame.DataFrame] The frontiers, see
+        `EfficientFrontier.to_data_frame`, with a market_type column
+    """
+    instrumentation = Instrumentation()
+    data_frames = []
+    for market_type in market_types:
+        with instrumentation.stage(f'{market_type}/factor_returns'):
+            factor_data = FactorReturns.fetch_snapshot(market_type)
+        df = screen_funds(market_type, factor_data, cache, bootstrap)
+        with instrumentation.stage(f'{market_type}/efficient_frontier'):
+            frontier = trace_frontier(df, points)
+        if not isinstance(frontier, EfficientFrontier):
+            continue
+        print(frontier.points.iloc[[0, -1]].to_string())
+        best = frontier.points.sharpe_ratio.argmax()
+        print(f'Best Sharpe ratio of the {market_type} frontier, at risk aversion {frontier.points.risk_aversion.iloc[best]}')
+        frontier.chosen(best).summary()
+        data_frames.append(frontier.to_data_frame().assign(market_type=market_type))
+    return pd.concat(data_frames, ignore_index=True) if data_frames else pd.DataFrame(columns=['market_type'])
+
+# The factor returns of every market type, loaded once by the parent process
+# and inherited by the workers rather than fetched again by each of them
+_worker_factor_data = None
+
+def _set_worker_factor_data(factor_data):
+    global _worker_factor_data
+    _worker_factor_data = factor_data
+
+def _analyze_in_worker(market_type, iterations, workers, seed, cache, batched, bootstrap, trace_memory):
+    # To report back what it printed and measured, rather than interleave it
+    # with the other workers'
+    instrumentation = Instrumentation().start(engine(), trace_memory=trace_memory)
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        funds_df, results_df = analyze(market_type, _worker_factor_data[market_type], iterations, workers, seed, cache, batched, bootstrap)
+    instrumentation.stop()
+    return {
+        'market_type': market_type,
+        'log': log.getvalue(),
+        'funds': funds_df,
+        'results': results_df,
+        'report': instrumentation.report()
+    }
+
+def analyze_all(market_types=MARKET_TYPES, iterations=100, workers=None, seed=0, refresh=False, cache=False, batched=True, bootstrap=0, trace_memory=False):
+    """
+    Runs the pipeline of each market type, each in its own worker process,
+    after loading all of their factor returns once. Each market type's output
+    gets printed in turn, once they're all done.
+    @param [list] market_types E.g. ['US', 'Emerging']
+    @param [int] iterations The count of random samples to choose the best funds from
+    @param [int] workers The count of processes to spread all of the market
+        types' iterations across, defaulting to the CPU count
+    @param [int] seed The master seed of experiment_with_shuffling
+    @param [Boolean] refresh If True, re-downloads the factor returns that have changed first
+    @param [Boolean] cache If True, reuses the cached regression results, see `analyze`
+    @param [Boolean] batched If False, solves each sample with its own solver call, see `analyze`
+    @param [int] bootstrap If more than 0, screens the loadings by block bootstrap confidence intervals, see `analyze`
+    @param [Boolean] trace_memory If True, traces each worker's memory too, see `Instrumentation.start`
+    @raise [ValueError] If a market type isn't one of MARKET_TYPES
+    @return [tuple] The screened funds and the results of experiment_with_shuffling
+        of all the market types, with a market_type column [pandas.core.frame.DataFrame]
+    """
+    unknown = [market_type for market_type in market_types if market_type not in MARKET_TYPES]
+    if unknown:
+        raise ValueError(f'Market types ({", ".join(unknown)}) are not among {", ".join(MARKET_TYPES)}')
+    instrumentation = Instrumentation()
+    workers = workers or os.cpu_count()
+
+    # Get the French-Fama Data
+    with instrumentation.stage('factor_returns'):
+        if refresh:
+            FactorReturns.refresh()
+        factor_data = {market_type: FactorReturns.fetch_snapshot(market_type) for market_type in market_types}
+
+    outputs = []
+    # Only one process at a time can open a DuckDB file
+    if len(market_types) == 1 or engine().dialect.name == 'duckdb':
+        for market_type in market_types:
+            funds_df, results_df = analyze(market_type, factor_data[market_type], iterations, workers, seed, cache, batched, bootstrap)
+            outputs.append({'market_type': market_type, 'funds': funds_df, 'results': results_df})
+    else:
+        # The workers must open their own DB connections, rather than share
+        # the ones they'd inherit. An in memory DB's one connection is the
+        # exception, since each worker gets a copy of the whole DB anyway.
+        Session.remove()
+        if not isinstance(engine().pool, StaticPool):
+            engine().dispose()
+        with ProcessPoolExecutor(
+            max_workers=len(market_types),
+            initializer=_set_worker_factor_data,
+            initargs=(factor_data,)
+        ) as executor:
+            futures = [
+                executor.submit(_analyze_in_worker, market_type, iterations, max(1, workers // len(market_types)), seed, cache, batched, bootstrap, trace_memory)
+                for market_type in market_types
+            ]
+            outputs = [future.result() for future in futures]
+        for output in outputs:
+            print(output['log'], end='')
+            instrumentation.merge(output['report'])
+
+    return tuple(
+        pd.concat([output[key].assign(market_type=output['market_type']) for output in outputs], ignore_index=True)
+        for key in ['funds', 'results']
+    )
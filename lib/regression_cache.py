@@ -0,0 +1,200 @@
+import contextlib
+import hashlib
+from lib import factor_regression
+from lib.instrumentation import Instrumentation, timed
+import numpy as np
+import os
+import pandas as pd
+import sqlite3
+import time
+
+class RegressionCache:
+    """
+    Keeps each ticker's factor regression results in a local SQLite file,
+    keyed by the ticker, a fingerprint of the data it was fit on and the
+    model, so that a run only refits the tickers whose data changed since the
+    last one, e.g. the ones with a new month of returns. The least recently
+    used results get evicted once there are more than `max_entries`, or once
+    they haven't been used for `max_age_days`.
+    ```py
+    regression_cache = RegressionCache()
+    results = regression_cache.fit(excess_returns, factor_returns)
+    print(f'{regression_cache.hits} hits, {regression_cache.misses} misses')
+    ```
+    """
+    PATH = os.path.join('snapshots', 'regressions.sqlite3')
+
+    def __init__(self, path=PATH, max_entries=100000, max_age_days=30, clock=time.time):
+        """
+        @param [string] path The SQLite file
+        @param [int] max_entries The most results to keep
+        @param [float] max_age_days How long to keep results that aren't used
+        @param [function] clock Returns the time in seconds
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.clock = clock
+        # The count of tickers whose results were in the cache, or not, over every fit
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def model(terms):
+        """
+        @param [list] terms The terms of the design matrix, e.g. Intercept and the factors
+        @return [string] E.g. ols: excess_return ~ Intercept + market_minus_risk_free + ...
+        """
+        return f'ols: excess_return ~ {" + ".join(terms)}'
+
+    @staticmethod
+    def fingerprints(X, Y, mask):
+        """
+        Hashes the span of months each ticker gets fit on: its excess returns
+        and the factor returns of those months. Months after its last return
+        or before its first don't count, so a new month of factor returns
+        leaves the fingerprints of the tickers without a return for it as
+        they were.
+        @param [numpy.ndarray] X Months by terms design matrix
+        @param [numpy.ndarray] Y Tickers by months
+        @param [numpy.ndarray] mask Tickers by months, True where the month is used
+        @return [list] A hex digest [string] per ticker
+        """
+        # Hash each month's factor returns once, rather than once per ticker
+        month_digests = np.array([
+            int.from_bytes(hashlib.blake2b(month.tobytes(), digest_size=8).digest(), 'little')
+            for month in np.ascontiguousarray(X, dtype=float)
+        ], dtype=np.uint64)
+        # The same NaN for every unused month, and contiguous rows to hash
+        # slices of without copying them
+        Y = np.where(mask, Y, np.nan)
+        used = mask.any(axis=1)
+        firsts = np.where(used, mask.argmax(axis=1), 0)
+        ends = np.where(used, mask.shape[1] - mask[:, ::-1].argmax(axis=1), 0)
+        fingerprints = []
+        for ticker_returns, first, end in zip(Y, firsts, ends):
+            digest = hashlib.blake2b(month_digests[first:end], digest_size=16)
+            digest.update(ticker_returns[first:end])
+            fingerprints.append(digest.hexdigest())
+        return fingerprints
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # The market types' worker processes share the file, so each read or
+        # write takes the write lock up front, with `begin immediate`, rather
+        # than fail to upgrade a read lock once another process has written
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.execute('pragma journal_mode=wal')
+        connection.execute("""
+            create table if not exists regression_results
+            ( model text not null
+            , ticker text not null
+            , fingerprint text not null
+            -- The params, tvalues and pvalues of each term, and nobs, as float64s
+            , results blob not null
+            , used_at real not null
+            , primary key (model, ticker, fingerprint)
+            )
+        """)
+        connection.execute('create index if not exists regression_results_used_at on regression_results (used_at)')
+        return connection
+
+    @timed('regression_cache.fit')
+    def fit(self, excess_returns, factor_returns, factors=factor_regression.FIVE_FACTORS):
+        """
+        Like `factor_regression.fit`, but only fits the tickers that aren't
+        in the cache yet, and then caches them.
+        @param [pandas.core.frame.DataFrame] excess_returns Months (rows) by tickers (columns)
+        @param [pandas.core.frame.DataFrame] factor_returns Months (rows) by factors (columns), aligned to excess_returns
+        @param [list] factors The factors to regress on, in order
+        @return [factor_regression.FactorRegressionResults]
+        """
+        X, Y, mask = factor_regression.regression_inputs(excess_returns, factor_returns, factors)
+        terms = [factor_regression.INTERCEPT] + list(factors)
+        model = self.model(terms)
+        tickers = list(excess_returns.columns)
+        fingerprints = self.fingerprints(X, Y, mask)
+
+        # Each ticker's params, tvalues and pvalues side by side, then nobs
+        values = np.empty((len(tickers), 3 * len(terms) + 1))
+        hit = np.zeros(len(tickers), dtype=bool)
+        with contextlib.closing(self.connect()) as connection:
+            cached_tickers, cached_values = self.read(connection, model, tickers, fingerprints)
+            if cached_tickers:
+                positions = pd.Index(tickers).get_indexer(cached_tickers)
+                values[positions] = cached_values
+                hit[positions] = True
+
+            if not hit.all():
+                missed = np.flatnonzero(~hit)
+                fitted = factor_regression.fit_masked(X, Y[missed], mask[missed], [tickers[i] for i in missed], terms)
+                values[missed] = np.column_stack([fitted.params, fitted.tvalues, fitted.pvalues, fitted.nobs])
+                self.write(connection, model, [(tickers[i], fingerprints[i], values[i]) for i in missed])
+            self.evict(connection)
+
+        index = pd.Index(tickers, name='ticker')
+        n_terms = len(terms)
+        hits = int(hit.sum())
+        self.hits += hits
+        self.misses += len(tickers) - hits
+        Instrumentation().count('regression_cache.hits', hits)
+        Instrumentation().count('regression_cache.misses', len(tickers) - hits)
+        return factor_regression.FactorRegressionResults(
+            pd.DataFrame(values[:, :n_terms], index=index, columns=terms),
+            pd.DataFrame(values[:, n_terms:2 * n_terms], index=index, columns=terms),
+            pd.DataFrame(values[:, 2 * n_terms:3 * n_terms], index=index, columns=terms),
+            pd.Series(values[:, -1], index=index)
+        )
+
+    def read(self, connection, model, tickers, fingerprints):
+        """
+        Finds the cached results of the tickers, and marks the ones that
+        weren't used today as used.
+        @return [tuple] The cached tickers [list], and their results [numpy.ndarray], one row each
+        """
+        # To look them all up with one join, rather than a query per ticker
+        connection.execute('create temporary table if not exists wanted (ticker text, fingerprint text)')
+        connection.execute('begin immediate')
+        connection.execute('delete from wanted')
+        connection.executemany('insert into wanted values (?, ?)', zip(tickers, fingerprints))
+        rows = connection.execute("""
+            select r.ticker, r.results
+            from regression_results r
+            join wanted w on r.ticker = w.ticker and r.fingerprint = w.fingerprint
+            where r.model = ?
+        """, (model,)).fetchall()
+        now = self.clock()
+        connection.execute("""
+            update regression_results set used_at = ?
+            where model = ? and used_at < ? and (ticker, fingerprint) in (select ticker, fingerprint from wanted)
+        """, (now, model, now - 24 * 60 * 60))
+        connection.commit()
+        if not rows:
+            return [], None
+        cached_tickers, blobs = zip(*rows)
+        return list(cached_tickers), np.frombuffer(b''.join(blobs)).reshape(len(rows), -1)
+
+    def write(self, connection, model, results):
+        """
+        @param [list] results A ticker, fingerprint and results [numpy.ndarray] [tuple] per ticker
+        """
+        used_at = self.clock()
+        connection.execute('begin immediate')
+        connection.executemany('insert or replace into regression_results values (?, ?, ?, ?, ?)', [
+            (model, ticker, fingerprint, ticker_values.tobytes(), used_at)
+            for ticker, fingerprint, ticker_values in results
+        ])
+        connection.commit()
+
+    def evict(self, connection):
+        """
+        Deletes the results that haven't been used for max_age_days, and then
+        the least recently used ones beyond max_entries.
+        """
+        connection.execute('begin immediate')
+        connection.execute('delete from regression_results where used_at < ?', (self.clock() - self.max_age_days * 24 * 60 * 60,))
+        connection.execute("""
+            delete from regression_results
+            where rowid in (select rowid from regression_results order by used_at desc limit -1 offset ?)
+        """, (self.max_entries,))
+        connection.commit()
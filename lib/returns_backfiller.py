@@ -0,0 +1,122 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from lib.instrumentation import timed
+from lib.investment_returns import InvestmentReturns
+import pandas as pd
+from pandas_datareader._utils import RemoteDataError
+import requests
+import threading
+import time
+
+class RateLimiter:
+    """
+    Spaces out calls evenly, so that no more than the given count of them
+    start per second, across all threads.
+    """
+    def __init__(self, requests_per_second, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1 / requests_per_second
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.next_call_at = 0
+
+    def wait(self):
+        with self.lock:
+            now = self.clock()
+            call_at = max(now, self.next_call_at)
+            self.next_call_at = call_at + self.interval
+        if call_at > now:
+            self.sleep(call_at - now)
+
+class ReturnsBackfiller:
+    """
+    Backfills the returns of many tickers at once. Price downloads run on a
+    pool of worker threads, within a requests-per-second limit, while the
+    main thread writes the finished ones to the DB.
+    ```py
+    skipped = ReturnsBackfiller(requests_per_second=2).run(ticker_symbols, start, end)
+    ```
+    """
+    # Errors worth trying the same download again for
+    RETRYABLE_ERRORS = (RemoteDataError, requests.exceptions.ConnectionError)
+
+    def __init__(
+        self,
+        price_source=InvestmentReturns.get_percentage_change_data,
+        workers=8,
+        requests_per_second=2,
+        retries=3,
+        backoff=1,
+        write_batch_size=50,
+        sleep=time.sleep
+    ):
+        """
+        @param [function] price_source Takes a ticker symbol, a start and an end date, and returns the same data frame as `InvestmentReturns.get_percentage_change_data`
+        @param [int] workers The count of downloads to run at the same time
+        @param [float] requests_per_second The most downloads to start per second
+        @param [int] retries The count of times to retry a download after a retryable error
+        @param [float] backoff Seconds to wait before the first retry, doubling after each one
+        @param [int] write_batch_size The count of tickers' returns to write to the DB at once
+        @param [function] sleep To wait between retries
+        """
+        self.price_source = price_source
+        self.workers = workers
+        self.rate_limiter = RateLimiter(requests_per_second, sleep=sleep)
+        self.retries = retries
+        self.backoff = backoff
+        self.write_batch_size = write_batch_size
+        self.sleep = sleep
+
+    @timed('returns_backfiller.run')
+    def run(self, ticker_symbols, start, end):
+        """
+        @param [list] ticker_symbols Ticker symbols of the stocks
+        @param [Date] start Start date of the range (inclusive) of desired data
+        @param [Date] end End date of the range (inclusive) of desired data
+        @return [dict] For each skipped ticker, the key is its ticker symbol, and the value is the reason [string]
+        """
+        ranges = InvestmentReturns.backfill_ranges(ticker_symbols, start, end)
+        print(f'Backfilling the returns of {len(ranges)} tickers from the Yahoo API')
+
+        skipped = {}
+        pending = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self.download, ticker_symbol, range_start, range_end): ticker_symbol
+                for ticker_symbol, (range_start, range_end) in ranges.items()
+            }
+            # Write as downloads finish, while the rest carry on downloading
+            for future in as_completed(futures):
+                ticker_symbol = futures[future]
+                try:
+                    percentage_change_data = future.result()
+                except Exception as e:
+                    skipped[ticker_symbol] = f'{type(e).__name__}: {e}'
+                    continue
+                if percentage_change_data.empty:
+                    skipped[ticker_symbol] = 'No price data in the Yahoo API'
+                    continue
+                pending.append(percentage_change_data)
+                if len(pending) >= self.write_batch_size:
+                    InvestmentReturns.write(pd.concat(pending))
+                    pending = []
+        if pending:
+            InvestmentReturns.write(pd.concat(pending))
+
+        print(f'Backfilled {len(ranges) - len(skipped)} tickers, skipped {len(skipped)}')
+        for ticker_symbol, reason in sorted(skipped.items()):
+            print(f'  Skipped {ticker_symbol}: {reason}')
+        return skipped
+
+    def download(self, ticker_symbol, start, end):
+        """
+        @raise [Exception] Whatever the price source raised, once out of retries
+        @return [pandas.core.frame.DataFrame]
+        """
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.wait()
+            try:
+                return self.price_source(ticker_symbol, start, end)
+            except self.RETRYABLE_ERRORS:
+                if attempt == self.retries:
+                    raise
+                self.sleep(self.backoff * 2 ** attempt)
@@ -0,0 +1,112 @@
+from lib.factor_regression import FIVE_FACTORS, INTERCEPT, cross_products, month_outer_products, pseudo_inverse_and_rank, regression_inputs, zero_filled
+from lib.instrumentation import timed
+import numpy as np
+import pandas as pd
+
+# Windows whose X'WX, scaled to a unit diagonal, has a determinant below this
+# get refit from their own months, see `fit_rolling`
+NEARLY_SINGULAR = 10**-8
+
+class RollingFactorRegressionResults:
+    def __init__(self, params, nobs, tickers, occurred_ats, terms):
+        """
+        @param [numpy.ndarray] params Tickers by windows by terms, NaN where a window has too few months
+        @param [numpy.ndarray] nobs Tickers by windows, the count of months used
+        @param [list] tickers
+        @param [list] occurred_ats The last month of each window
+        @param [list] terms
+        """
+        self.params = params
+        self.nobs = nobs
+        self.tickers = tickers
+        self.occurred_ats = occurred_ats
+        self.terms = terms
+
+    def to_data_frame(self):
+        """
+        @return [pandas.core.frame.DataFrame] Indexed by ticker and occurred_at, with a column per term,
+            and nobs, the count of months used
+        """
+        index = pd.MultiIndex.from_product([self.tickers, self.occurred_ats], names=['ticker', 'occurred_at'])
+        df = pd.DataFrame(self.params.reshape(-1, len(self.terms)), index=index, columns=self.terms)
+        df['nobs'] = self.nobs.reshape(-1).astype(int)
+        return df
+
+@timed('rolling_factor_regression.fit_rolling')
+def fit_rolling(excess_returns, factor_returns, window=36, step=1, min_observations=24, factors=FIVE_FACTORS):
+    """
+    Runs an OLS regression of every ticker's excess returns on the factors over
+    each rolling window of months. Rather than refitting each window from
+    scratch, every ticker's normal equations (X'X and X'y) are updated as the
+    window slides: the newest month gets added in and the oldest taken out.
+    Months where a ticker has no return simply contribute nothing. Adding and
+    taking out leaves rounding errors behind, so a window that can't tell
+    some factors apart, e.g. one with just a few months left, would solve to
+    noise; those get refit from the window's own months with the
+    pseudo-inverse instead, like `factor_regression.fit` does.
+    @param [pandas.core.frame.DataFrame] excess_returns Months (rows) by tickers (columns), see `factor_regression.excess_returns`
+    @param [pandas.core.frame.DataFrame] factor_returns Months (rows) by factors (columns), aligned to excess_returns
+    @param [int] window The count of months in each window
+    @param [int] step The count of months between the ends of consecutive windows
+    @param [int] min_observations Windows where a ticker has fewer months of returns than this are NaN
+    @param [list] factors The factors to regress on, in order
+    @return [RollingFactorRegressionResults]
+    """
+    design, returns, mask = regression_inputs(excess_returns, factor_returns, factors)
+    X, Y, W = zero_filled(design, returns, mask)
+    outer = month_outer_products(X)
+
+    n_tickers, n_months = Y.shape
+    n_terms = X.shape[1]
+    min_observations = max(min_observations, n_terms + 1)
+    window_ends = list(range(window - 1, n_months, step))
+
+    gram = np.zeros((n_tickers, n_terms * n_terms))
+    xty = np.zeros((n_tickers, n_terms))
+    nobs = np.zeros(n_tickers)
+    params = np.full((n_tickers, len(window_ends), n_terms), np.nan)
+    window_nobs = np.zeros((n_tickers, len(window_ends)))
+
+    def update(month, sign):
+        gram[:] += sign * W[:, month, np.newaxis] * outer[month]
+        xty[:] += sign * Y[:, month, np.newaxis] * X[month]
+        nobs[:] += sign * W[:, month]
+
+    for i, window_end in enumerate(window_ends):
+        window_start = window_end - window + 1
+        previous_end = window_ends[i - 1] if i else -1
+        # Slide the window: add the months that entered, drop those that left
+        for month in range(previous_end + 1, window_end + 1):
+            update(month, 1)
+        for month in range(max(0, previous_end - window + 1), window_start):
+            update(month, -1)
+
+        valid = nobs >= min_observations
+        window_nobs[:, i] = nobs
+        if not valid.any():
+            continue
+        valid_gram = gram[valid].reshape(-1, n_terms, n_terms)
+        valid_xty = xty[valid]
+        # The determinant of X'WX scaled to a unit diagonal, without scaling it
+        sign, log_determinant = np.linalg.slogdet(valid_gram)
+        with np.errstate(divide='ignore'):
+            log_determinant -= np.log(np.diagonal(valid_gram, axis1=1, axis2=2)).sum(axis=1)
+        singular = (sign <= 0) | ~(log_determinant >= np.log(NEARLY_SINGULAR))
+
+        window_params = np.empty((len(valid_gram), n_terms))
+        window_params[~singular] = np.linalg.solve(valid_gram[~singular], valid_xty[~singular][:, :, np.newaxis])[:, :, 0]
+        if singular.any():
+            tickers = np.flatnonzero(valid)[singular]
+            months = slice(window_start, window_end + 1)
+            window_gram, window_xty, *_ = cross_products(design[months], returns[tickers, months], mask[tickers, months])
+            gram_inverse, _ = pseudo_inverse_and_rank(window_gram)
+            window_params[singular] = np.einsum('tij,tj->ti', gram_inverse, window_xty)
+        params[valid, i] = window_params
+
+    return RollingFactorRegressionResults(
+        params,
+        window_nobs,
+        list(excess_returns.columns),
+        list(factor_returns.index[window_ends]),
+        [INTERCEPT] + list(factors)
+    )
@@ -1,4 +1,5 @@
 from lib.chosen_summarizer import ChosenSummarizer
+from lib.instrumentation import Instrumentation, timed
 import numpy as np
 from scipy import optimize
 
@@ -8,56 +9,190 @@ from scipy import optimize
 # deviation.
 # https://www.kaggle.com/vijipai/lesson-6-sharpe-ratio-based-portfolio-optimization
 
-def choose_best(df):
+# The factor loadings to balance, leaving out the market's
+RELEVANT_COLUMNS = ['smb', 'hml', 'rmw', 'cma']
+
+@timed('sharpe_ratio_solver.choose_best')
+def choose_best(df, warm_start=None, solver=None):
+    """
+    @param [pandas.core.frame.DataFrame] df The funds to choose from
+    @param [pandas.core.series.Series] warm_start Allocations to start the
+        solver from, indexed like df, e.g. a previous `ChosenSummarizer`'s
+        `chosen.allocation`. Funds missing from it start at zero.
+    @param [function] solver Takes factor_means, factor_var_covar_root and x0
+        and returns a scipy.optimize.OptimizeResult, defaulting to
+        `maximize_sharpe_ratio`. Pass `maximize_sharpe_ratio_by_projected_gradient`
+        to take the same steps as `choose_best_of_samples` does.
+    @return [ChosenSummarizer]
+    """
     if df.shape[0] <= 1:
         print(f'DataFrame is too small ({df.shape[0]}), skipping')
         return (0, 0, 0)
 
-    relevant_columns = ['smb', 'hml', 'rmw', 'cma']
-    if len(set(df.columns) & set(relevant_columns)) != len(relevant_columns):
-        raise ValueError(f'DataFrame columns ({",".join(df.columns)}) does not contain all relevant columns ({",".join(relevant_columns)})')
+    _, factor_means, factor_var_covar_root = relevant_factors(df)
 
-    # Compute the mean and variance-covariance matrix
-    factors = np.asarray(df[relevant_columns])
-    factor_means = np.mean(factors, axis = 1)
-    # https://numpy.org/doc/stable/reference/generated/numpy.cov.html
-    # Bias true because I don't want to exclude one of my "observations" (factors)
-    factor_var_covar_matrix = np.cov(factors, bias=True)
+    x0 = None
+    if warm_start is not None:
+        x0 = np.asarray(warm_start.reindex(df.index, fill_value=0), dtype=float)
 
     # Compute maximal Sharpe Ratio and optimal weights
-    result = maximize_sharpe_ratio(factor_means, factor_var_covar_matrix)
+    result = (solver or maximize_sharpe_ratio)(factor_means, factor_var_covar_root, x0=x0)
+    record_solver_result(result)
     if not result.success:
         raise ValueError(result.message)
 
     df['allocation'] = np.round(result.x, 3)
 
     chosen = df[(df.allocation > 0)].sort_values(by=['allocation'], ascending=False)
-    return ChosenSummarizer(chosen, relevant_columns)
-
-def maximize_sharpe_ratio(factor_means, factor_var_covar_matrix):
-    def objective_function(x, given_factor_means, given_factor_var_covar_matrix):
-        standard_deviation = np.sqrt(
-            np.matmul(
-                np.matmul(x, given_factor_var_covar_matrix),
-                x.T
+    return ChosenSummarizer(chosen, RELEVANT_COLUMNS, solver_result=result)
+
+@timed('sharpe_ratio_solver.choose_best_of_samples')
+def choose_best_of_samples(df, samples, warm_start=None):
+    """
+    Like `choose_best` with `maximize_sharpe_ratio_by_projected_gradient` on
+    each sample of the funds, but solving them all at once, see
+    `maximize_sharpe_ratios`.
+    @param [pandas.core.frame.DataFrame] df The funds to choose from
+    @param [list] samples The index labels of the funds in each sample [list]
+    @param [pandas.core.series.Series] warm_start Allocations to start every
+        sample's solver from, indexed like df. Funds missing from it start at zero.
+    @return [list] A ChosenSummarizer per sample, or (0, 0, 0) for the
+        samples that are too small, like `choose_best` returns
+    """
+    chosen_summarizers = [None] * len(samples)
+    for i, sample in enumerate(samples):
+        if len(sample) <= 1:
+            print(f'DataFrame is too small ({len(sample)}), skipping')
+            chosen_summarizers[i] = (0, 0, 0)
+    solving = [i for i, chosen_summarizer in enumerate(chosen_summarizers) if chosen_summarizer is None]
+    if not solving:
+        return chosen_summarizers
+
+    _, factor_means, factor_var_covar_root = relevant_factors(df)
+
+    # The positions of each sample's funds in df, in the order of the sample,
+    # like choose_best gets them, looked up all at once
+    sizes = [len(samples[i]) for i in solving]
+    positions = np.split(df.index.get_indexer(np.concatenate([np.asarray(samples[i]) for i in solving])), np.cumsum(sizes)[:-1])
+    masks = np.zeros((len(solving), len(df)), dtype=bool)
+    for i, sample_positions in enumerate(positions):
+        masks[i, sample_positions] = True
+    x0 = None
+    if warm_start is not None:
+        x0 = np.asarray(warm_start.reindex(df.index, fill_value=0), dtype=float)
+
+    # Solve in batches, to keep the samples x funds arrays to a few million values
+    batch_size = max(1, 4 * 10**6 // len(df))
+    for start in range(0, len(solving), batch_size):
+        result = maximize_sharpe_ratios(factor_means, factor_var_covar_root, masks[start:start + batch_size], x0=x0)
+        sample_results = []
+        chosen_positions = []
+        chosen_allocations = []
+        for i, sample_positions in enumerate(positions[start:start + batch_size]):
+            sample_result = optimize.OptimizeResult(
+                x = result.x[i][sample_positions],
+                fun = result.fun[i],
+                nit = result.nit[i],
+                nfev = result.nfev[i],
+                success = result.success[i],
+                message = result.message[i]
             )
-        )
-        mean = np.matmul(np.array(given_factor_means), x.T)
-        # The Sharpe ratio doesn't normally have this "1 +" in the denominator,
-        # but I want to be less strict about standard deviation.
-        # Since the optimizer minimizes and we want to maximize, we negate our
-        # objective function.
-        return -mean / (1 + standard_deviation)
+            record_solver_result(sample_result)
+            if not sample_result.success:
+                raise ValueError(sample_result.message)
+            # Only take the funds chosen out of df, rather than the whole
+            # sample, largest allocation first
+            allocation = np.round(sample_result.x, 3)
+            order = np.argsort(-allocation[allocation > 0], kind='stable')
+            sample_results.append(sample_result)
+            chosen_positions.append(sample_positions[allocation > 0][order])
+            chosen_allocations.append(allocation[allocation > 0][order])
+
+        # Taking every sample's rows out of df at once, and then slicing them
+        # up, is much quicker than a take per sample
+        all_chosen = df.iloc[np.concatenate(chosen_positions)].\
+            assign(allocation=np.concatenate(chosen_allocations))
+        ends = np.cumsum([len(sample_positions) for sample_positions in chosen_positions])
+        for i, sample_result in enumerate(sample_results):
+            chosen = all_chosen.iloc[ends[i] - len(chosen_positions[i]):ends[i]]
+            chosen_summarizers[solving[start + i]] = ChosenSummarizer(chosen, RELEVANT_COLUMNS, solver_result=sample_result)
+    return chosen_summarizers
+
+def relevant_factors(df):
+    """
+    @param [pandas.core.frame.DataFrame] df The funds to choose from
+    @raise [ValueError] If df is missing any of `RELEVANT_COLUMNS`
+    @return [tuple] The funds x factors loadings, each fund's mean loading, and
+        the root of their variance-covariance matrix, see `var_covar_root`
+    """
+    if len(set(df.columns) & set(RELEVANT_COLUMNS)) != len(RELEVANT_COLUMNS):
+        raise ValueError(f'DataFrame columns ({",".join(df.columns)}) does not contain all relevant columns ({",".join(RELEVANT_COLUMNS)})')
+
+    # Compute the mean and variance-covariance matrix
+    factors = np.asarray(df[RELEVANT_COLUMNS])
+    factor_means = np.mean(factors, axis = 1)
+    return factors, factor_means, var_covar_root(factors, factor_means)
+
+def record_solver_result(result):
+    """
+    Adds a solver run's iterations and function evaluations to the counters of
+    `Instrumentation`.
+    @param [scipy.optimize.OptimizeResult] result
+    """
+    instrumentation = Instrumentation()
+    instrumentation.count('solver.runs')
+    instrumentation.count('solver.iterations', int(result.nit))
+    instrumentation.count('solver.evaluations', int(result.nfev))
+    if not result.success:
+        instrumentation.count('solver.failures')
+
+def var_covar_root(factors, factor_means):
+    """
+    The variance-covariance matrix of the funds is
+    `np.cov(factors, bias=True)`, with bias true because I don't want to exclude
+    one of my "observations" (factors). But that's a funds x funds matrix
+    of rank at most 4, so instead return the funds x factors matrix R where
+    `np.cov(factors, bias=True) == R @ R.T`, and never build the big one.
+    https://numpy.org/doc/stable/reference/generated/numpy.cov.html
+    @param [numpy.ndarray] factors Funds by factors
+    @param [numpy.ndarray] factor_means The mean of each fund's factors
+    @return [numpy.ndarray] Funds by factors
+    """
+    return (factors - factor_means[:, np.newaxis]) / np.sqrt(factors.shape[1])
+
+# SLSQP works on dense funds x funds matrices internally, so past this many
+# funds it gets too slow, and the projected gradient method takes over
+SLSQP_MAX_FUNDS = 500
+
+def maximize_sharpe_ratio(factor_means, factor_var_covar_root, x0=None):
+    """
+    @param [numpy.ndarray] factor_means The mean of each fund's factors
+    @param [numpy.ndarray] factor_var_covar_root Funds by factors, see `var_covar_root`
+    @param [numpy.ndarray] x0 Allocations to start from, e.g. a previous
+        solution. Defaults to 0.33 each for SLSQP, see below, and to equal
+        allocations for the projected gradient method.
+    @return [scipy.optimize.OptimizeResult] With nit and nfev, the counts of
+        iterations and function evaluations it took
+    """
+    if len(factor_means) > SLSQP_MAX_FUNDS:
+        return maximize_sharpe_ratio_by_projected_gradient(factor_means, factor_var_covar_root, x0=x0)
+
+    # 0.33 each doesn't sum to 1, but SLSQP's first step fixes that, and with
+    # a tolerance this loose, starting anywhere else ends somewhere else
+    xinit = np.repeat(0.33, len(factor_means))
+    if x0 is not None and np.any(x0 > 0):
+        xinit = initial_allocations(len(factor_means), x0)
 
     # Enforce that all allocations sum to 1
     def equality_constraint(x):
         A = np.ones(x.shape)
         b = 1
         return np.matmul(A, x.T) - b
-    constraints = ({'type': 'eq', 'fun': equality_constraint})
+    def equality_constraint_gradient(x):
+        return np.ones(x.shape)
+    constraints = ({'type': 'eq', 'fun': equality_constraint, 'jac': equality_constraint_gradient})
 
     # Enforce that all allocations are positive
-    xinit = np.repeat(0.33, len(factor_means))
     lower_bound = 0
     upper_bound = 1
     bounds = tuple([(lower_bound, upper_bound) for x in xinit])
@@ -68,12 +203,429 @@ def maximize_sharpe_ratio(factor_means, factor_var_covar_matrix):
         x0 = xinit,
         args = (
             factor_means,
-            factor_var_covar_matrix
+            factor_var_covar_root
         ),
         method = 'SLSQP',
+        # objective_function returns its gradient too, so SLSQP doesn't have
+        # to estimate it with a finite difference per fund
+        jac = True,
         bounds = bounds,
         constraints = constraints,
         # https://stackoverflow.com/questions/11155721/positive-directional-derivative-for-linesearch
         # https://stackoverflow.com/questions/9667514/what-is-the-difference-between-xtol-and-ftol-to-use-fmin-of-scipy-optimize
         tol = 10**-2
     )
+
+def objective_function(x, factor_means, factor_var_covar_root):
+    """
+    @return [tuple] The objective, and its gradient
+    """
+    # sqrt(x @ R @ R.T @ x.T) is the length of x @ R
+    deviation = np.matmul(x, factor_var_covar_root)
+    standard_deviation = np.linalg.norm(deviation)
+    mean = np.matmul(factor_means, x.T)
+    # The Sharpe ratio doesn't normally have this "1 +" in the denominator,
+    # but I want to be less strict about standard deviation.
+    # Since the optimizer minimizes and we want to maximize, we negate our
+    # objective function.
+    objective = -mean / (1 + standard_deviation)
+    gradient = -factor_means / (1 + standard_deviation)
+    if standard_deviation > 0:
+        gradient = gradient + mean / (1 + standard_deviation)**2 *\
+            np.matmul(factor_var_covar_root, deviation) / standard_deviation
+    return objective, gradient
+
+def initial_allocations(n, x0=None):
+    """
+    @param [int] n The count of funds
+    @param [numpy.ndarray] x0 Allocations to start from, if any
+    @return [numpy.ndarray] x0 made feasible, i.e. positive and summing to 1,
+        or else equal allocations
+    """
+    if x0 is None or not np.any(x0 > 0):
+        return np.repeat(1 / n, n)
+    return project_onto_simplex(np.asarray(x0, dtype=float))
+
+def maximize_sharpe_ratio_by_projected_gradient(factor_means, factor_var_covar_root, x0=None, tol=10**-6, maxiter=1000):
+    """
+    Maximizes the same objective as `maximize_sharpe_ratio`, see
+    `minimize_over_simplex`. Every step is O(funds x factors), so this
+    handles tens of thousands of funds.
+    @param [numpy.ndarray] factor_means The mean of each fund's factors
+    @param [numpy.ndarray] factor_var_covar_root Funds by factors, see `var_covar_root`
+    @param [numpy.ndarray] x0 Allocations to start from, defaulting to equal allocations
+    @param [float] tol Stop once no allocation moves by more than this
+    @param [int] maxiter The most steps to take
+    @return [scipy.optimize.OptimizeResult]
+    """
+    return minimize_over_simplex(
+        objective_function,
+        initial_allocations(len(factor_means), x0),
+        args=(factor_means, factor_var_covar_root),
+        tol=tol,
+        maxiter=maxiter
+    )
+
+def minimize_over_simplex(fun, x0, args=(), tol=10**-6, maxiter=1000, step0=1):
+    """
+    Minimizes fun with steps down its exact gradient that get projected back
+    onto the allocations that are positive and sum to 1, with
+    Barzilai-Borwein step sizes and an Armijo line search.
+    @param [function] fun Takes x and args, and returns the objective and its
+        gradient, like `objective_function`
+    @param [numpy.ndarray] x0 Allocations to start from, positive and summing to 1
+    @param [tuple] args
+    @param [float] tol Stop once no allocation moves by more than this
+    @param [int] maxiter The most steps to take
+    @param [float] step0 The first step size, e.g. the step a previous run on
+        a similar objective ended with
+    @return [scipy.optimize.OptimizeResult] With step, the step size to carry on with
+    """
+    x = x0
+    objective, gradient = fun(x, *args)
+    nfev = 1
+    step = step0
+    converged = False
+    for nit in range(1, maxiter + 1):
+        # Backtrack until the step decreases the objective enough (Armijo)
+        while True:
+            x_new = project_onto_simplex(x - step * gradient)
+            objective_new, gradient_new = fun(x_new, *args)
+            nfev += 1
+            if objective_new <= objective + 10**-4 * np.matmul(gradient, x_new - x) or step < 10**-12:
+                break
+            step /= 2
+
+        converged = np.abs(x_new - x).max() < tol
+        # Barzilai-Borwein step size for the next step
+        x_change = x_new - x
+        curvature = np.matmul(x_change, gradient_new - gradient)
+        step = np.matmul(x_change, x_change) / curvature if curvature > 0 else step * 2
+        x, objective, gradient = x_new, objective_new, gradient_new
+        if converged:
+            break
+
+    return optimize.OptimizeResult(
+        x = x,
+        fun = objective,
+        jac = gradient,
+        nit = nit,
+        nfev = nfev,
+        step = step,
+        success = converged,
+        message = 'Optimization terminated successfully' if converged else 'Iteration limit reached'
+    )
+
+# How many funds each problem of `maximize_sharpe_ratios` steps over at
+# least, after its first step. The best allocations rarely hold more than a few.
+WORKING_SET_SIZE = 32
+
+def maximize_sharpe_ratios(factor_means, factor_var_covar_root, masks, x0=None, tol=10**-6, maxiter=1000):
+    """
+    Runs `maximize_sharpe_ratio_by_projected_gradient` for a stack of
+    problems at once, each over its own subset of the funds, e.g. a random
+    sample of them. The first step drops all but a few of each problem's
+    funds, so the steps after it only go over a small working set of them:
+    the ones it holds, and the ones its gradient favors most. Whenever a step
+    would move a fund outside of the working set, a new working set gets
+    picked to take that step over instead, so each problem takes the same
+    steps as it would by itself.
+    @param [numpy.ndarray] factor_means The mean of each fund's factors
+    @param [numpy.ndarray] factor_var_covar_root Funds by factors, see `var_covar_root`
+    @param [numpy.ndarray] masks Problems by funds, True where the problem can allocate to the fund
+    @param [numpy.ndarray] x0 Allocations to start every problem from, restricted to
+        its funds. Defaults to equal allocations.
+    @param [float] tol Stop a problem once none of its allocations move by more than this
+    @param [int] maxiter The most steps to take
+    @return [scipy.optimize.OptimizeResult] With x (problems by funds, zero
+        outside each problem's funds), and fun, nit, nfev, success and message per problem
+    """
+    masks = np.asarray(masks, dtype=bool)
+    n_funds = masks.shape[1]
+    if x0 is not None and np.any(x0 > 0):
+        x = np.broadcast_to(np.asarray(x0, dtype=float), masks.shape)
+    else:
+        x = masks / masks.sum(axis=1, keepdims=True)
+    result = maximize_sharpe_ratios_over_working_sets(factor_means, factor_var_covar_root, masks, None, x, tol=tol, maxiter=1)
+    x, objective, nit, nfev, step, converged = result.x, result.fun, result.nit, result.nfev, result.step, result.success
+
+    solving = np.flatnonzero(~converged & (nit < maxiter))
+    size = min(n_funds, WORKING_SET_SIZE)
+    while len(solving):
+        _, gradient = objective_functions(x[solving], factor_means, factor_var_covar_root)
+        held = x[solving] > 0
+        # Leave room for as many funds again as any problem holds
+        size = max(size, min(n_funds, 2 * held.sum(axis=1).max()))
+        working_sets = choose_working_sets(held, gradient, masks[solving], size)
+        rows = solving[:, np.newaxis]
+        result = maximize_sharpe_ratios_over_working_sets(
+            factor_means,
+            factor_var_covar_root,
+            masks[solving],
+            working_sets,
+            x[rows, working_sets],
+            step0=step[solving],
+            tol=tol,
+            maxiter=maxiter - nit[solving]
+        )
+        nit[solving] += result.nit
+        nfev[solving] += result.nfev
+        x[solving] = 0
+        x[rows, working_sets], objective[solving], step[solving], converged[solving] = result.x, result.fun, result.step, result.success
+
+        # The ones whose next step would move a fund outside of their working
+        # set carry on over a new one, with the funds whose gradients are now
+        # the lowest. Those that didn't take a step over the last one take
+        # this step over all of their funds, so that they don't get stuck.
+        leaving = solving[result.left]
+        stuck = leaving[result.nit[result.left] == 0]
+        result = maximize_sharpe_ratios_over_working_sets(
+            factor_means,
+            factor_var_covar_root,
+            masks[stuck],
+            None,
+            x[stuck],
+            step0=step[stuck],
+            tol=tol,
+            maxiter=1
+        )
+        nit[stuck] += result.nit
+        nfev[stuck] += result.nfev
+        x[stuck], objective[stuck], step[stuck], converged[stuck] = result.x, result.fun, result.step, result.success
+        solving = leaving[~converged[leaving] & (nit[leaving] < maxiter)]
+
+    return optimize.OptimizeResult(
+        x = x,
+        fun = objective,
+        nit = nit,
+        nfev = nfev,
+        success = converged,
+        message = np.where(converged, 'Optimization terminated successfully', 'Iteration limit reached')
+    )
+
+def choose_working_sets(held, gradient, masks, size):
+    """
+    @param [numpy.ndarray] held Problems by funds, True where the problem allocates to the fund
+    @param [numpy.ndarray] gradient Problems by funds
+    @param [numpy.ndarray] masks Problems by funds
+    @param [int] size The count of funds in each working set
+    @return [numpy.ndarray] Problems by size, the positions of the funds each
+        problem holds, and then of its other funds with the lowest gradients.
+        Problems with fewer funds than size get some outside their masks.
+    """
+    priority = np.where(held, -np.inf, np.where(masks, gradient, np.inf))
+    if size == priority.shape[1]:
+        return np.broadcast_to(np.arange(size), priority.shape)
+    return np.argpartition(priority, size - 1, axis=1)[:, :size]
+
+def maximize_sharpe_ratios_over_working_sets(factor_means, factor_var_covar_root, masks, working_sets, x0, step0=None, tol=10**-6, maxiter=1000):
+    """
+    The projected gradient method of `maximize_sharpe_ratio_by_projected_gradient`,
+    for a stack of problems at once, each over a working set of its funds.
+    Each problem keeps its own step size, and drops out of the vectorized
+    steps of the ones still going once it has converged, or once its next
+    step would move a fund outside of its working set.
+    @param [numpy.ndarray] factor_means The mean of each fund's factors
+    @param [numpy.ndarray] factor_var_covar_root Funds by factors, see `var_covar_root`
+    @param [numpy.ndarray] masks Problems by funds, True where the problem can allocate to the fund
+    @param [numpy.ndarray] working_sets Problems by the positions of the funds
+        to step over, see `choose_working_sets`, or None to step over all of them
+    @param [numpy.ndarray] x0 Problems by working set, the allocations to start from
+    @param [numpy.ndarray] step0 The step size each problem starts with, defaulting to 1
+    @param [int] maxiter The most steps to take, or an array of them per problem
+    @return [scipy.optimize.OptimizeResult] With x (problems by working set),
+        fun, nit, nfev, success, the step size to carry on with, and left,
+        True where the next step would've moved a fund outside of the working
+        set, per problem
+    """
+    n_problems = len(x0)
+    if working_sets is None:
+        working_means, working_root, working_masks, inside = factor_means, factor_var_covar_root, masks, None
+    else:
+        rows = np.arange(n_problems)[:, np.newaxis]
+        working_means, working_root, working_masks = factor_means[working_sets], factor_var_covar_root[working_sets], masks[rows, working_sets]
+        # To leave the funds in each working set, and those the problem can't
+        # allocate to, out of the lowest gradient outside of it
+        inside = np.where(masks, 0, np.inf)
+        inside[rows, working_sets] = np.inf
+        # Each fund's mean and row of the root, to weight into all of their gradients at once
+        funds = np.column_stack([factor_means, factor_var_covar_root])
+    x = project_onto_masked_simplex(x0, working_masks)
+    objective, gradient = objective_functions(x, working_means, working_root)
+    nfev = np.ones(n_problems, dtype=int)
+    nit = np.zeros(n_problems, dtype=int)
+    converged = np.zeros(n_problems, dtype=bool)
+    left = np.zeros(n_problems, dtype=bool)
+    steps = np.ones(n_problems) if step0 is None else np.array(step0, dtype=float)
+    maxiter = np.broadcast_to(maxiter, n_problems)
+
+    # The problems still going, packed together, with where each one's results go
+    going = np.arange(n_problems)
+    x_going, objective_going, gradient_going, step = x, objective, gradient, steps.copy()
+    means_going, root_going, masks_going, inside_going = working_means, working_root, working_masks, inside
+    while len(going):
+        step_before = step.copy()
+        # Take every problem's step, then backtrack the ones whose step didn't
+        # decrease their objective enough (Armijo)
+        x_new = project_onto_masked_simplex(x_going - step[:, np.newaxis] * gradient_going, masks_going)
+        objective_new, gradient_new = objective_functions(x_new, means_going, root_going)
+        nfev[going] += 1
+        decrease = np.einsum('ij,ij->i', gradient_going, x_new - x_going)
+        backtracking = np.flatnonzero((objective_new > objective_going + 10**-4 * decrease) & (step >= 10**-12))
+        while len(backtracking):
+            step[backtracking] /= 2
+            candidate = project_onto_masked_simplex(
+                x_going[backtracking] - step[backtracking, np.newaxis] * gradient_going[backtracking],
+                masks_going[backtracking]
+            )
+            objective_candidate, gradient_candidate = objective_functions(
+                candidate,
+                means_going[backtracking] if inside is not None else means_going,
+                root_going[backtracking] if inside is not None else root_going
+            )
+            nfev[going[backtracking]] += 1
+            decrease = np.einsum('ij,ij->i', gradient_going[backtracking], candidate - x_going[backtracking])
+            accepted = (objective_candidate <= objective_going[backtracking] + 10**-4 * decrease) | (step[backtracking] < 10**-12)
+            done = backtracking[accepted]
+            x_new[done] = candidate[accepted]
+            objective_new[done] = objective_candidate[accepted]
+            gradient_new[done] = gradient_candidate[accepted]
+            backtracking = backtracking[~accepted]
+
+        leaving = np.zeros(len(going), dtype=bool)
+        if inside is not None:
+            # The projection subtracted the same threshold from every fund it
+            # kept, and a fund outside of the working set would've been kept
+            # too if its step took it above that
+            kept = x_new > 0
+            threshold = (np.where(kept, x_going - step[:, np.newaxis] * gradient_going, 0).sum(axis=1) - 1) / kept.sum(axis=1)
+            _, mean_weights, deviation_weights = objective_and_gradient_weights(x_going, means_going, root_going)
+            outside_gradient = np.matmul(np.hstack([mean_weights, deviation_weights]), funds.T)
+            outside_gradient += inside_going
+            leaving = outside_gradient.min(axis=1) < -threshold / step
+            if leaving.any():
+                # To take this step over a new working set instead
+                stopped = going[leaving]
+                x[stopped], objective[stopped], steps[stopped] = x_going[leaving], objective_going[leaving], step_before[leaving]
+                left[stopped] = True
+
+        x_change = x_new - x_going
+        # Barzilai-Borwein step sizes for the next step
+        curvature = np.einsum('ij,ij->i', x_change, gradient_new - gradient_going)
+        step = np.where(
+            curvature > 0,
+            np.einsum('ij,ij->i', x_change, x_change) / np.where(curvature > 0, curvature, 1),
+            step * 2
+        )
+        x_going, objective_going, gradient_going = x_new, objective_new, gradient_new
+        nit[going[~leaving]] += 1
+
+        # Write out the problems that converged or ran out of steps, and drop
+        # them from the ones going along with the ones leaving
+        stopping = ~leaving & (np.abs(x_change).max(axis=1) < tol)
+        converged[going[stopping]] = True
+        stopping |= ~leaving & (nit[going] >= maxiter[going])
+        if stopping.any():
+            stopped = going[stopping]
+            x[stopped], objective[stopped], steps[stopped] = x_going[stopping], objective_going[stopping], step[stopping]
+        keep = ~(stopping | leaving)
+        if not keep.all():
+            going, step = going[keep], step[keep]
+            x_going, objective_going, gradient_going, masks_going = x_going[keep], objective_going[keep], gradient_going[keep], masks_going[keep]
+            if inside is not None:
+                means_going, root_going, inside_going = means_going[keep], root_going[keep], inside_going[keep]
+
+    return optimize.OptimizeResult(x = x, fun = objective, nit = nit, nfev = nfev, success = converged, step = steps, left = left)
+
+def objective_functions(x, factor_means, factor_var_covar_root):
+    """
+    `objective_function` of every row of x.
+    @param [numpy.ndarray] x Problems by funds
+    @param [numpy.ndarray] factor_means The mean of each fund's factors, or
+        problems by funds when each problem has its own funds
+    @param [numpy.ndarray] factor_var_covar_root Funds by factors, or problems
+        by funds by factors when each problem has its own funds
+    @return [tuple] The objectives, and their gradients (problems by funds)
+    """
+    objective, mean_weights, deviation_weights = objective_and_gradient_weights(x, factor_means, factor_var_covar_root)
+    if factor_means.ndim == 1:
+        gradient = mean_weights * factor_means + np.matmul(deviation_weights, factor_var_covar_root.T)
+    else:
+        gradient = mean_weights * factor_means + np.einsum('ijk,ik->ij', factor_var_covar_root, deviation_weights)
+    return objective, gradient
+
+def objective_and_gradient_weights(x, factor_means, factor_var_covar_root):
+    """
+    Every fund's gradient is its mean and its row of the root, weighted the
+    same way for all of a problem's funds, so the gradients of any other funds
+    at x only take these weights.
+    @param [numpy.ndarray] x Problems by funds
+    @param [numpy.ndarray] factor_means See `objective_functions`
+    @param [numpy.ndarray] factor_var_covar_root See `objective_functions`
+    @return [tuple] The objectives, the weights of the means (problems by 1),
+        and of the roots (problems by factors)
+    """
+    if factor_means.ndim == 1:
+        deviation = np.matmul(x, factor_var_covar_root)
+        mean = np.matmul(x, factor_means)
+    else:
+        deviation = np.einsum('ij,ijk->ik', x, factor_var_covar_root)
+        mean = np.einsum('ij,ij->i', x, factor_means)
+    standard_deviation = np.linalg.norm(deviation, axis=1)
+    objective = -mean / (1 + standard_deviation)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deviation_weights = np.where(
+            standard_deviation > 0,
+            mean / (1 + standard_deviation)**2 / standard_deviation,
+            0
+        )[:, np.newaxis] * deviation
+    return objective, -1 / (1 + standard_deviation[:, np.newaxis]), deviation_weights
+
+def project_onto_masked_simplex(v, masks):
+    """
+    Like `project_onto_simplex`, but with the values outside each row's mask
+    left at zero.
+    @param [numpy.ndarray] v Problems by funds
+    @param [numpy.ndarray] masks Problems by funds
+    @return [numpy.ndarray] Problems by funds
+    """
+    # The projection zeroes every value more than 1 below a row's largest, so
+    # push the masked out ones down by 2
+    floor = np.where(masks, v, -np.inf).max(axis=-1, keepdims=True) - 2
+    return project_onto_simplex(np.where(masks, v, floor))
+
+def project_onto_simplex(v):
+    """
+    The closest point to v, along its last axis, whose values are positive and
+    sum to 1.
+    https://arxiv.org/abs/1309.1541
+    @param [numpy.ndarray] v
+    @return [numpy.ndarray] The same shape as v
+    """
+    n = v.shape[-1]
+    rows = v.reshape(-1, n)
+    # Usually only a few funds stay positive, so find the threshold from the
+    # largest few values of each row, and only sort all of a row's values
+    # when even the smallest of those few stays positive
+    top = min(n, SIMPLEX_TOP_VALUES)
+    theta, exact = simplex_threshold(-np.sort(-np.partition(rows, n - top, axis=-1)[:, n - top:], axis=-1))
+    if top < n and not exact.all():
+        theta[~exact], _ = simplex_threshold(-np.sort(-rows[~exact], axis=-1))
+    return np.maximum(v - theta.reshape(v.shape[:-1] + (1,)), 0)
+
+# How many of the largest values `project_onto_simplex` sorts at first
+SIMPLEX_TOP_VALUES = 32
+
+def simplex_threshold(u):
+    """
+    @param [numpy.ndarray] u Rows of the largest values of v, sorted from largest
+    @return [tuple] The threshold to subtract from each row of v in
+        `project_onto_simplex`, and whether the values in u were enough to
+        find it, i.e. the smallest of them doesn't stay positive
+    """
+    cumulative_sums = np.cumsum(u, axis=-1) - 1
+    positive = u - cumulative_sums / np.arange(1, u.shape[-1] + 1) > 0
+    # The index of the last positive value
+    rho = u.shape[-1] - 1 - np.argmax(positive[:, ::-1], axis=-1)
+    theta = cumulative_sums[np.arange(len(u)), rho] / (rho + 1)
+    return theta, ~positive[:, -1]
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import tempfile
+
+class SnapshotCache:
+    """
+    Keeps float64 data frames on local disk as memory-mappable `.npy` files,
+    so that warm runs load them in milliseconds instead of re-running the
+    same SELECTs and converting every `Decimal` again. Each snapshot is keyed
+    by a name, e.g. factor_returns/Emerging, and the version of the data it
+    was made from; only the latest version of a name is kept.
+    ```py
+    df = SnapshotCache().fetch('factor_returns/Emerging', version, lambda: load_it_from_the_db())
+    ```
+    """
+    DIRECTORY = 'snapshots'
+
+    def __init__(self, directory=DIRECTORY):
+        self.directory = directory
+
+    def fetch(self, name, version, load):
+        """
+        @param [string] name What the snapshot is of, e.g. factor_returns/Emerging
+        @param [string] version The version of the data, e.g. a fingerprint of the rows in the DB
+        @param [function] load Returns the data frame, if there's no snapshot of this version yet
+        @return [pandas.core.frame.DataFrame] With float64 values
+        """
+        path = self.path(name, version)
+        if os.path.isdir(path):
+            return self.read(path)
+        data_frame = load()
+        self.invalidate(name)
+        self.write(path, data_frame)
+        return data_frame
+
+    @staticmethod
+    def version(*aggregates):
+        """
+        Fingerprints the rows a snapshot is made from by aggregates that any
+        insert, delete or update of them changes, e.g. their count, their
+        largest id and the sum of each value column weighted by id.
+        @param [list] aggregates Numbers, or None where there are no rows
+        @return [string] E.g. 12-345-1f2e3d4c5b6a7988
+        """
+        checksum = hashlib.blake2b(json.dumps(aggregates[2:], default=float).encode(), digest_size=8).hexdigest()
+        return '-'.join([str(aggregate) for aggregate in aggregates[:2]] + [checksum])
+
+    def invalidate(self, name=''):
+        """
+        Deletes every snapshot of the name, or whose name starts with it.
+        @param [string] name E.g. factor_returns, to delete all of them
+        """
+        shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def path(self, name, version):
+        return os.path.join(self.directory, name, version)
+
+    def write(self, path, data_frame):
+        # Write to a directory of this writer's own first, so that concurrent
+        # readers never see half a snapshot, and concurrent writers of the same
+        # one, e.g. the market types' worker processes, don't write over each other
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = tempfile.mkdtemp(prefix=f'{os.path.basename(path)}.', suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            np.save(os.path.join(temporary_path, 'values.npy'), np.ascontiguousarray(data_frame.to_numpy(dtype='float64')))
+            np.save(os.path.join(temporary_path, 'index.npy'), np.asarray(data_frame.index, dtype='datetime64[D]'))
+            with open(os.path.join(temporary_path, 'meta.json'), 'w') as meta_file:
+                json.dump({'index_name': data_frame.index.name, 'columns': list(data_frame.columns)}, meta_file)
+            try:
+                os.rename(temporary_path, path)
+            except OSError:
+                # Another writer got there first, with the same version of the same data
+                if not os.path.isdir(path):
+                    raise
+        finally:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+
+    def read(self, path):
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+        # Back to datetime.date objects, like pd.read_sql returns for Date columns
+        index = pd.Index(np.load(os.path.join(path, 'index.npy')).astype(object), name=meta['index_name'])
+        return pd.DataFrame(values, index=index, columns=meta['columns'], copy=False)
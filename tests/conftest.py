@@ -0,0 +1,24 @@
+import os
+import sys
+
+# So that the tests import the application's packages, e.g. `from lib import ...`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import db
+import pytest
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    Points the application at a new SQLite DB, with the schema and seeds
+    applied, and runs the test from its own directory, so that its snapshots
+    and caches start out empty too.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, 'DATABASE_URL', f'sqlite:///{tmp_path / "ff.db"}')
+    db.Session.remove()
+    db.engine.cache_clear()
+    yield db.engine()
+    db.Session.remove()
+    db.engine().dispose()
+    db.engine.cache_clear()
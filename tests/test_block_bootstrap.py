@@ -0,0 +1,78 @@
+from lib import block_bootstrap, factor_regression, fund_screener
+import numpy as np
+import pandas as pd
+import pytest
+
+def panel(months=120, autocorrelation=0.0):
+    rng = np.random.default_rng(4)
+    index = pd.date_range('2010-01-31', periods=months, freq='M')
+    factor_returns = pd.DataFrame(
+        rng.normal(0, 0.04, (months, len(factor_regression.FIVE_FACTORS))),
+        index=index,
+        columns=factor_regression.FIVE_FACTORS
+    )
+    # Loaded on the market and small minus big, and not on the rest
+    loadings = np.array([1.0, 0.6, 0.0, 0.0, 0.0])
+    noise = rng.normal(0, 0.02, (months, 3))
+    for month in range(1, months):
+        noise[month] += autocorrelation * noise[month - 1]
+    excess_returns = pd.DataFrame(
+        (factor_returns.to_numpy() @ loadings)[:, None] + noise,
+        index=index,
+        columns=['AAA', 'BBB', 'CCC']
+    )
+    # Too few months to fit
+    excess_returns.iloc[3:, 2] = np.nan
+    return excess_returns, factor_returns
+
+def test_draws_as_many_months_as_there_are():
+    rng = np.random.Generator(np.random.PCG64(0))
+    counts = block_bootstrap.block_counts(rng, 100, 50, 7)
+    assert counts.shape == (100, 50)
+    assert (counts.sum(axis=1) == 50).all()
+    assert (counts >= 0).all()
+    # Blocks as long as all the months draw every month once
+    assert (block_bootstrap.block_counts(rng, 10, 50, 50) == 1).all()
+
+def test_intervals_tell_loaded_factors_from_the_rest():
+    excess_returns, factor_returns = panel()
+    results = block_bootstrap.bootstrap(excess_returns, factor_returns, replicates=500)
+    assert results.block_length == 5
+
+    lower, upper = results.lower.loc['AAA'], results.upper.loc['AAA']
+    assert (lower[['market_minus_risk_free', 'small_minus_big']] > 0).all()
+    assert (lower[['high_minus_low', 'robust_minus_weak', 'conservative_minus_aggressive']] < 0).all()
+    assert (upper[['high_minus_low', 'robust_minus_weak', 'conservative_minus_aggressive']] > 0).all()
+    # Around the OLS estimates
+    params = factor_regression.fit(excess_returns, factor_returns).params.loc['AAA']
+    assert ((lower < params) & (params < upper)).all()
+    assert results.lower.loc['CCC'].isna().all()
+
+    # The same seed draws the same months
+    again = block_bootstrap.bootstrap(excess_returns, factor_returns, replicates=500)
+    assert again.lower.equals(results.lower)
+
+def test_intervals_widen_with_autocorrelated_residuals():
+    def width(autocorrelation):
+        excess_returns, factor_returns = panel(autocorrelation=autocorrelation)
+        results = block_bootstrap.bootstrap(excess_returns, factor_returns, replicates=500, block_length=12)
+        return (results.upper - results.lower).loc[['AAA', 'BBB'], factor_regression.INTERCEPT].mean()
+
+    assert width(0.9) > 2 * width(0.0)
+
+def test_screens_by_the_intervals_rather_than_the_pvalues():
+    excess_returns, factor_returns = panel()
+    df = factor_regression.fit(excess_returns, factor_returns).to_data_frame()
+    intervals = block_bootstrap.bootstrap(excess_returns, factor_returns, replicates=500).to_data_frame()
+    investments_df = pd.DataFrame({'ticker': ['AAA', 'BBB'], 'expense_ratio': 0.005, 'dividend_yield': 0.02})
+
+    # Like a p-value that's too optimistic about a loading the intervals don't back
+    df.loc[(df.ticker == 'AAA') & (df.factor == 'high_minus_low'), 'pvalue'] = 0.001
+    by_pvalues = fund_screener.screen(df, investments_df).set_index('ticker')
+    by_intervals = fund_screener.screen(df.merge(intervals, on=['ticker', 'factor']), investments_df).set_index('ticker')
+
+    assert by_pvalues.loc['AAA', 'hml'] != 0
+    # No fund's hml loading survives, so there's no column for it
+    assert 'hml' not in by_intervals.columns
+    assert by_intervals.loc['AAA', 'mmrf'] == pytest.approx(by_pvalues.loc['AAA', 'mmrf'])
+    assert by_intervals.loc['AAA', 'smb'] > 0
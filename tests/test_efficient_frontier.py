@@ -0,0 +1,50 @@
+from lib import efficient_frontier, sharpe_ratio_solver
+import numpy as np
+import pandas as pd
+import pytest
+
+def funds(count=60):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        rng.normal(0.1, 0.3, (count, 4)).round(3),
+        columns=sharpe_ratio_solver.RELEVANT_COLUMNS,
+        index=[f'F{i:02}' for i in range(count)]
+    )
+    return df.assign(ticker=df.index, expense_ratio=0.005)
+
+def test_trades_mean_for_stdev_along_the_frontier():
+    frontier = efficient_frontier.trace_frontier(funds())
+    points = frontier.points
+    assert len(points) == 200
+    # From the least averse to risk, the mean and its stdev only go down
+    assert (np.diff(points['mean']) <= 10**-6).all()
+    assert (np.diff(points.stdev) <= 10**-6).all()
+    assert points['mean'].iloc[0] - points['mean'].iloc[-1] > 0.02
+    assert points.funds.iloc[0] == 1
+    assert frontier.weights.sum(axis=1).to_numpy() == pytest.approx(1)
+
+def test_its_best_point_is_as_good_as_choose_best():
+    df = funds()
+    frontier = efficient_frontier.trace_frontier(df, points=400)
+    _, factor_means, factor_var_covar_root = sharpe_ratio_solver.relevant_factors(df)
+    objectives = np.array([
+        sharpe_ratio_solver.objective_function(x, factor_means, factor_var_covar_root)[0]
+        for x in frontier.weights.to_numpy()
+    ])
+    best = objectives.argmin()
+
+    # Solved as tightly as the frontier is, they agree
+    chosen_summarizer = sharpe_ratio_solver.choose_best(df.copy(), solver=sharpe_ratio_solver.maximize_sharpe_ratio_by_projected_gradient)
+    assert chosen_summarizer.solver_result.fun == pytest.approx(objectives[best], rel=10**-4)
+    assert frontier.chosen(best).sharpe_ratio() == pytest.approx(chosen_summarizer.sharpe_ratio(), rel=10**-2)
+
+    # SLSQP only solves to a tolerance of 1e-2, so it can't do better than
+    # the frontier, but gets close
+    chosen_summarizer = sharpe_ratio_solver.choose_best(df.copy())
+    assert chosen_summarizer.solver_result.fun >= objectives[best] - 10**-6
+    assert chosen_summarizer.solver_result.fun == pytest.approx(objectives[best], rel=0.05)
+
+def test_skips_funds_that_are_too_few():
+    df = funds()
+    assert efficient_frontier.trace_frontier(df.iloc[:0]) == (0, 0, 0)
+    assert efficient_frontier.trace_frontier(df.iloc[:1]) == (0, 0, 0)
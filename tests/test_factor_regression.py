@@ -0,0 +1,69 @@
+from lib import factor_regression
+import numpy as np
+import pandas as pd
+import pytest
+import statsmodels.api as sm
+
+def panel(months=48):
+    rng = np.random.default_rng(0)
+    index = pd.date_range('2015-01-31', periods=months, freq='M')
+    factor_returns = pd.DataFrame(
+        rng.normal(0, 0.04, (months, len(factor_regression.FIVE_FACTORS))),
+        index=index,
+        columns=factor_regression.FIVE_FACTORS
+    ).assign(risk_free=0.001)
+    # Two factors that move together for the first year, so that a ticker
+    # with returns in just those months can't tell them apart
+    factor_returns.iloc[:12, 2] = factor_returns.iloc[:12, 1]
+
+    loadings = rng.normal(0.5, 0.3, (len(factor_regression.FIVE_FACTORS), 4))
+    values = np.matmul(factor_returns[factor_regression.FIVE_FACTORS].to_numpy(), loadings) + rng.normal(0, 0.01, (months, 4))
+    excess_returns = pd.DataFrame(values, index=index, columns=['FULL', 'GAPS', 'RANK', 'SHORT'])
+    # Missing months here and there
+    excess_returns.iloc[[3, 10, 11, 30, 47], 1] = np.nan
+    excess_returns.iloc[12:, 2] = np.nan
+    excess_returns.iloc[:40, 3] = np.nan
+    return excess_returns, factor_returns
+
+def statsmodels_results(excess_returns, factor_returns):
+    results = {}
+    for ticker in excess_returns.columns:
+        X = sm.add_constant(factor_returns[factor_regression.FIVE_FACTORS]).rename(columns={'const': factor_regression.INTERCEPT})
+        results[ticker] = sm.OLS(excess_returns[ticker], X, missing='drop').fit()
+    return results
+
+def test_matches_statsmodels():
+    excess_returns, factor_returns = panel()
+    results = factor_regression.fit(excess_returns, factor_returns)
+    X, Y, mask = factor_regression.regression_inputs(excess_returns, factor_returns)
+    *_, rsquared_adj = factor_regression.solve_normal_equations(*factor_regression.cross_products(X, Y, mask))
+
+    for i, (ticker, expected) in enumerate(statsmodels_results(excess_returns, factor_returns).items()):
+        assert results.nobs[ticker] == expected.nobs
+        assert results.params.loc[ticker].to_numpy() == pytest.approx(expected.params.to_numpy(), rel=10**-6, abs=10**-10)
+        assert results.tvalues.loc[ticker].to_numpy() == pytest.approx(expected.tvalues.to_numpy(), rel=10**-6)
+        assert results.pvalues.loc[ticker].to_numpy() == pytest.approx(expected.pvalues.to_numpy(), rel=10**-6, abs=10**-12)
+        assert rsquared_adj[i] == pytest.approx(expected.rsquared_adj, rel=10**-9)
+
+def test_matches_statsmodels_where_a_ticker_cant_tell_two_factors_apart():
+    excess_returns, factor_returns = panel()
+    expected = statsmodels_results(excess_returns, factor_returns)['RANK']
+    assert expected.df_resid == 12 - 5
+
+    results = factor_regression.fit(excess_returns[['RANK']], factor_returns)
+    # The least squares solution of least length, which splits the loading
+    # evenly between the two factors
+    assert results.params.iloc[0].to_numpy() == pytest.approx(expected.params.to_numpy(), rel=10**-6, abs=10**-10)
+    assert results.params.iloc[0, 2] == pytest.approx(results.params.iloc[0, 3])
+    assert results.tvalues.iloc[0].to_numpy() == pytest.approx(expected.tvalues.to_numpy(), rel=10**-6)
+    assert results.pvalues.iloc[0].to_numpy() == pytest.approx(expected.pvalues.to_numpy(), rel=10**-6)
+
+def test_fit_masked_matches_fit():
+    excess_returns, factor_returns = panel()
+    X, Y, mask = factor_regression.regression_inputs(excess_returns, factor_returns)
+    terms = [factor_regression.INTERCEPT] + factor_regression.FIVE_FACTORS
+    # Fitting a subset of the tickers, like the regression cache does its misses
+    results = factor_regression.fit_masked(X, Y[[1, 3]], mask[[1, 3]], ['GAPS', 'SHORT'], terms)
+    expected = factor_regression.fit(excess_returns, factor_returns)
+    assert results.params.to_numpy() == pytest.approx(expected.params.loc[['GAPS', 'SHORT']].to_numpy())
+    assert results.nobs.tolist() == [43, 8]
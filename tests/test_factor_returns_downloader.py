@@ -0,0 +1,289 @@
+import calendar
+import csv
+import datetime
+from datetime import date
+from email.utils import formatdate
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+from lib.factor_returns import FactorReturns
+from lib.factor_returns_downloader import FactorReturnsDownloader
+import os
+import pandas as pd
+import pytest
+import threading
+import zipfile
+
+def ken_french_zip(rows, header=',Mkt-RF,SMB,HML,RMW,CMA,RF', filename='Emerging_5_Factors.csv'):
+    """
+    @param [list] rows A (yyyymm, [percentages]) [tuple] per month
+    @param [string] header The header line of the table, e.g. ',WML' for momentum
+    @param [string] filename The name of the CSV in the zip file
+    @return [bytes] A zip file with a CSV laid out like the Ken French ones
+    """
+    lines = [
+        'This file was created using the 202112 Bloomberg database.',
+        'Missing data are indicated by -99.99.',
+        '',
+        header
+    ] + [f'{month},{",".join(f"{value:.2f}" for value in values)}' for month, values in rows] + [
+        '',
+        ' Annual Factors: January-December ',
+        header,
+        f'2021,{",".join(["1.00"] * header.count(","))}'
+    ]
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w') as z:
+        z.writestr(filename, '\r\n'.join(lines))
+    return content.getvalue()
+
+class KenFrenchStub(BaseHTTPRequestHandler):
+    """
+    Serves `files`, by path, with an ETag and a Last-Modified header if the
+    test sets them, answering conditional requests that match with 304 Not
+    Modified, unless `ignore_conditions` is set.
+    """
+    files = {}
+    etag = None
+    last_modified = None
+    ignore_conditions = False
+    requests = []
+
+    def do_GET(self):
+        KenFrenchStub.requests.append((self.path, self.headers['If-None-Match'], self.headers['If-Modified-Since']))
+        if self.path not in self.files:
+            self.send_error(404)
+            return
+        not_modified = \
+            (self.etag is not None and self.headers['If-None-Match'] == self.etag) or \
+            (self.last_modified is not None and self.headers['If-Modified-Since'] == self.last_modified)
+        if not_modified and not self.ignore_conditions:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = self.files[self.path]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Length', str(len(body)))
+        if self.etag is not None:
+            self.send_header('ETag', self.etag)
+        if self.last_modified is not None:
+            self.send_header('Last-Modified', self.last_modified)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+ROWS = [
+    ('202110', [1.0, 2.0, 3.0, 4.0, 5.0, 0.01]),
+    ('202111', [-1.5, 0.5, -99.99, 0.25, 0.75, 0.01])
+]
+PATH = '/Emerging_5_Factors_CSV.zip'
+
+@pytest.fixture
+def ken_french(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('downloads')
+    KenFrenchStub.files = {PATH: ken_french_zip(ROWS)}
+    KenFrenchStub.etag = None
+    KenFrenchStub.last_modified = None
+    KenFrenchStub.ignore_conditions = False
+    KenFrenchStub.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KenFrenchStub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+def downloader():
+    return FactorReturnsDownloader(FactorReturnsDownloader.FiveFactorDataSource('Emerging', 'Emerging_5_Factors'))
+
+def metadata():
+    with open(downloader().data_source.metadata_filename()) as metadata_file:
+        return json.load(metadata_file)
+
+def test_downloads_and_parses_the_file(ken_french):
+    KenFrenchStub.etag = '"v1"'
+    assert downloader().refresh_zipfile(ken_french)
+    assert metadata() == {'etag': '"v1"', 'last_modified': None, 'sha256': hashlib.sha256(KenFrenchStub.files[PATH]).hexdigest()}
+
+    data_frame = downloader().from_csv()
+    assert list(data_frame.occurred_at) == [date(2021, 10, 31), date(2021, 11, 30)]
+    assert data_frame.market_minus_risk_free.tolist() == pytest.approx([0.01, -0.015])
+    # -99.99 is missing data
+    assert data_frame.high_minus_low.isna().tolist() == [False, True]
+
+def test_etag_gets_not_modified(ken_french):
+    KenFrenchStub.etag = '"v1"'
+    assert downloader().refresh_zipfile(ken_french)
+    assert not downloader().refresh_zipfile(ken_french)
+    assert KenFrenchStub.requests == [(PATH, None, None), (PATH, '"v1"', None)]
+
+def test_if_modified_since_gets_not_modified(ken_french):
+    KenFrenchStub.last_modified = formatdate(0, usegmt=True)
+    assert downloader().refresh_zipfile(ken_french)
+    assert not downloader().refresh_zipfile(ken_french)
+    assert KenFrenchStub.requests[-1] == (PATH, None, KenFrenchStub.last_modified)
+
+def test_unchanged_hash_is_not_a_change(ken_french):
+    # The server sends the whole file again, but it's the same bytes
+    KenFrenchStub.etag = '"v1"'
+    KenFrenchStub.ignore_conditions = True
+    assert downloader().refresh_zipfile(ken_french)
+    modified_at = os.stat(downloader().data_source.zip_filename()).st_mtime_ns
+    assert not downloader().refresh_zipfile(ken_french)
+    assert os.stat(downloader().data_source.zip_filename()).st_mtime_ns == modified_at
+
+def test_changed_hash_replaces_the_file(ken_french):
+    KenFrenchStub.etag = '"v1"'
+    assert downloader().refresh_zipfile(ken_french)
+
+    # A new month, under a new ETag that the old one no longer matches
+    KenFrenchStub.files[PATH] = ken_french_zip(ROWS + [('202112', [3.0, 0.0, 1.0, 2.0, 1.0, 0.01])])
+    KenFrenchStub.etag = '"v2"'
+    assert downloader().refresh_zipfile(ken_french)
+    assert metadata()['sha256'] == hashlib.sha256(KenFrenchStub.files[PATH]).hexdigest()
+    assert metadata()['etag'] == '"v2"'
+    assert downloader().from_csv().occurred_at.iloc[-1] == date(2021, 12, 31)
+    assert not os.path.exists(f'{downloader().data_source.zip_filename()}.tmp')
+
+def test_missing_metadata_downloads_unconditionally(ken_french):
+    KenFrenchStub.etag = '"v1"'
+    assert downloader().refresh_zipfile(ken_french)
+    os.remove(downloader().data_source.metadata_filename())
+    # Without its hash to compare with, the file counts as changed
+    assert downloader().refresh_zipfile(ken_french)
+    assert KenFrenchStub.requests[-1] == (PATH, None, None)
+
+def parse_row_by_row(data_source, text):
+    """
+    How `from_csv` parsed the extracted CSV before it read the table with
+    pandas: every row, one at a time, keeping those that parse.
+    """
+    def parse_date(given_date):
+        d = datetime.datetime.strptime(given_date.strip(), data_source.DATE_FORMAT).date()
+        return datetime.date(d.year, d.month, calendar.monthrange(d.year, d.month)[-1])
+
+    def parse_float(given_float):
+        f = float(given_float)
+        return None if f == data_source.MISSING else f / 100
+
+    def parse(given_row):
+        if not len(given_row) == len(data_source.columns()):
+            return
+        try:
+            head, *tail = given_row
+            return [parse_date(head)] + [parse_float(el) for el in tail]
+        except ValueError:
+            return
+
+    rows = [parse(row) for row in csv.reader(io.StringIO(text))]
+    rows = [row for row in rows if row]
+    return pd.DataFrame(rows, columns=data_source.columns())
+
+def test_parses_like_the_row_by_row_parser():
+    # Laid out like F-F_Research_Data_5_Factors_2x3.csv
+    text = '\r\n'.join([
+        'This file was created by CMPT_ME_BEME_OP_INV_RETS using the 202112 CRSP database.',
+        'The 1-month TBill return is from Ibbotson and Associates Inc.',
+        '',
+        ',Mkt-RF,SMB,HML,RMW,CMA,RF',
+        '196307,   -0.39,   -0.41,   -0.97,    0.68,   -1.18,    0.27',
+        '196308,    5.07,   -0.80,    1.80,    0.36,   -0.35,    0.25',
+        '196309,   -1.57,  -99.99,    0.13,   -0.71,    0.29,    0.27',
+        '196310,    2.53,   -1.34,   -0.10,    2.80,   -2.01,    0.29',
+        '196311,   -0.85,   -0.88,    1.75,   -0.51,    2.24,    0.27',
+        '196312,    1.83,   -2.05,   -0.09,    0.03,   -0.07,    0.29',
+        '',
+        ' Annual Factors: January-December ',
+        ',Mkt-RF,SMB,HML,RMW,CMA,RF',
+        '  1964,   12.57,    0.15,    9.77,    0.83,    4.56,    3.54',
+        '  1965,   10.65,   21.65,    7.12,    0.07,    0.46,    3.93',
+        '',
+        'Copyright 2021 Kenneth R. French'
+    ])
+    data_source = FactorReturnsDownloader.FiveFactorDataSource('US', 'F-F_Research_Data_5_Factors_2x3')
+    data_frame = data_source.parse(text)
+    pd.testing.assert_frame_equal(data_frame, parse_row_by_row(data_source, text))
+    assert len(data_frame) == 6
+    assert data_frame.small_minus_big.isna().tolist() == [False, False, True, False, False, False]
+
+MOMENTUM_ROWS = [
+    # Momentum starts a month after the five factors
+    ('202111', [2.5]),
+    ('202112', [-0.5])
+]
+MOMENTUM_PATH = '/Emerging_MOM_Factor_CSV.zip'
+
+def test_parses_momentum(ken_french):
+    KenFrenchStub.files[MOMENTUM_PATH] = ken_french_zip(MOMENTUM_ROWS, header=',WML', filename='Emerging_MOM_Factor.csv')
+    momentum = FactorReturnsDownloader(FactorReturnsDownloader.MomentumDataSource('Emerging', 'Emerging_MOM_Factor'))
+    assert momentum.refresh_zipfile(ken_french)
+
+    data_frame = momentum.from_csv()
+    assert list(data_frame.columns) == ['occurred_at', 'winners_minus_losers']
+    assert list(data_frame.occurred_at) == [date(2021, 11, 30), date(2021, 12, 31)]
+    assert data_frame.winners_minus_losers.tolist() == pytest.approx([0.025, -0.005])
+
+def test_parses_and_merges_a_momentum_file_that_starts_later():
+    five_factors = FactorReturnsDownloader.FiveFactorDataSource('Developed ex US', 'Developed_ex_US_5_Factors').parse('\r\n'.join([
+        'This file was created using the 202112 Bloomberg database.',
+        'Missing data are indicated by -99.99.',
+        '',
+        ',Mkt-RF,SMB,HML,RMW,CMA,RF',
+        '199007,   -3.42,    0.58,    0.31,   -0.25,    0.80,    0.68',
+        '199008,  -10.15,    1.14,    1.54,   -0.36,    1.14,    0.66',
+        '199009,  -12.37,    2.21,    2.23,    0.31,    1.92,    0.60',
+        '199010,   12.12,   -3.55,   -1.44,   -0.51,   -1.59,    0.68',
+        '',
+        ' Annual Factors: January-December ',
+        ',Mkt-RF,SMB,HML,RMW,CMA,RF',
+        '  1991,   18.22,   -4.77,    2.06,    3.01,   -0.73,    5.60'
+    ]))
+    # Laid out like Ken French's momentum files, with a padded header, and
+    # starting months after the five factors
+    momentum = FactorReturnsDownloader.MomentumDataSource('Developed ex US', 'Developed_ex_US_Mom_Factor').parse('\r\n'.join([
+        'This file was created using the 202112 Bloomberg database.',
+        'Missing data are indicated by -99.99.',
+        '',
+        ',WML   ',
+        '199009,    4.08',
+        '199010,  -99.99',
+        '199011,   -1.39',
+        '',
+        ' Annual Factors: January-December ',
+        ',WML',
+        '  1991,   11.07'
+    ]))
+    assert list(momentum.occurred_at) == [date(1990, 9, 30), date(1990, 10, 31), date(1990, 11, 30)]
+
+    data_frame = FactorReturnsDownloader.merge([five_factors, momentum])
+    assert list(data_frame.occurred_at) == [date(1990, 7, 31), date(1990, 8, 31), date(1990, 9, 30), date(1990, 10, 31)]
+    assert data_frame.market_minus_risk_free.tolist() == pytest.approx([-0.0342, -0.1015, -0.1237, 0.1212])
+    # Missing before it starts, and where the file says it's missing
+    assert data_frame.winners_minus_losers.isna().tolist() == [True, True, False, True]
+    assert data_frame.winners_minus_losers.iloc[2] == pytest.approx(0.0408)
+
+def test_merges_momentum_into_the_five_factors(ken_french, database, monkeypatch):
+    # Without missing data, which the DB doesn't take for the five factors
+    KenFrenchStub.files[PATH] = ken_french_zip([ROWS[0], ('202111', [-1.5, 0.5, 0.25, 0.25, 0.75, 0.01])])
+    KenFrenchStub.files[MOMENTUM_PATH] = ken_french_zip(MOMENTUM_ROWS, header=',WML', filename='Emerging_MOM_Factor.csv')
+    monkeypatch.setattr(FactorReturnsDownloader, 'DATA_SOURCES', [
+        FactorReturnsDownloader.FiveFactorDataSource('Emerging', 'Emerging_5_Factors'),
+        FactorReturnsDownloader.MomentumDataSource('Emerging', 'Emerging_MOM_Factor')
+    ])
+    os.makedirs('downloads', exist_ok=True)
+    data_frame = FactorReturnsDownloader.refresh_all(ken_french)['Emerging']
+
+    # Every month of the five factors, even those before momentum starts,
+    # and none of momentum's after they end
+    assert list(data_frame.occurred_at) == [date(2021, 10, 31), date(2021, 11, 30)]
+    assert data_frame.winners_minus_losers.isna().tolist() == [True, False]
+    assert data_frame.winners_minus_losers.iloc[1] == pytest.approx(0.025)
+
+    FactorReturns.sync('Emerging', data_frame)
+    snapshot = FactorReturns.fetch_snapshot('Emerging')
+    assert snapshot.winners_minus_losers.isna().tolist() == [True, False]
@@ -0,0 +1,105 @@
+import datetime
+from db.investment import Investment
+from db.market_type import MarketType
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from lib.investments import Investments
+import pytest
+import threading
+from urllib.parse import parse_qs, urlparse
+
+# What the stub knows about each ticker, by endpoint, in the Seeking Alpha API's shape
+PROFILES = {
+    'EEM': {'expenseRatio': 0.0068, 'inceptionDate': '04/07/2003'},
+    'DEM': {'expenseRatio': 0.0063},
+    'ECON': {'inceptionDate': '08/15/2010'}
+}
+SUMMARIES = {
+    'EEM': {'divYield': 0.021},
+    'DGS': {'divYield': 0.034},
+    # Without a yield, so nothing to fill
+    'DEM': {'divYield': None}
+}
+
+class SeekingAlphaStub(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        symbols = parse_qs(url.query)['symbols'][0].split(',')
+        attributes = {'/symbols/get-profile': PROFILES, '/symbols/get-summary': SUMMARIES}[url.path]
+        SeekingAlphaStub.requests.append((url.path, symbols, self.headers['x-rapidapi-key']))
+        body = json.dumps({'data': [
+            {'id': symbol, 'attributes': attributes[symbol]}
+            for symbol in symbols if symbol in attributes
+        ]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+@pytest.fixture
+def seeking_alpha():
+    SeekingAlphaStub.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SeekingAlphaStub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/symbols'
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def investments(database, monkeypatch):
+    # The singleton binds to the DB on first use, so start a new one on the test's DB
+    monkeypatch.setattr(Investments, '_instance', None)
+    monkeypatch.setenv('SEEKING_ALPHA_RAPIDAPI_KEY', 'test-key')
+    yield Investments()
+    Investments._instance.query.session.close()
+
+def emerging_investments(investments):
+    return {
+        investment.ticker_symbol: investment
+        for investment in investments.query.session.query(Investment).join(MarketType).filter(MarketType.name == 'Emerging')
+    }
+
+def test_backfills_facts_from_seeking_alpha(investments, seeking_alpha):
+    ticker_symbols = sorted(emerging_investments(investments))
+    investments.backfill_facts_from_seeking_alpha('Emerging', concurrency=4, root_url=seeking_alpha, batch_size=3)
+    investments.query.session.expire_all()
+    filled = emerging_investments(investments)
+
+    facts = [
+        (ticker_symbol, fact)
+        for ticker_symbol, investment in filled.items()
+        for fact in ['expense_ratio', 'dividend_yield', 'inception_date']
+        if getattr(investment, fact) is not None
+    ]
+    assert len(facts) == 6
+    assert filled['EEM'].expense_ratio == pytest.approx(0.0068)
+    assert filled['EEM'].dividend_yield == pytest.approx(0.021)
+    assert filled['EEM'].inception_date == datetime.date(2003, 4, 7)
+    assert filled['DEM'].expense_ratio == pytest.approx(0.0063)
+    assert filled['DEM'].dividend_yield is None
+    assert filled['DGS'].dividend_yield == pytest.approx(0.034)
+    assert filled['ECON'].inception_date == datetime.date(2010, 8, 15)
+
+    # Both endpoints got asked about every ticker, at most 4 at a time, with the API key
+    for endpoint in ['/symbols/get-profile', '/symbols/get-summary']:
+        requested = [symbols for path, symbols, _ in SeekingAlphaStub.requests if path == endpoint]
+        assert sorted(symbol for symbols in requested for symbol in symbols) == ticker_symbols
+        assert max(len(symbols) for symbols in requested) == 4
+    assert {key for _, _, key in SeekingAlphaStub.requests} == {'test-key'}
+
+def test_keeps_facts_already_known(investments, seeking_alpha):
+    with investments.query.bulk_updater() as updater:
+        updater.add('EEM', {'expense_ratio': 0.007})
+    investments.backfill_facts_from_seeking_alpha('Emerging', root_url=seeking_alpha)
+    investments.query.session.expire_all()
+    filled = emerging_investments(investments)
+
+    assert filled['EEM'].expense_ratio == pytest.approx(0.007)
+    assert filled['EEM'].dividend_yield == pytest.approx(0.021)
@@ -0,0 +1,25 @@
+from db import db, embedded, migrations
+from db.factor_return import FactorReturn
+import sqlalchemy
+
+def test_adds_the_columns_an_older_db_is_missing(tmp_path, database, monkeypatch):
+    # The schema from before momentum
+    with open(embedded.SQL_FILENAMES[0]) as sql_file:
+        structure = sql_file.read().replace(', winners_minus_losers numeric\n', '')
+    (tmp_path / '00_structure.sql').write_text(structure)
+    older_engine = sqlalchemy.create_engine(f'sqlite:///{tmp_path / "older.db"}')
+    embedded.apply_sql_files(older_engine, [tmp_path / '00_structure.sql', embedded.SQL_FILENAMES[1]])
+    older_engine.dispose()
+
+    db.Session.remove()
+    db.engine().dispose()
+    db.engine.cache_clear()
+    monkeypatch.setattr(db, 'DATABASE_URL', f'sqlite:///{tmp_path / "older.db"}')
+    columns = [column['name'] for column in sqlalchemy.inspect(db.engine()).get_columns('factor_returns')]
+    assert 'winners_minus_losers' in columns
+    assert db.Session().query(FactorReturn).all() == []
+    # And only once
+    assert migrations.migrate(db.engine()) == []
+
+def test_leaves_a_new_db_as_it_is(database):
+    assert migrations.migrate(database) == []
@@ -0,0 +1,53 @@
+from lib import model_suite
+from lib.factor_regression import FIVE_FACTORS, INTERCEPT
+import numpy as np
+import pandas as pd
+import pytest
+
+def factor_returns(months=60, momentum_starts_at=0):
+    """
+    @param [int] momentum_starts_at The first month with momentum, like Ken
+        French's momentum files, which start later than the five factors
+    """
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        rng.normal(0, 0.04, (months, len(FIVE_FACTORS) + 1)),
+        index=pd.date_range('2010-01-31', periods=months, freq='M'),
+        columns=FIVE_FACTORS + [model_suite.MOMENTUM]
+    )
+    df.iloc[:momentum_starts_at, -1] = np.nan
+    return df.assign(risk_free=0.001)
+
+def excess_returns(factor_data):
+    rng = np.random.default_rng(1)
+    loadings = rng.normal(0.5, 0.3, (len(FIVE_FACTORS) + 1, 3))
+    values = np.matmul(factor_data[FIVE_FACTORS + [model_suite.MOMENTUM]].fillna(0).to_numpy(), loadings)
+    return pd.DataFrame(values + rng.normal(0, 0.01, values.shape), index=factor_data.index, columns=['AAA', 'BBB', 'CCC'])
+
+def test_skips_the_momentum_models_without_momentum():
+    factor_data = factor_returns(momentum_starts_at=60)
+    assert list(model_suite.available_models(factor_data)) == ['three_factor', 'five_factor']
+
+    results = model_suite.fit_models(excess_returns(factor_data), factor_data)
+    assert list(results.params) == ['three_factor', 'five_factor']
+    assert model_suite.MOMENTUM not in results.params['five_factor'].columns
+    assert list(results.summary().index) == ['three_factor', 'five_factor']
+
+def test_skips_the_momentum_models_without_the_column():
+    factor_data = factor_returns().drop(columns=[model_suite.MOMENTUM])
+    assert list(model_suite.available_models(factor_data)) == ['three_factor', 'five_factor']
+
+def test_fits_momentum_over_the_months_that_have_it():
+    factor_data = factor_returns(momentum_starts_at=12)
+    returns = excess_returns(factor_data)
+    results = model_suite.fit_models(returns, factor_data)
+    assert list(results.params) == list(model_suite.MODELS)
+    assert results.nobs.carhart.tolist() == [48] * 3
+    assert results.nobs.five_factor.tolist() == [60] * 3
+
+    # The same coefficients as a least squares fit of just those months
+    months = factor_data.index[12:]
+    X = np.column_stack([np.ones(len(months)), factor_data.loc[months, model_suite.MODELS['carhart']]])
+    expected, *_ = np.linalg.lstsq(X, returns.loc[months].to_numpy(), rcond=None)
+    terms = [INTERCEPT] + model_suite.MODELS['carhart']
+    assert results.params['carhart'][terms].to_numpy() == pytest.approx(expected.T)
@@ -0,0 +1,131 @@
+from datetime import date
+from lib.investment_returns import InvestmentReturns
+from lib.returns_backfiller import RateLimiter, ReturnsBackfiller
+import pandas as pd
+from pandas_datareader._utils import RemoteDataError
+import requests
+import threading
+
+START = date(2020, 1, 1)
+END = date(2020, 6, 30)
+MONTHS = list(pd.date_range(START, END, freq='M').date)
+
+def returns(ticker_symbol, start, end):
+    """
+    Like `InvestmentReturns.get_percentage_change_data`, a return at the end of
+    each month from start through end.
+    """
+    occurred_ats = pd.date_range(start, end, freq='M').date
+    return pd.DataFrame({
+        'percentage_change': [0.01] * len(occurred_ats),
+        'ticker_symbol': ticker_symbol,
+        'occurred_at': occurred_ats
+    })
+
+def months_stored(ticker_symbol):
+    """
+    @return [int] The count of months from START through END with a return in the DB
+    """
+    return InvestmentReturns.fetch_panel([ticker_symbol], MONTHS)[ticker_symbol].count()
+
+class FakePriceSource:
+    """
+    Stands in for the Yahoo API: raises each ticker's scripted errors, one
+    per call, and then returns its prices.
+    """
+    def __init__(self, errors=None, empty=()):
+        """
+        @param [dict] errors For each ticker symbol, the exceptions to raise on its first calls [list]
+        @param [tuple] empty The ticker symbols with no prices
+        """
+        self.errors = {ticker_symbol: list(raised) for ticker_symbol, raised in (errors or {}).items()}
+        self.empty = empty
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, ticker_symbol, start, end):
+        with self.lock:
+            self.calls.append(ticker_symbol)
+            raised = self.errors.get(ticker_symbol)
+            error = raised.pop(0) if raised else None
+        if error is not None:
+            raise error
+        if ticker_symbol in self.empty:
+            return returns(ticker_symbol, start, start)
+        return returns(ticker_symbol, start, end)
+
+def backfiller(price_source, sleeps, **kwargs):
+    return ReturnsBackfiller(
+        price_source=price_source,
+        workers=4,
+        requests_per_second=10**6,
+        write_batch_size=2,
+        sleep=sleeps.append,
+        **kwargs
+    )
+
+def test_backfills_every_ticker(database):
+    price_source = FakePriceSource()
+    skipped = backfiller(price_source, []).run(['AAA', 'BBB', 'CCC'], START, END)
+
+    assert skipped == {}
+    assert sorted(price_source.calls) == ['AAA', 'BBB', 'CCC']
+    panel = InvestmentReturns.fetch_panel(['AAA', 'BBB', 'CCC'], pd.date_range(START, END, freq='M').date)
+    assert panel.notna().all().all()
+    assert len(panel) == 6
+
+def test_retries_with_exponential_backoff(database):
+    price_source = FakePriceSource(errors={'AAA': [
+        RemoteDataError('Unable to read URL'),
+        requests.exceptions.ConnectionError('Connection reset')
+    ]})
+    sleeps = []
+    skipped = backfiller(price_source, sleeps, retries=3, backoff=1).run(['AAA'], START, END)
+
+    assert skipped == {}
+    assert price_source.calls == ['AAA', 'AAA', 'AAA']
+    assert sleeps == [1, 2]
+    assert months_stored('AAA') == 6
+
+def test_skips_tickers_out_of_retries(database):
+    price_source = FakePriceSource(errors={'AAA': [RemoteDataError('Unable to read URL')] * 3})
+    sleeps = []
+    skipped = backfiller(price_source, sleeps, retries=2, backoff=0.5).run(['AAA', 'BBB'], START, END)
+
+    assert list(skipped) == ['AAA']
+    assert skipped['AAA'].startswith('RemoteDataError')
+    assert price_source.calls.count('AAA') == 3
+    assert sleeps == [0.5, 1]
+    assert months_stored('AAA') == 0
+    assert months_stored('BBB') == 6
+
+def test_skips_tickers_without_retrying_other_errors(database):
+    price_source = FakePriceSource(errors={'AAA': [KeyError('Date')]}, empty=('BBB',))
+    sleeps = []
+    skipped = backfiller(price_source, sleeps).run(['AAA', 'BBB', 'CCC'], START, END)
+
+    assert skipped == {'AAA': "KeyError: 'Date'", 'BBB': 'No price data in the Yahoo API'}
+    assert price_source.calls.count('AAA') == 1
+    assert sleeps == []
+
+def test_only_downloads_the_missing_months(database):
+    InvestmentReturns.write(returns('AAA', START, date(2020, 3, 31)))
+    calls = []
+    def price_source(ticker_symbol, start, end):
+        calls.append((ticker_symbol, start, end))
+        return returns(ticker_symbol, start, end)
+    backfiller(price_source, []).run(['AAA'], START, END)
+
+    assert calls == [('AAA', date(2020, 3, 1), END)]
+    assert months_stored('AAA') == 6
+
+def test_rate_limiter_spaces_out_calls():
+    now = [0.0]
+    sleeps = []
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+    rate_limiter = RateLimiter(4, clock=lambda: now[0], sleep=sleep)
+    for _ in range(3):
+        rate_limiter.wait()
+    assert sleeps == [0.25, 0.25]
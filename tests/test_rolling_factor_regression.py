@@ -0,0 +1,52 @@
+from lib import factor_regression, rolling_factor_regression
+import numpy as np
+import pandas as pd
+import pytest
+
+def panel(months=60):
+    rng = np.random.default_rng(1)
+    index = pd.date_range('2015-01-31', periods=months, freq='M')
+    factor_returns = pd.DataFrame(
+        rng.normal(0, 0.04, (months, len(factor_regression.FIVE_FACTORS))),
+        index=index,
+        columns=factor_regression.FIVE_FACTORS
+    )
+    # Two factors that move together for the first year and a half
+    factor_returns.iloc[:18, 2] = factor_returns.iloc[:18, 1]
+
+    excess_returns = pd.DataFrame(
+        np.matmul(factor_returns.to_numpy(), rng.normal(0.5, 0.3, (5, 3))) + rng.normal(0, 0.01, (months, 3)),
+        index=index,
+        columns=['FULL', 'GAPS', 'EARLY']
+    )
+    excess_returns.iloc[[5, 6, 20, 33, 34, 35, 50], 1] = np.nan
+    # Only returns in months where the two factors move together, so once
+    # the window slides past the start, it can't tell them apart
+    excess_returns.iloc[16:, 2] = np.nan
+    return excess_returns, factor_returns
+
+@pytest.mark.parametrize('window, step', [(12, 1), (12, 5), (8, 10)])
+def test_matches_fitting_each_window_from_scratch(window, step):
+    excess_returns, factor_returns = panel()
+    results = rolling_factor_regression.fit_rolling(excess_returns, factor_returns, window=window, step=step, min_observations=7)
+    df = results.to_data_frame()
+
+    for window_end, occurred_at in zip(range(window - 1, len(factor_returns), step), results.occurred_ats):
+        months = slice(window_end - window + 1, window_end + 1)
+        expected = factor_regression.fit(excess_returns.iloc[months], factor_returns.iloc[months])
+        for ticker in excess_returns.columns:
+            row = df.loc[(ticker, occurred_at)]
+            assert row.nobs == expected.nobs[ticker]
+            if expected.nobs[ticker] < 7:
+                assert row[expected.params.columns].isna().all()
+            else:
+                assert row[expected.params.columns].to_numpy() == pytest.approx(expected.params.loc[ticker].to_numpy(), rel=10**-6, abs=10**-9)
+
+def test_falls_back_to_the_pseudo_inverse_where_a_window_cant_tell_factors_apart():
+    excess_returns, factor_returns = panel()
+    df = rolling_factor_regression.fit_rolling(excess_returns, factor_returns, window=12, min_observations=7).to_data_frame()
+    early = df.loc['EARLY'].dropna()
+    # Every window from the first through the one with 7 months left
+    assert len(early) == 10
+    # The least squares solution of least length splits the loading evenly
+    assert early.small_minus_big.to_numpy() == pytest.approx(early.high_minus_low.to_numpy())
@@ -0,0 +1,80 @@
+from lib import sharpe_ratio_solver
+import numpy as np
+import pandas as pd
+from scipy import optimize
+import time
+
+def funds(count=60):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        rng.normal(0.1, 0.3, (count, 4)).round(3),
+        columns=sharpe_ratio_solver.RELEVANT_COLUMNS,
+        index=[f'F{i:02}' for i in range(count)]
+    )
+    return df.assign(mmrf=1.0, expense_ratio=0.005, dividend_yield=0.02)
+
+def samples(df, count=10):
+    # Like experiment_with_shuffling's
+    return [df.sample(frac=0.8, random_state=np.random.PCG64(seed)).index for seed in np.random.SeedSequence(0).spawn(count)]
+
+def baseline_allocations(df):
+    """
+    How choose_best solved before it had the covariance root and gradients:
+    SLSQP on the dense covariance matrix, with finite differences.
+    """
+    factors = np.asarray(df[sharpe_ratio_solver.RELEVANT_COLUMNS])
+    factor_means = np.mean(factors, axis = 1)
+    factor_var_covar_matrix = np.cov(factors, bias=True)
+    result = optimize.minimize(
+        lambda x: -np.matmul(factor_means, x.T) / (1 + np.sqrt(np.matmul(np.matmul(x, factor_var_covar_matrix), x.T))),
+        x0 = np.repeat(0.33, len(factor_means)),
+        method = 'SLSQP',
+        bounds = tuple([(0, 1) for _ in factor_means]),
+        constraints = ({'type': 'eq', 'fun': lambda x: np.sum(x) - 1}),
+        tol = 10**-2
+    )
+    return np.round(result.x, 3)
+
+def test_chooses_the_same_allocations_as_the_baseline():
+    df = funds()
+    for sample in [df.index] + samples(df, 5):
+        chosen_summarizer = sharpe_ratio_solver.choose_best(df.loc[sample].copy())
+        allocation = chosen_summarizer.chosen.allocation.reindex(sample, fill_value=0)
+        assert list(allocation) == list(baseline_allocations(df.loc[sample]))
+        # With the exact gradient, instead of a finite difference per fund
+        assert chosen_summarizer.solver_result.nfev < 20
+
+def test_per_sample_and_batched_choose_the_same_funds():
+    df = funds()
+    batched = sharpe_ratio_solver.choose_best_of_samples(df, samples(df))
+    for sample, chosen_summarizer in zip(samples(df), batched):
+        per_sample = sharpe_ratio_solver.choose_best(
+            df.loc[sample].copy(),
+            solver=sharpe_ratio_solver.maximize_sharpe_ratio_by_projected_gradient
+        )
+        assert per_sample.chosen.allocation.to_dict() == chosen_summarizer.chosen.allocation.to_dict()
+        assert abs(per_sample.solver_result.fun - chosen_summarizer.solver_result.fun) < 10**-9
+
+def test_skips_samples_that_are_too_small():
+    df = funds()
+    chosen_summarizers = sharpe_ratio_solver.choose_best_of_samples(df, [df.index[:0], df.index[:1], df.index[:10]])
+    assert chosen_summarizers[:2] == [(0, 0, 0), (0, 0, 0)]
+    assert chosen_summarizers[2].chosen.allocation.sum() > 0.99
+
+def test_solves_many_samples_per_second():
+    df = funds()
+    started_at = time.perf_counter()
+    sharpe_ratio_solver.choose_best_of_samples(df, samples(df, 1000))
+    batched_rate = 1000 / (time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    for sample in samples(df, 50):
+        sharpe_ratio_solver.choose_best(
+            df.loc[sample].copy(),
+            solver=sharpe_ratio_solver.maximize_sharpe_ratio_by_projected_gradient
+        )
+    per_sample_rate = 50 / (time.perf_counter() - started_at)
+
+    # About 750 and 70 per second on one core
+    assert batched_rate > 200
+    assert batched_rate > 4 * per_sample_rate
@@ -0,0 +1,63 @@
+from datetime import date
+from db.db import Session
+from db.factor_return import FactorReturn
+from db.investment_return import InvestmentReturn
+from lib.factor_returns import FactorReturns
+from lib.investment_returns import InvestmentReturns
+from lib.snapshot_cache import SnapshotCache
+import os
+import pandas as pd
+import pytest
+
+def data_frame():
+    return pd.DataFrame({'a': [1.0, 2.0]}, index=pd.Index([date(2021, 10, 31), date(2021, 11, 30)], name='occurred_at'))
+
+def test_a_second_writer_of_the_same_snapshot_succeeds(tmp_path):
+    snapshot_cache = SnapshotCache(tmp_path)
+    path = snapshot_cache.path('factor_returns/Emerging', '1-2-3')
+    snapshot_cache.write(path, data_frame())
+    # Like another process that loaded the same version before the first wrote it
+    snapshot_cache.write(path, data_frame())
+    assert snapshot_cache.read(path).equals(data_frame())
+    assert os.listdir(os.path.dirname(path)) == ['1-2-3']
+
+def factor_returns():
+    return pd.DataFrame({
+        'occurred_at': [date(2021, 10, 31), date(2021, 11, 30)],
+        'risk_free': [0.001, 0.001],
+        'market_minus_risk_free': [0.01, -0.02],
+        'small_minus_big': [0.02, 0.005],
+        'high_minus_low': [0.03, 0.0025],
+        'robust_minus_weak': [0.04, 0.0025],
+        'conservative_minus_aggressive': [0.05, 0.0075],
+        'winners_minus_losers': [None, 0.025]
+    })
+
+def test_a_factor_return_updated_in_place_changes_the_version(database):
+    FactorReturns.sync('Emerging', factor_returns())
+    assert FactorReturns.fetch_snapshot('Emerging').small_minus_big.tolist() == [0.02, 0.005]
+
+    # Not through sync, so nothing invalidates the snapshot, like a sync from
+    # another machine
+    version = FactorReturns.data_version('Emerging')
+    Session().query(FactorReturn).filter(FactorReturn.occurred_at == date(2021, 11, 30)).update({'small_minus_big': 0.006})
+    Session().commit()
+    assert FactorReturns.data_version('Emerging') != version
+    assert FactorReturns.fetch_snapshot('Emerging').small_minus_big.tolist() == [0.02, 0.006]
+
+def test_swapped_factor_returns_change_the_version(database):
+    FactorReturns.sync('Emerging', factor_returns())
+    version = FactorReturns.data_version('Emerging')
+    for occurred_at, value in [(date(2021, 10, 31), 0.005), (date(2021, 11, 30), 0.02)]:
+        Session().query(FactorReturn).filter(FactorReturn.occurred_at == occurred_at).update({'small_minus_big': value})
+    Session().commit()
+    assert FactorReturns.data_version('Emerging') != version
+
+def test_an_investment_return_updated_in_place_changes_the_version(database):
+    months = [date(2021, 10, 31), date(2021, 11, 30)]
+    InvestmentReturns.write(pd.DataFrame({'ticker_symbol': ['EEM', 'EEM'], 'occurred_at': months, 'percentage_change': [0.01, 0.02]}))
+    assert InvestmentReturns.fetch_panel_snapshot(['EEM'], months).EEM.tolist() == [0.01, 0.02]
+
+    Session().query(InvestmentReturn).filter(InvestmentReturn.occurred_at == months[1]).update({'percentage_change': 0.03})
+    Session().commit()
+    assert InvestmentReturns.fetch_panel_snapshot(['EEM'], months).EEM.tolist() == pytest.approx([0.01, 0.03])